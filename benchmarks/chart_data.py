@@ -0,0 +1,103 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare bytes on the wire and repeat-interaction latency of charts with inline data versus content-addressed data urls
+Usage: python benchmarks/chart_data.py [--passes=<n>] [--mbps=<n>]
+
+Run from the repository root. A scripted session drags the year slider back
+and forth, highlights a few CMAs and changes the trends locations. The
+browser is simulated: callback responses are gzipped (as Dash does by
+default), and data urls are fetched through the Flask test client once, then
+served from the browser cache. Latency is server time plus the transfer time
+at --mbps.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+
+os.environ.setdefault("WARMUP", "0")
+os.environ.setdefault("DATA_URL_DIR", tempfile.mkdtemp(prefix="crime-data-urls-"))
+warnings.simplefilter("ignore", FutureWarning)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import app
+import tab1
+
+
+DATA_URL = re.compile(r'"url": "(/data/[0-9a-f]+\.json)"')
+
+
+def session(index, passes):
+    metrics = index.unique("Metric")
+    violations = index.unique("Level1 Violation Flag")
+    cmas = sorted(index.unique("Geography", where=("Geo_Level", ["CMA"])))
+    selection = (metrics[0], violations[0], "All")
+    years = list(range(tab1.END_YEAR, tab1.START_YEAR - 1, -1))
+
+    events = []
+    for i in range(passes):
+        for year in (years if i % 2 == 0 else years[::-1]):
+            events.append((app.generate_cma_barplot, selection + (year, None)))
+        for cma in cmas[:4]:
+            events.append((app.generate_cma_barplot, selection + (tab1.END_YEAR, cma.split(",")[0])))
+        for n in (3, 6, 12, len(cmas)):
+            events.append((app.generate_time_plots, (cmas[:n], "CMA")))
+    return events
+
+
+def run(mode, events, mbps):
+    """Replay a session, returns bytes sent per interaction and latency in ms for first and repeat interactions"""
+    app.CHART_DATA = mode
+    app.RENDER_CACHE.clear()
+    client = app.server.test_client()
+    browser_cache = set()
+    seen = set()
+    first, repeat = [], []
+    sizes = []
+    for func, args in events:
+        start = time.perf_counter()
+        html = func.__wrapped__(*args)
+        body = gzip.compress(json.dumps({"response": {"srcDoc": html}}).encode())
+        sent = len(body)
+        for url in DATA_URL.findall(html):
+            if url not in browser_cache:
+                response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+                assert response.status_code == 200
+                sent += len(response.data)
+                browser_cache.add(url)
+        elapsed = (time.perf_counter() - start) + sent * 8 / (mbps * 1e6)
+        sizes.append(sent)
+        key = (func.__name__,) + tuple(map(str, args))
+        (repeat if key in seen else first).append(elapsed * 1000)
+        seen.add(key)
+    return sizes, first, repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--passes", type=int, default=4)
+    parser.add_argument("--mbps", type=float, default=10, help="simulated bandwidth")
+    args = parser.parse_args()
+
+    events = session(app.DATASET.get().index, args.passes)
+    run("url", events[:2], args.mbps)
+
+    print("{} interactions, {:.0f} Mbit/s".format(len(events), args.mbps))
+    for mode in ("inline", "url"):
+        sizes, first, repeat = run(mode, events, args.mbps)
+        print("{:<7} sent {:8.1f} kB ({:5.1f} kB per interaction)   first p50 {:7.1f} ms   repeat p50 {:6.1f} ms   p95 {:6.1f} ms".format(
+            mode, sum(sizes) / 1024, statistics.mean(sizes) / 1024, statistics.median(first),
+            statistics.median(repeat), statistics.quantiles(repeat, n=20)[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Stress test generate_choropleth under parallel requests and measure per-request allocation
+Usage: python benchmarks/choropleth_concurrency.py [--threads=<n>] [--requests=<n>]
+
+Each request serializes its response like Dash does and checks that the values
+in it are the ones for its own year. The legacy approach of writing values into
+the shared geojson and the deep-copy alternative are run for comparison.
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("WARMUP", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import plotly
+import app
+import tab1
+
+
+METRIC = "Rate per 100,000 population"
+VIOLATION = "Total violent Criminal Code violations"
+
+
+def current(year):
+    """The callback as it is now: values in hideout, geometry never touched"""
+    outputs = app.generate_choropleth.__wrapped__(METRIC, VIOLATION, "All", year, "PROVINCE")
+    payload = json.loads(json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder))
+    return payload[0]["values"]
+
+
+def legacy(year, geojson):
+    """Values written into one geojson dict shared by every request"""
+    values = app.map_values(METRIC, VIOLATION, "All", year, "PROVINCE")
+    for location in geojson['features']:
+        location['properties']['Value'] = values.get(location['properties']['PRENAME'])
+    time.sleep(0)  # let other threads run between the write and the serialization, as in a real request
+    payload = json.loads(json.dumps(geojson))
+    return {f['properties']['PRENAME']: f['properties']['Value'] for f in payload['features']
+            if f['properties']['Value'] is not None}
+
+
+def deep_copy(year, geojson):
+    """Values written into a private deep copy of the geojson"""
+    geojson = copy.deepcopy(geojson)
+    return legacy(year, geojson)
+
+
+def stress(name, func, threads, n_requests):
+    years = [random.randint(tab1.START_YEAR, tab1.END_YEAR) for _ in range(n_requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(func, years))
+    elapsed = time.perf_counter() - start
+    names = {f['properties']['PRENAME'] for f in app.import_map()['features']}
+    wrong = 0
+    for year, values in zip(years, results):
+        want = {k: v for k, v in app.map_values(METRIC, VIOLATION, "All", year, "PROVINCE").items() if k in names}
+        if {k: values.get(k) for k in want} != want:
+            wrong += 1
+    print("{:<12} {:5d} requests on {:2d} threads   {:5d} wrong   {:7.2f} ms/request".format(
+        name, n_requests, threads, wrong, elapsed / n_requests * 1000))
+
+
+def allocation(name, func, n_requests=20):
+    tracemalloc.start()
+    peaks = []
+    for year in range(n_requests):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func(tab1.END_YEAR - year % 20)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    print("{:<12} peak allocation per request {:10.1f} kB".format(name, sum(peaks) / len(peaks) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    shared = app.import_map()
+    stress("current", current, args.threads, args.requests)
+    stress("legacy", lambda year: legacy(year, shared), args.threads, args.requests)
+    stress("deep copy", lambda year: deep_copy(year, shared), args.threads, args.requests // 10)
+
+    # Serialization of the response is common to every approach, so only the
+    # work done before handing the response to Dash is traced
+    allocation("current", lambda year: app.generate_choropleth.__wrapped__(METRIC, VIOLATION, "All", year, "PROVINCE"))
+    allocation("deep copy", lambda year: copy.deepcopy(shared))
+
+
+if __name__ == '__main__':
+    main()
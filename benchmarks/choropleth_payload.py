@@ -0,0 +1,77 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare choropleth update responses with geometry in every response against values-only updates
+Usage: python benchmarks/choropleth_payload.py [--repeat=<n>]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("WARMUP", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dash_leaflet as dl
+import plotly
+import app
+import geometry
+import tab1
+
+
+METRIC = "Rate per 100,000 population"
+VIOLATION = "Total violent Criminal Code violations"
+
+
+def with_geometry(year, level):
+    """Response of the callback when it returned the whole map layer on every update"""
+    hideout, colorscale, vmin, vmax = app.generate_choropleth.__wrapped__(METRIC, VIOLATION, "All", year, "PROVINCE")
+    geojson = json.loads(app.MAP_PAYLOADS["provinces"][level])
+    children = [
+        dl.TileLayer(),
+        dl.GeoJSON(data=geojson, id="provinces", hideout=hideout),
+        dl.Colorbar(colorscale=colorscale, id="colorbar", width=20, height=150, min=vmin, max=vmax, position="bottomleft")
+    ]
+    return {"response": {"choropleth": {"children": children}}, "multi": True}
+
+
+def values_only(year, level):
+    """Response of the callback now that the geometry is a static layer"""
+    hideout, colorscale, vmin, vmax = app.generate_choropleth.__wrapped__(METRIC, VIOLATION, "All", year, "PROVINCE")
+    return {"response": {"provinces": {"hideout": hideout},
+                         "colorbar": {"colorscale": colorscale, "min": vmin, "max": vmax}}, "multi": True}
+
+
+def measure(build, level, repeat):
+    sizes, times = [], []
+    for _ in range(repeat):
+        for year in range(tab1.START_YEAR, tab1.END_YEAR + 1):
+            start = time.perf_counter()
+            body = json.dumps(build(year, level), cls=plotly.utils.PlotlyJSONEncoder)
+            times.append(time.perf_counter() - start)
+            sizes.append(len(body))
+    return statistics.mean(sizes), statistics.median(times), sorted(times)[int(len(times) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("{:<22} {:<7} {:>14} {:>10} {:>10}".format("mode", "level", "response B", "p50 ms", "p95 ms"))
+    for level in [name for name, *_ in geometry.LEVELS] + ["full"]:
+        for name, build in [("geometry every update", with_geometry), ("values only", values_only)]:
+            size, p50, p95 = measure(build, level, args.repeat)
+            print("{:<22} {:<7} {:>14.0f} {:>10.2f} {:>10.2f}".format(name, level, size, p50 * 1000, p95 * 1000))
+
+    client = app.server.test_client()
+    geometry_bytes = len(client.get(geometry.geometry_url("provinces", geometry.level_for_zoom(tab1.MAP_ZOOM))).data)
+    print("static geometry fetched once per page: {} B".format(geometry_bytes))
+
+
+if __name__ == '__main__':
+    main()
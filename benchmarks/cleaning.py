@@ -0,0 +1,89 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Check the vectorized wrangling against the original loop-and-regex version and compare their speed
+Usage: python benchmarks/cleaning.py [--source=<path>] [--scales=<n> ...] [--repeat=<n>]
+
+The source is enlarged synthetically by stacking copies of it, with every copy
+after the first shifted to new years so that rows stay distinct. The
+outputs are compared on a small extract in tests/test_cleaning.py too.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import crime_data
+
+
+def legacy_clean_data(data):
+    """`clean_data` as it was before vectorization, the reference output of tests/test_cleaning.py"""
+    data = data.dropna()
+    data.replace(r" \[.*\]", "", regex=True, inplace=True)
+    data.loc[data["Geography"] == "Prince Edward Island", "Geo_Level"] = data["Geo_Level"].replace("CMA", "PROVINCE")
+    data['Geography'].replace(r"\?", "e", regex=True, inplace=True)
+
+    # Remove total col
+    data = data[data['Level1 Violation Flag'] != "Total, all violations"]
+
+    # Change subcategory name to All for totals
+    for name in data['Level1 Violation Flag'].unique():
+        data['Violation Description'].replace(name, "All", inplace=True)
+
+    # Separate 'Geography' into Province and CMA
+    data[['CMA','Province']]=data['Geography'].str.extract(r'(?P<CMA>^.*)\,(?P<Province>.*$)')
+    data.loc[(data["Geo_Level"] == "PROVINCE"),'Province'] = data.loc[(data["Geo_Level"] == "PROVINCE"),'Geography']
+
+    return data
+
+
+def enlarge(data, scale):
+    """Stack `scale` copies of the raw data"""
+    copies = []
+    span = int(data["Year"].max() - data["Year"].min() + 1)
+    for i in range(scale):
+        copy = data.copy()
+        copy["Year"] += i * span
+        if "REF_DATE" in copy:
+            copy["REF_DATE"] += i * span
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def best_of(repeat, func, raw):
+    times = []
+    for _ in range(repeat):
+        # both versions modify their input in place
+        frame = raw.copy()
+        start = time.perf_counter()
+        result = func(frame)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--source", default=crime_data.TSV_PATH)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    raw = crime_data.read_tsv(args.source)
+    pd.options.mode.chained_assignment = None
+    for scale in args.scales:
+        data = enlarge(raw, scale)
+        t_legacy, expected = best_of(args.repeat, legacy_clean_data, data)
+        t_vector, result = best_of(args.repeat, crime_data.clean_data, data)
+        pd.testing.assert_frame_equal(expected, result)
+        print("{:>4}x {:>10} rows   legacy {:9.1f} ms   vectorized {:9.1f} ms   speedup {:5.1f}x   identical output".format(
+            scale, len(data), t_legacy * 1000, t_vector * 1000, t_legacy / t_vector))
+
+
+if __name__ == '__main__':
+    main()
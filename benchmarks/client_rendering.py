@@ -0,0 +1,162 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare server CPU, bytes sent and interaction latency of one scripted session with server-side and client-side chart rendering
+Usage: python benchmarks/client_rendering.py [--repeat=<n>]
+
+Run from the repository root. Renders are timed without the render cache, as
+for a session exploring states nobody asked for before. Client-side latency
+is the time of the functions in src/assets/charts.js under node (needs `node`
+on the PATH); drawing the chart in the iframe costs the same in both modes and
+is not included.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+os.environ.setdefault("WARMUP", "0")
+warnings.simplefilter("ignore", FutureWarning)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import app
+import tab1
+
+
+NODE_TIMER = """
+global.window = {dash_clientside: {no_update: null}};
+require(process.argv[1]);
+const charts = window.dash_clientside.crimeDashboard;
+const session = require(process.argv[2]);
+const repeat = Number(process.argv[3]);
+const times = session.events.map(function(event) {
+    const data = session.payloads[event.payload];
+    const samples = [];
+    for (let r = 0; r < repeat; ++r) {
+        const start = process.hrtime.bigint();
+        if (event.chart === "barplot") {
+            charts.cmaBarplot(data, event.year, event.highlight);
+        } else {
+            charts.crimeTrends(data, event.locations);
+        }
+        samples.push(Number(process.hrtime.bigint() - start) / 1e6);
+    }
+    samples.sort(function(a, b) { return a - b; });
+    return samples[Math.floor(repeat / 2)];
+});
+console.log(JSON.stringify(times));
+"""
+
+
+def session_events(index):
+    """Interactions of one visit: a slider drag, a few highlighted CMAs, other violations, then the trends tab"""
+    metrics = index.unique("Metric")
+    violations = index.unique("Level1 Violation Flag")
+    cmas = sorted(index.unique("Geography", where=("Geo_Level", ["CMA"])))
+    provinces = sorted(index.unique("Geography", where=("Geo_Level", ["PROVINCE"])))
+    selection = (metrics[0], violations[0], "All")
+
+    events = [dict(chart="barplot", selection=selection, year=year, highlight=None)
+              for year in range(tab1.END_YEAR, tab1.START_YEAR - 1, -1)]
+    events += [dict(chart="barplot", selection=selection, year=tab1.END_YEAR, highlight=cma.split(",")[0])
+               for cma in cmas[:5]]
+    events += [dict(chart="barplot", selection=(metrics[0], violation, "All"), year=tab1.END_YEAR, highlight=None)
+               for violation in violations[1:]]
+    events += [dict(chart="trends", geo_level="PROVINCE", locations=provinces[:3])]
+    events += [dict(chart="trends", geo_level="CMA", locations=cmas[:n]) for n in (3, 6, 12, len(cmas))]
+    return events
+
+
+def timed(func, *args):
+    start_cpu, start = time.process_time(), time.perf_counter()
+    result = func(*args)
+    # Dash serializes callback outputs to JSON before sending them
+    body = json.dumps(result)
+    return time.process_time() - start_cpu, time.perf_counter() - start, len(body)
+
+
+def server_mode(events):
+    barplot = app.generate_cma_barplot.__wrapped__.__wrapped__
+    trends = app.generate_time_plots.__wrapped__.__wrapped__
+    cpu = sent = 0
+    latencies = []
+    for event in events:
+        if event["chart"] == "barplot":
+            t_cpu, t_wall, size = timed(barplot, *event["selection"], event["year"], event["highlight"])
+        else:
+            t_cpu, t_wall, size = timed(trends, event["locations"], event["geo_level"])
+        cpu += t_cpu
+        sent += size
+        latencies.append(t_wall * 1000)
+    return cpu, sent, latencies
+
+
+def client_mode(events, repeat):
+    barplot_data = app.cma_barplot_data.__wrapped__
+    trends_data = app.crime_trends_data.__wrapped__
+    cpu = sent = 0
+    payloads, keys = [], {}
+    for event in events:
+        # the data store callback only fires when the selection behind it changes
+        key = (event["chart"],) + (event["selection"] if event["chart"] == "barplot" else (event["geo_level"],))
+        if key not in keys:
+            if event["chart"] == "barplot":
+                t_cpu, _, size = timed(barplot_data, *event["selection"])
+                payloads.append(barplot_data(*event["selection"]))
+            else:
+                t_cpu, _, size = timed(trends_data, event["geo_level"])
+                payloads.append(trends_data(event["geo_level"]))
+            keys[key] = len(payloads) - 1
+            cpu += t_cpu
+            sent += size
+        event["payload"] = keys[key]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"events": [{k: v for k, v in e.items() if k != "selection"} for e in events],
+                   "payloads": payloads}, f)
+    try:
+        out = subprocess.run(["node", "-e", NODE_TIMER, os.path.abspath(os.path.join(ROOT, "src", "assets", "charts.js")),
+                              f.name, str(repeat)], capture_output=True, text=True, check=True)
+        latencies = json.loads(out.stdout)
+    except FileNotFoundError:
+        latencies = None
+    finally:
+        os.unlink(f.name)
+    return cpu, sent, latencies, len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=21)
+    args = parser.parse_args()
+
+    events = session_events(app.DATASET.get().index)
+    # load altair and the lazy imports before timing
+    server_mode(events[:1])
+
+    cpu, sent, latencies = server_mode(events)
+    print("{} interactions".format(len(events)))
+    print("server  CPU {:8.1f} ms   sent {:8.1f} kB   {:>2} requests   latency p50 {:7.2f} ms   p95 {:7.2f} ms".format(
+        cpu * 1000, sent / 1024, len(events), statistics.median(latencies),
+        statistics.quantiles(latencies, n=20)[-1]))
+
+    cpu, sent, latencies, requests = client_mode(events, args.repeat)
+    line = "client  CPU {:8.1f} ms   sent {:8.1f} kB   {:>2} requests".format(cpu * 1000, sent / 1024, requests)
+    if latencies is None:
+        line += "   (node not found, no client latency)"
+    else:
+        line += "   latency p50 {:7.2f} ms   p95 {:7.2f} ms".format(
+            statistics.median(latencies), statistics.quantiles(latencies, n=20)[-1])
+    print(line)
+
+
+if __name__ == '__main__':
+    main()
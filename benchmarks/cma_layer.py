@@ -0,0 +1,73 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Report render payload of the CMA choropleth layer and hit-testing latency of the CMA spatial index
+Usage: python benchmarks/cma_layer.py [--points=<n>]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("WARMUP", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import numpy as np
+import plotly
+import app
+import tab1
+
+
+def brute_force(index, lon, lat):
+    """Point-in-polygon test against every CMA, what the index avoids"""
+    for name, rings, _, _ in index._features:
+        if index._contains(rings, lon, lat):
+            return name
+    return None
+
+
+def percentiles(times):
+    times = sorted(times)
+    return statistics.median(times) * 1e6, times[int(len(times) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("{:<8} {:>12} {:>12}".format("level", "json kB", "gzip kB"))
+    for level, payload in app.MAP_PAYLOADS["cma"].items():
+        print("{:<8} {:>12.1f} {:>12.1f}".format(level, len(payload) / 1024, len(gzip.compress(payload)) / 1024))
+
+    outputs = app.generate_choropleth.__wrapped__(
+        "Rate per 100,000 population", "Total violent Criminal Code violations", "All", tab1.END_YEAR, "CMA")
+    body = json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder)
+    print("values update with all {} CMAs: {} B".format(len(outputs[0]["values"]), len(body)))
+
+    index = app.CMA_INDEX
+    random.seed(0)
+    centres = [points.mean(axis=0) for _, _, _, points in index._features]
+    queries = [(random.uniform(-140, -52), random.uniform(42, 70)) for _ in range(args.points // 2)]
+    queries += [tuple(random.choice(centres) + np.random.normal(0, 0.2, 2)) for _ in range(args.points // 2)]
+
+    for name, lookup in [("grid index", lambda x, y: index.locate(x, y)),
+                         ("grid index, 10px snap", lambda x, y: index.locate(x, y, tolerance=0.05)),
+                         ("brute force", lambda x, y: brute_force(index, x, y))]:
+        times, hits = [], 0
+        for lon, lat in queries:
+            start = time.perf_counter()
+            hits += lookup(lon, lat) is not None
+            times.append(time.perf_counter() - start)
+        p50, p99 = percentiles(times)
+        print("{:<24} p50 {:8.1f} us   p99 {:8.1f} us   {} hits".format(name, p50, p99, hits))
+
+
+if __name__ == '__main__':
+    main()
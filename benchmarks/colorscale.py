@@ -0,0 +1,88 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare the precomputed colour scale with building viridis through matplotlib on every call
+Usage: python benchmarks/colorscale.py [--repeat=<n>]
+
+Import time and resident memory are measured in fresh interpreters, as a new
+gunicorn worker would pay them. The matplotlib path needs matplotlib installed.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import numpy as np
+import pandas as pd
+import colorscale
+
+
+IMPORT = """
+import resource, time
+start = time.perf_counter()
+{}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def legacy(values, num=13):
+    """Colour scale and classes as generate_choropleth built them with matplotlib"""
+    import matplotlib
+    from matplotlib import cm
+    vals = pd.Series(values)
+    classes = list(np.linspace(max(0, int(vals.min())), max(10, int(vals.max()) + 0.01), num=num))
+    viridis = cm.get_cmap('viridis', num)
+    colors = [matplotlib.colors.rgb2hex(viridis(i)) for i in range(viridis.N)]
+    return classes, colors[::-1]
+
+
+def current(values, num=13):
+    classes, _, _ = colorscale.class_breaks(values, num)
+    return classes, colorscale.palette('viridis', num, reverse=True)
+
+
+def cold_import(statement, repeat):
+    times, rss = [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", IMPORT.format(statement)], env=dict(os.environ, PYTHONPATH=SRC),
+                             capture_output=True, text=True, check=True)
+        elapsed, maxrss = out.stdout.split()
+        times.append(float(elapsed))
+        rss.append(int(maxrss))
+    return statistics.median(times) * 1000, statistics.median(rss) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = cold_import("import numpy, pandas", args.repeat)
+    for name, statement in [("matplotlib", "import numpy, pandas, matplotlib\nfrom matplotlib import cm"),
+                            ("colorscale", "import numpy, pandas, colorscale")]:
+        ms, mb = cold_import(statement, args.repeat)
+        print("{:<12} import {:7.1f} ms over numpy+pandas   max RSS {:6.1f} MB (+{:.1f} MB)".format(
+            name, ms - baseline[0], mb, mb - baseline[1]))
+
+    values = list(np.random.default_rng(0).uniform(0, 2000, 13))
+    assert legacy(values)[1] == current(values)[1]
+    assert np.allclose(legacy(values)[0], current(values)[0])
+    for name, func in [("matplotlib", legacy), ("colorscale", current)]:
+        times = []
+        for _ in range(200):
+            start = time.perf_counter()
+            func(values)
+            times.append(time.perf_counter() - start)
+        print("{:<12} per call {:8.1f} us".format(name, statistics.median(times) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
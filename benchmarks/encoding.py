@@ -0,0 +1,98 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare memory footprint and callback filter steps of the object-dtype dataframe against the integer-coded columns
+Usage: python benchmarks/encoding.py [--source=<path>] [--repeat=<n>]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import crime_data
+import query
+
+
+def string_masks(data, filters):
+    """Filter step as the callbacks used to do it: python string compares on object columns"""
+    mask = np.ones(len(data), dtype=bool)
+    for name, value in filters:
+        mask &= (data[name] == value).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def code_masks(table, filters):
+    """The same filter on integer codes, each value encoded once against the category dictionary"""
+    mask = np.ones(table.rows, dtype=bool)
+    for name, value in filters:
+        codes = table.encode(name, [value])
+        mask &= table.columns[name] == (codes[0] if codes.size else -1)
+    return np.flatnonzero(mask)
+
+
+def timed(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--source", default=crime_data.TSV_PATH)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    data = crime_data.clean_data(crime_data.read_tsv(args.source)).reset_index(drop=True)
+    table = crime_data.ColumnTable.from_frame(data)
+    index = query.QueryIndex(table)
+
+    print("{} rows".format(len(data)))
+    print("{:<24} {:>14} {:>14}".format("column", "object dtype", "coded"))
+    for name in data.columns:
+        print("{:<24} {:>11.1f} kB {:>11.1f} kB  {}".format(
+            name, data[name].memory_usage(deep=True, index=False) / 1024,
+            table.columns[name].nbytes / 1024, table.columns[name].dtype))
+    print("{:<24} {:>11.1f} kB {:>11.1f} kB".format(
+        "total", data.memory_usage(deep=True).sum() / 1024, table.nbytes / 1024))
+
+    metric = data["Metric"].iloc[0]
+    violation = data["Level1 Violation Flag"].iloc[0]
+    year = int(data["Year"].max())
+    steps = [
+        ("generate_cma_barplot", [("Metric", metric), ("Level1 Violation Flag", violation),
+                                  ("Violation Description", "All"), ("Year", year), ("Geo_Level", "CMA")],
+         lambda: index.slice_rows(metric, violation, "All", year, "CMA")),
+        ("map_values", [("Metric", metric), ("Level1 Violation Flag", violation),
+                        ("Violation Description", "All"), ("Year", year), ("Geo_Level", "PROVINCE")],
+         lambda: index.slice_rows(metric, violation, "All", year, "PROVINCE")),
+        ("generate_time_plots", [("Metric", "Rate per 100,000 population"), ("Geo_Level", "PROVINCE"),
+                                 ("Violation Description", "All")],
+         lambda: index._trends.get(("Rate per 100,000 population", "PROVINCE", "All"), index._no_rows)),
+        ("set_dropdown_values", [("Level1 Violation Flag", violation)], None),
+    ]
+
+    print("\n{:<24} {:>14} {:>14} {:>14}".format("filter step", "strings", "codes", "index"))
+    for name, filters, lookup in steps:
+        t_strings, expected = timed(args.repeat, string_masks, data, filters)
+        t_codes, result = timed(args.repeat, code_masks, table, filters)
+        assert np.array_equal(expected, result)
+        line = "{:<24} {:>11.3f} ms {:>11.3f} ms".format(name, t_strings * 1000, t_codes * 1000)
+        if lookup is not None:
+            t_index, rows = timed(args.repeat, lookup)
+            assert np.array_equal(expected, np.sort(rows))
+            line += " {:>11.3f} ms".format(t_index * 1000)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
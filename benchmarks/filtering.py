@@ -0,0 +1,114 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare per-callback filtering latency of full-table boolean masks against the query index
+Usage: python benchmarks/filtering.py [--source=<path>] [--store=<path>]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import crime_data
+import query
+
+
+def mask_slice(data, metric, violation, subcategory, year, geo_level):
+    """Filter step of generate_cma_barplot / generate_choropleth before the index"""
+    return data[
+        (data["Metric"] == metric) &
+        (data["Level1 Violation Flag"] == violation) &
+        (data["Violation Description"] == subcategory) &
+        (data["Year"] == year) &
+        (data["Geo_Level"] == geo_level)
+    ]
+
+
+def mask_trend(data, metric, geo_level):
+    """Filter step of generate_time_plots before the index"""
+    return data[
+        (data['Metric'] == metric) &
+        (data["Geo_Level"] == geo_level) &
+        (data['Violation Description'] == 'All')
+    ]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def report(name, before, after):
+    print("{:<26} masks p50 {:8.3f} ms   index p50 {:8.3f} ms   speedup {:6.0f}x".format(
+        name, statistics.median(before) * 1000, statistics.median(after) * 1000,
+        statistics.median(before) / statistics.median(after)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--source", default=crime_data.TSV_PATH)
+    parser.add_argument("--store", default=crime_data.STORE_PATH)
+    args = parser.parse_args()
+
+    # the index returns rows labelled by position
+    data = crime_data.load_data(args.source, args.store).reset_index(drop=True)
+    start = time.perf_counter()
+    index = query.QueryIndex(data)
+    print("index build {:.1f} ms, {} slices".format((time.perf_counter() - start) * 1000, len(index._slices)))
+
+    metrics = list(data["Metric"].unique())
+    violations = list(data["Level1 Violation Flag"].unique())
+    years = range(1998, 2020)
+
+    for geo_level, name in [("CMA", "generate_cma_barplot")]:
+        before, after = [], []
+        for metric in metrics:
+            for violation in violations:
+                for year in years:
+                    t_mask, expected = timed(mask_slice, data, metric, violation, "All", year, geo_level)
+                    t_index, result = timed(index.slice, metric, violation, "All", year, geo_level)
+                    assert expected.index.equals(result.index)
+                    before.append(t_mask)
+                    after.append(t_index)
+        report(name, before, after)
+
+    before, after = [], []
+    for metric in metrics:
+        for violation in violations:
+            for year in years:
+                t_mask, expected = timed(mask_slice, data, metric, violation, "All", year, "PROVINCE")
+                t_index, result = timed(index.slice_values, metric, violation, "All", year, "PROVINCE")
+                assert dict(zip(expected["Geography"], expected["Value"])) == result
+                before.append(t_mask)
+                after.append(t_index)
+    report("map_values (choropleth)", before, after)
+
+    before, after = [], []
+    for metric in metrics:
+        for geo_level in ["PROVINCE", "CMA"]:
+            t_mask, expected = timed(mask_trend, data, metric, geo_level)
+            t_index, result = timed(index.trend, metric, geo_level)
+            assert expected.index.sort_values().equals(result.index.sort_values())
+            before.append(t_mask)
+            after.append(t_index)
+    report("generate_time_plots", before, after)
+
+    before, after = [], []
+    for violation in violations:
+        t_mask, expected = timed(lambda: data[data["Level1 Violation Flag"].isin([violation])]["Violation Description"].unique())
+        index.unique("Violation Description", where=("Level1 Violation Flag", [violation]))
+        t_index, result = timed(index.unique, "Violation Description", ("Level1 Violation Flag", [violation]))
+        assert list(expected) == result
+        before.append(t_mask)
+        after.append(t_index)
+    report("get_dropdown_values", before, after)
+
+
+if __name__ == '__main__':
+    main()
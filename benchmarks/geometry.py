@@ -0,0 +1,50 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Report payload size and serialization time of the province boundaries at each simplification level
+Usage: python benchmarks/geometry.py [--repeat=<n>]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import plotly
+import geometry
+
+
+def load(level):
+    path = "data/processed/provinces.geojson" if level == "full" else "data/processed/provinces_{}.geojson".format(level)
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print("{:<8} {:>5} {:>9} {:>12} {:>12} {:>16}".format(
+        "level", "zoom", "vertices", "json kB", "gzip kB", "serialize ms"))
+    levels = [(name, max_zoom) for name, _, _, max_zoom in geometry.LEVELS] + [("full", None)]
+    for name, max_zoom in levels:
+        geojson = load(name)
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            payload = json.dumps(geojson, cls=plotly.utils.PlotlyJSONEncoder)
+            times.append(time.perf_counter() - start)
+        print("{:<8} {:>5} {:>9} {:>12.1f} {:>12.1f} {:>16.2f}".format(
+            name, "<={}".format(max_zoom) if max_zoom else "", geometry.count_vertices(geojson),
+            len(payload) / 1024, len(gzip.compress(payload.encode())) / 1024, statistics.median(times) * 1000))
+
+
+if __name__ == '__main__':
+    main()
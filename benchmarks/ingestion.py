@@ -0,0 +1,95 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Measure time and peak memory of building the column store from large synthetic TSVs, whole-file versus chunked
+Usage: python benchmarks/ingestion.py [--source=<path>] [--sizes=<GB> ...] [--chunksize=<rows>] [--whole-max=<GB>] [--workdir=<path>]
+
+The synthetic inputs repeat the rows of the source TSV, shifting the years of
+every copy so that rows stay distinct. Each build runs in a fresh interpreter
+and reports its own peak RSS.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import crime_data
+
+
+BUILD = """
+import resource, time
+import crime_data
+start = time.perf_counter()
+rows = crime_data.build_store({source!r}, {store!r}, chunksize={chunksize!r})
+print(rows, time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def make_source(source, path, size_gb):
+    """Write a TSV of about `size_gb` GB by repeating the source rows with shifted years"""
+    target = size_gb * 1024 ** 3
+    if os.path.exists(path) and abs(os.path.getsize(path) - target) < 0.05 * target:
+        return
+    with open(source, encoding="ISO-8859-1") as f:
+        header = f.readline()
+        lines = [line.rstrip("\n").split("\t") for line in f]
+    columns = header.rstrip("\n").split("\t")
+    year_cols = [columns.index(name) for name in ("REF_DATE", "Year") if name in columns]
+    years = [int(line[columns.index("Year")]) for line in lines]
+    span = max(years) - min(years) + 1
+
+    with open(path, "w", encoding="ISO-8859-1") as out:
+        out.write(header)
+        copy = 0
+        while out.tell() < target:
+            block = []
+            for line in lines:
+                fields = list(line)
+                for i in year_cols:
+                    fields[i] = str(int(fields[i]) + copy * span)
+                block.append("\t".join(fields))
+            out.write("\n".join(block) + "\n")
+            copy += 1
+
+
+def build(source, store, chunksize):
+    out = subprocess.run([sys.executable, "-c", BUILD.format(source=source, store=store, chunksize=chunksize)],
+                         cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=SRC),
+                         capture_output=True, text=True, check=True)
+    rows, seconds, max_rss_kb = out.stdout.split()
+    return int(rows), float(seconds), int(max_rss_kb) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--source", default=crime_data.TSV_PATH)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[0.25, 1, 4], help="synthetic input sizes in GB")
+    parser.add_argument("--chunksize", type=int, default=500_000)
+    parser.add_argument("--whole-max", type=float, default=1, help="largest input in GB to also load whole")
+    parser.add_argument("--workdir", default="/tmp/crime-ingestion")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    store = os.path.join(args.workdir, "store")
+    for size in args.sizes:
+        path = os.path.join(args.workdir, "crime-{}GB.tsv".format(size))
+        start = time.perf_counter()
+        make_source(args.source, path, size)
+        print("\n{:.2f} GB input ({:.1f} s to generate)".format(os.path.getsize(path) / 1024 ** 3,
+                                                              time.perf_counter() - start))
+        modes = [("chunked", args.chunksize)]
+        if size <= args.whole_max:
+            modes.append(("whole file", None))
+        for name, chunksize in modes:
+            rows, seconds, peak = build(path, store, chunksize)
+            print("  {:<11} {:>11} rows   {:8.1f} s   peak RSS {:8.1f} MB".format(name, rows, seconds, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Load test the gunicorn server with and without response compression, reporting bytes received and latency percentiles
+Usage: python benchmarks/load_test.py [--clients=<n>] [--visits=<n>] [--workers=<n>] [--port=<n>] [--mbps=<n>]
+
+Run from the repository root. Every client loads the page like a browser
+(index, scripts, layout, dependencies, map geometry, a few chart callbacks),
+first with an empty cache and then again honouring the Cache-Control and ETag
+headers of the first visit. Latency is the measured response time plus the
+transfer time of the received bytes at --mbps, as seen by a visitor on a
+slower link than the loopback interface.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from worker_boot import SRC, wait_healthy
+
+
+SCRIPT = re.compile(r'<script src="([^"]+)"')
+STYLESHEET = re.compile(r'<link rel="stylesheet" href="(/[^"]+)"')
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def callback(output, inputs, changed):
+    """Body of a Dash callback request for a single output"""
+    component, prop = output.split(".")
+    return json.dumps({
+        "output": output,
+        "outputs": {"id": component, "property": prop},
+        "inputs": [{"id": name.split(".")[0], "property": name.split(".")[1], "value": value}
+                   for name, value in inputs],
+        "changedPropIds": [changed],
+        "state": [],
+    }).encode()
+
+
+def barplot(year, highlight=None):
+    return callback("cma_barplot.srcDoc", [
+        ("metric_select.value", "Actual incidents"),
+        ("violation_select.value", "Total violent Criminal Code violations"),
+        ("subviolation_select.value", "All"),
+        ("year_select.value", year),
+        ("highlight.value", highlight),
+    ], "year_select.value")
+
+
+def trends(locations, geo_level):
+    return callback("crime_trends_plot.srcDoc", [
+        ("geo_multi_select.value", locations),
+        ("geo_radio_button.value", geo_level),
+    ], "geo_multi_select.value")
+
+
+def decode(data, encoding):
+    """Undo the Content-Encoding of a response, urllib leaves it to the caller"""
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        import brotli
+        return brotli.decompress(data)
+    return data
+
+
+class Browser:
+    """A client with an HTTP cache keyed by url, Vary is ignored as the headers never change"""
+
+    def __init__(self, base, mbps):
+        self.base = base
+        self.mbps = mbps
+        self.cache = {}
+        self.received = 0
+        self.latencies = []
+
+    def fetch(self, path, body=None):
+        cached = self.cache.get(path) if body is None else None
+        if cached and cached["expires"] > time.monotonic():
+            self.latencies.append(0.0)
+            return cached["body"]
+
+        headers = {"Accept-Encoding": "gzip, br"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        request = urllib.request.Request(self.base + path, data=body, headers=headers)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                data = response.read()
+                status, response_headers = response.status, response.headers
+        except urllib.error.HTTPError as error:
+            if error.code != 304:
+                raise
+            data, status, response_headers = b"", 304, error.headers
+        elapsed = time.perf_counter() - start
+        # headers count too, roughly 300 bytes per response
+        size = len(data) + 300
+        self.received += size
+        self.latencies.append((elapsed + size * 8 / (self.mbps * 1e6)) * 1000)
+
+        if status == 304:
+            return cached["body"]
+        data = decode(data, response_headers.get("Content-Encoding"))
+        cache_control = response_headers.get("Cache-Control", "")
+        max_age = MAX_AGE.search(cache_control)
+        if body is None and "no-store" not in cache_control:
+            self.cache[path] = {
+                "body": data,
+                "etag": response_headers.get("ETag"),
+                "expires": time.monotonic() + (int(max_age.group(1)) if max_age else 0),
+            }
+        return data
+
+    def visit(self, requests):
+        index = self.fetch("/").decode()
+        for path in SCRIPT.findall(index) + STYLESHEET.findall(index):
+            if path.startswith("/"):
+                self.fetch(path)
+        for path, body in requests:
+            self.fetch(path, body)
+
+
+def page_requests():
+    """What the dashboard fetches after its scripts: layout, map and the default charts, then a slider drag"""
+    requests = [
+        ("/_dash-layout", None),
+        ("/_dash-dependencies", None),
+        ("/geometry/provinces/low.json", None),
+        ("/geometry/provinces/medium.json", None),
+        ("/geometry/cma/low.json", None),
+    ]
+    requests += [("/_dash-update-component", barplot(year)) for year in range(2019, 2009, -1)]
+    requests += [("/_dash-update-component", barplot(2019, "Calgary"))]
+    requests += [("/_dash-update-component", trends(["Alberta", "Ontario", "Quebec"], "PROVINCE"))]
+    return requests
+
+
+def load(port, clients, visits, mbps):
+    """Run `clients` concurrent browsers, returns the first and repeat visit of each"""
+    base = "http://127.0.0.1:{}".format(port)
+    requests = page_requests()
+    results = {"first": [], "repeat": []}
+    lock = threading.Lock()
+
+    def run():
+        for _ in range(visits):
+            browser = Browser(base, mbps)
+            browser.visit(requests)
+            first = (browser.received, browser.latencies)
+            browser.received, browser.latencies = 0, []
+            browser.visit(requests)
+            with lock:
+                results["first"].append(first)
+                results["repeat"].append((browser.received, browser.latencies))
+
+    threads = [threading.Thread(target=run) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def serve(compress, workers, port, timeout):
+    cmd = [sys.executable, "-m", "gunicorn", "app:server", "--pythonpath", SRC,
+           "--config", os.path.join(SRC, "gunicorn_config.py"),
+           "--workers", str(workers), "--bind", "127.0.0.1:{}".format(port)]
+    env = dict(os.environ, RESPONSE_COMPRESSION="1" if compress else "0")
+    server = subprocess.Popen(cmd, cwd=os.getcwd(), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_healthy(port, timeout):
+        server.terminate()
+        raise RuntimeError("gunicorn did not become healthy within {}s".format(timeout))
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--visits", type=int, default=3, help="visits per client")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--mbps", type=float, default=20, help="simulated bandwidth")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    print("{} clients x {} visits, {} workers, {:.0f} Mbit/s".format(args.clients, args.visits, args.workers, args.mbps))
+    for compress in (False, True):
+        server = serve(compress, args.workers, args.port, args.timeout)
+        try:
+            # warm the render cache so both runs time the same work
+            load(args.port, 1, 1, args.mbps)
+            results, seconds = load(args.port, args.clients, args.visits, args.mbps)
+        finally:
+            server.terminate()
+            server.wait()
+        print("\ncompression {}  ({:.1f} s)".format("on" if compress else "off", seconds))
+        for visit in ("first", "repeat"):
+            received = [size for size, _ in results[visit]]
+            latencies = [latency for _, samples in results[visit] for latency in samples]
+            print("  {:<6} visit  {:8.1f} kB per visit   {:4} requests   p50 {:7.1f} ms   p95 {:7.1f} ms".format(
+                visit, statistics.mean(received) / 1024, len(latencies) // len(received),
+                statistics.median(latencies), statistics.quantiles(latencies, n=20)[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare adding one newly published year to the column store incrementally versus rebuilding it
+Usage: python benchmarks/refresh.py [--source=<path>] [--copies=<n>] [--repeat=<n>] [--check]
+
+Run from the repository root. The source TSV is split into every year but
+the last (the store as it was) and the last year (the new extract). With
+--copies the source is first repeated under other metric names to scale it up.
+Reports the time to merge the new year into the store, to rebuild the store
+from the whole TSV, to map the new store as every worker does when it
+notices the change, and how many cached charts each way keeps.
+
+With --check, checks instead that a chart rendered right after an update
+revising its rows shows the revised values, both from the render pool and
+from the shared cache as another worker would read it. Exits with 1 if not.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import crime_data
+import query
+import render_cache
+
+
+def split_source(source, copies, workdir):
+    """Write the TSVs of the store before the update, the update and the whole data"""
+    raw = crime_data.read_tsv(source)
+    frames = [raw]
+    for copy in range(1, copies):
+        frame = raw.copy()
+        frame["Metric"] += " #{}".format(copy)
+        frames.append(frame)
+    full = pd.concat(frames, ignore_index=True)
+    last = full["Year"] == full["Year"].max()
+    paths = {name: os.path.join(workdir, name + ".tsv") for name in ("base", "update", "full")}
+    full[~last].to_csv(paths["base"], sep="\t", index=False, encoding=crime_data.TSV_ENCODING)
+    full[last].to_csv(paths["update"], sep="\t", index=False, encoding=crime_data.TSV_ENCODING)
+    full.to_csv(paths["full"], sep="\t", index=False, encoding=crime_data.TSV_ENCODING)
+    return paths, len(full), int(last.sum())
+
+
+def timed(func, repeat):
+    """Median seconds of `repeat` calls"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def cache_kept(before, after):
+    """Cached charts of the store `before` still reachable once the store is `after`
+
+    Uses the app's cache keys: barplots and map values depend on their year,
+    trends on their locations and the data of the charts drawn in the
+    browser on every year.
+    """
+    current = {"history": before.history}
+    cache = render_cache.RenderCache(
+        maxsize=1 << 20,
+        version=lambda: current["history"].build,
+        generation=lambda years, geographies: current["history"].generation_for(years, geographies))
+
+    @cache.memoize(depends=lambda metric, violation, year: ([year], None))
+    def barplot(metric, violation, year):
+        return year
+
+    @cache.memoize(depends=lambda geo_list, geo_level: (None, geo_list))
+    def trends(geo_list, geo_level):
+        return geo_level
+
+    @cache.memoize()
+    def barplot_data(metric, violation):
+        return metric
+
+    index = query.QueryIndex(before)
+    calls = [(barplot, (metric, violation, year))
+             for metric in index.unique("Metric")
+             for violation in index.unique("Level1 Violation Flag")
+             for year in index.unique("Year")]
+    calls += [(barplot_data, (metric, violation))
+              for metric in index.unique("Metric")
+              for violation in index.unique("Level1 Violation Flag")]
+    calls += [(trends, ((geography,), level))
+              for level in index.unique("Geo_Level")
+              for geography in index.unique("Geography", where=("Geo_Level", [level]))]
+    for func, args in calls:
+        func(*args)
+    current["history"] = after.history
+    kept = sum(func.cached(*args) for func, args in calls)
+    return kept, len(calls)
+
+
+# A value no row has, to find in the rendered html
+REVISED_VALUE = 987654.5
+
+CHECK = """
+import json, sys, warnings
+warnings.simplefilter("ignore")
+import app, crime_data
+index = app.DATASET.get().index
+barplot = app.generate_cma_barplot.__wrapped__
+args = (index.unique("Metric")[0], index.unique("Level1 Violation Flag")[0], "All", int(max(index.unique("Year"))), None)
+app.RENDER_POOL.start()
+renders = {"before": barplot(*args)}
+crime_data.update_store(sys.argv[1])
+# as the worker does within seconds of the change, its render process has not looked yet
+app.DATASET.reload()
+renders["pool"] = barplot(*args)
+# another worker: not in its own cache, rendered by this one in the shared cache
+app.RENDER_CACHE.clear()
+renders["shared"] = barplot(*args)
+app.RENDER_POOL.stop()
+print(json.dumps(dict({name: sys.argv[2] in html for name, html in renders.items()},
+                      shared_hits=app.RENDER_CACHE.stats()["shared"]["hits"], render_pool=app.RENDER_POOL.stats())))
+"""
+
+
+def check(paths, workdir):
+    """Render a chart, revise its rows with an update and render it again in a fresh app
+
+    Returns
+    -------
+    dict
+        Whether the revised value is in the chart before the update, rendered
+        by the pool after it and read from the shared cache, and counters
+    """
+    root = os.path.join(workdir, "app")
+    crime_data.build_store(paths["full"], os.path.join(root, crime_data.STORE_PATH))
+    revision = crime_data.read_tsv(paths["update"])
+    revision = revision[revision["Geo_Level"] == "CMA"].assign(Value=REVISED_VALUE)
+    revision_path = os.path.join(workdir, "revision.tsv")
+    revision.to_csv(revision_path, sep="\t", index=False, encoding=crime_data.TSV_ENCODING)
+    env = dict(os.environ, PYTHONPATH=SRC, WARMUP="0", COALESCE="0", METRICS="0", CHART_DATA="inline",
+               RENDER_PROCESSES="1", SHARED_CACHE="sqlite://" + os.path.join(workdir, "cache.sqlite"))
+    out = subprocess.run([sys.executable, "-c", CHECK, revision_path, repr(REVISED_VALUE)], cwd=root, env=env,
+                         capture_output=True, text=True)
+    if out.returncode:
+        sys.exit("check failed to run:\n{}".format(out.stderr))
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--source", default=crime_data.TSV_PATH)
+    parser.add_argument("--copies", type=int, default=1, help="repeat the source with earlier years")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--check", action="store_true", help="check renders after an update show the revised rows")
+    args = parser.parse_args()
+
+    if args.check:
+        workdir = tempfile.mkdtemp(prefix="crime-refresh-")
+        try:
+            paths, _, _ = split_source(args.source, args.copies, workdir)
+            result = check(paths, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print("revised value in the chart before the update {}, rendered by the pool {}, from the shared cache {}"
+              .format(result["before"], result["pool"], result["shared"]))
+        print("shared cache hits {}, renders done in the worker as the pool had other data {}".format(
+            result["shared_hits"], result["render_pool"]["stale"]))
+        sys.exit(0 if result["pool"] and result["shared"] and not result["before"] else 1)
+
+    workdir = tempfile.mkdtemp(prefix="crime-refresh-")
+    try:
+        paths, rows, new_rows = split_source(args.source, args.copies, workdir)
+        base, store = os.path.join(workdir, "base_store"), os.path.join(workdir, "store")
+        crime_data.build_store(paths["base"], base)
+        before = crime_data.map_store(base, mmap=False)
+
+        def update():
+            shutil.rmtree(store, ignore_errors=True)
+            shutil.copytree(base, store)
+            crime_data.update_store(paths["update"], store)
+
+        def copy():
+            shutil.rmtree(store, ignore_errors=True)
+            shutil.copytree(base, store)
+
+        # the copy of the old store is part of the loop, not of the update
+        copy_seconds = timed(copy, args.repeat)
+        update_seconds = max(timed(update, args.repeat) - copy_seconds, 0)
+        updated = crime_data.map_store(store)
+        incremental_kept, entries = cache_kept(before, updated)
+
+        rebuild_seconds = timed(lambda: crime_data.build_store(paths["full"], store), args.repeat)
+        rebuilt = crime_data.map_store(store)
+        rebuild_kept, _ = cache_kept(before, rebuilt)
+        reload_seconds = timed(lambda: query.QueryIndex(crime_data.map_store(store)), args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("{} rows, the new year has {}".format(rows, new_rows))
+    print("{:<18} {:>9} {:>22}".format("", "seconds", "cached charts kept"))
+    print("{:<18} {:>9.3f} {:>15} of {}".format("incremental update", update_seconds, incremental_kept, entries))
+    print("{:<18} {:>9.3f} {:>15} of {}".format("full rebuild", rebuild_seconds, rebuild_kept, entries))
+    print("workers map the new store and rebuild their indexes in {:.3f}s, within {:.0f}s of the change".format(
+        reload_seconds, 5))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Measure throughput and latency percentiles under concurrent load, rendering charts in the request threads versus in a process pool
+Usage: python benchmarks/render_pool.py [--heavy=<n>] [--light=<n>] [--seconds=<n>] [--processes=<n>] [--queue=<n>] [--port=<n>]
+
+Run from the repository root. Caches are disabled so every chart is
+rendered. Heavy clients request the trends of many CMAs and CMA barplots,
+light clients the map values and dropdown options, which need no rendering.
+Both loop for --seconds against one gunicorn worker.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from slider_load import callback
+from worker_boot import SRC, wait_healthy
+
+sys.path.insert(0, SRC)
+
+import crime_data
+import query
+import tab1
+
+
+def heavy_requests(index, rng):
+    cmas = sorted(index.unique("Geography", where=("Geo_Level", ["CMA"])))
+    metric, violation = index.unique("Metric")[0], index.unique("Level1 Violation Flag")[0]
+    while True:
+        if rng.random() < 0.5:
+            yield callback(["crime_trends_plot.srcDoc"],
+                           [("geo_multi_select.value", rng.sample(cmas, rng.randint(len(cmas) // 2, len(cmas)))),
+                            ("geo_radio_button.value", "CMA")], [])
+        else:
+            yield callback(["cma_barplot.srcDoc"],
+                           [("metric_select.value", metric), ("violation_select.value", violation),
+                            ("subviolation_select.value", "All"),
+                            ("year_select.value", rng.randint(tab1.START_YEAR, tab1.END_YEAR)),
+                            ("highlight.value", rng.choice(cmas).split(",")[0])], [])
+
+
+def light_requests(index, rng):
+    metric, violation = index.unique("Metric")[0], index.unique("Level1 Violation Flag")[0]
+    while True:
+        if rng.random() < 0.5:
+            yield callback(["provinces.hideout", "colorbar.colorscale", "colorbar.min", "colorbar.max"],
+                           [("metric_select.value", metric), ("violation_select.value", violation),
+                            ("subviolation_select.value", "All"),
+                            ("year_select.value", rng.randint(tab1.START_YEAR, tab1.END_YEAR)),
+                            ("map_level.value", rng.choice(["PROVINCE", "CMA"]))], [])
+        else:
+            yield callback(["subviolation_select.options", "subviolation_select.value"],
+                           [("violation_select.value", violation)], [])
+
+
+def client(base, requests, deadline, results):
+    latencies, statuses = [], {}
+    for body in requests:
+        if time.monotonic() > deadline:
+            break
+        request = urllib.request.Request(base + "/_dash-update-component", data=body,
+                                         headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        if status == 200:
+            latencies.append((time.perf_counter() - start) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == 503:
+            # back off as the Retry-After header asks
+            time.sleep(1)
+    results.append((latencies, statuses))
+
+
+def run(processes, args, index):
+    cmd = [sys.executable, "-m", "gunicorn", "app:server", "--pythonpath", SRC,
+           "--config", os.path.join(SRC, "gunicorn_config.py"),
+           "--workers", "1", "--bind", "127.0.0.1:{}".format(args.port)]
+    env = dict(os.environ, WARMUP="0", COALESCE="0", SHARED_CACHE="none", RENDER_CACHE_SIZE="0",
+               RENDER_PROCESSES=str(processes), RENDER_QUEUE=str(args.queue))
+    server = subprocess.Popen(cmd, cwd=os.getcwd(), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_healthy(args.port, args.timeout):
+            raise RuntimeError("gunicorn did not become healthy within {}s".format(args.timeout))
+        base = "http://127.0.0.1:{}".format(args.port)
+        deadline = time.monotonic() + args.seconds
+        heavy, light = [], []
+        threads = [threading.Thread(target=client, args=(base, heavy_requests(index, random.Random(i)), deadline, heavy))
+                   for i in range(args.heavy)]
+        threads += [threading.Thread(target=client, args=(base, light_requests(index, random.Random(i)), deadline, light))
+                    for i in range(args.light)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    print("\n{}".format("render pool of {} processes".format(processes) if processes else "render in request threads"))
+    for name, results in (("heavy", heavy), ("light", light)):
+        latencies = sorted(latency for samples, _ in results for latency in samples)
+        statuses = {}
+        for _, counts in results:
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+        if not latencies:
+            print("  {:<5} no successful requests   {}".format(name, statuses))
+            continue
+        print("  {:<5} {:6.1f} req/s   p50 {:7.0f} ms   p99 {:7.0f} ms   responses {}".format(
+            name, len(latencies) / seconds, statistics.median(latencies),
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            ", ".join("{}: {}".format(k, v) for k, v in sorted(statuses.items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--heavy", type=int, default=8, help="clients requesting renders")
+    parser.add_argument("--light", type=int, default=8, help="clients requesting cheap callbacks")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--queue", type=int, default=0, help="renders pending at once, 0 for the app's default")
+    parser.add_argument("--port", type=int, default=8768)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    index = query.QueryIndex(crime_data.load_columns())
+    print("{} heavy and {} light clients for {:.0f} s, 1 gunicorn worker, {} CPUs".format(
+        args.heavy, args.light, args.seconds, os.cpu_count()))
+    for processes in (0, args.processes):
+        run(processes, args, index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Local stand-in for a Redis server, to try the redis:// shared cache without installing Redis
+Usage: python benchmarks/resp_standin.py [--port=<n>]
+
+Speaks enough of the Redis protocol (RESP) for shared_cache.RedisBackend:
+PING, GET, SET with PX / EX / NX, DEL, SELECT, DBSIZE and FLUSHDB, with
+every database in memory, and EVAL of the compare-and-delete script of
+RedisBackend.delete_if only. Then start the app with
+SHARED_CACHE=redis://localhost:<port>/0 and DATA_URL_DIR set (see app.py).
+"""
+
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import shared_cache
+
+
+class Store:
+    """Databases of keys to (value, expiry time or None)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.databases = {}
+
+    def db(self, number):
+        return self.databases.setdefault(number, {})
+
+    def get(self, number, key):
+        entry = self.db(number).get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.db(number)[key]
+            return None
+        return value
+
+
+def encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, Exception):
+        return "-ERR {}\r\n".format(reply).encode()
+    return "+{}\r\n".format(reply).encode()
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # inline command, as typed in telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def execute(self, db, args):
+        store = self.server.store
+        name = args[0].upper()
+        with store.lock:
+            if name == b"PING":
+                return "PONG"
+            if name == b"GET":
+                return store.get(db, args[1])
+            if name == b"SET":
+                key, value, options = args[1], args[2], [arg.upper() for arg in args[3:]]
+                expires = None
+                if b"PX" in options:
+                    expires = time.monotonic() + int(args[3 + options.index(b"PX") + 1]) / 1000
+                if b"EX" in options:
+                    expires = time.monotonic() + int(args[3 + options.index(b"EX") + 1])
+                if b"NX" in options and store.get(db, key) is not None:
+                    return None
+                store.db(db)[key] = (value, expires)
+                return "OK"
+            if name == b"DEL":
+                return sum(store.db(db).pop(key, None) is not None for key in args[1:])
+            if name == b"EVAL":
+                if args[1].decode() != shared_cache.RedisBackend.DELETE_IF:
+                    return ValueError("only the delete_if script is supported")
+                key, value = args[3], args[4]
+                if store.get(db, key) != value:
+                    return 0
+                del store.db(db)[key]
+                return 1
+            if name == b"DBSIZE":
+                return len(store.db(db))
+            if name == b"FLUSHDB":
+                store.db(db).clear()
+                return "OK"
+        return ValueError("unknown command '{}'".format(name.decode(errors="replace")))
+
+    def handle(self):
+        db = 0
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            if not args:
+                continue
+            if args[0].upper() == b"SELECT":
+                db = int(args[1])
+                reply = "OK"
+            else:
+                try:
+                    reply = self.execute(db, args)
+                except (IndexError, ValueError) as error:
+                    reply = ValueError(str(error) or "wrong number of arguments")
+            self.wfile.write(encode(reply))
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, Handler)
+        self.store = Store()
+
+
+def start(port=0):
+    """Serve in a background thread, returns the server, its port is `server.server_address[1]`"""
+    server = Server(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = Server(("127.0.0.1", args.port))
+    print("listening on 127.0.0.1:{}".format(args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Report render cache hit rates with 1 versus several worker processes, with and without a shared cache backend
+Usage: python benchmarks/shared_cache.py [--workers=<n> ...] [--users=<n>] [--seed=<n>]
+
+Run from the repository root. The chart requests of many simulated users
+(slider drags, highlighted CMAs, trends, popular selections more often than
+others) are spread at random over worker processes, as gunicorn does. Every
+worker imports the app with its own per-process cache and replays its share
+at the same time as the others. The Redis backend is served by the local
+stand-in in benchmarks/resp_standin.py.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from resp_standin import start as start_standin
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+
+import crime_data
+import query
+import tab1
+
+
+WORKER = """
+import json, sys, time, warnings
+warnings.simplefilter("ignore")
+import app
+events = json.load(open(sys.argv[1]))
+functions = {"barplot": app.generate_cma_barplot.__wrapped__, "map": app.map_values,
+             "trends": app.generate_time_plots.__wrapped__}
+print("ready", flush=True)
+sys.stdin.readline()
+start = time.perf_counter()
+for name, args in events:
+    functions[name](*args)
+stats = app.RENDER_CACHE.stats()
+stats["seconds"] = time.perf_counter() - start
+print(json.dumps(stats))
+"""
+
+
+def user_events(index, rng):
+    """Chart requests of one visit, the default selection first"""
+    metrics = index.unique("Metric")
+    violations = index.unique("Level1 Violation Flag")
+    cmas = sorted(index.unique("Geography", where=("Geo_Level", ["CMA"])))
+    provinces = sorted(index.unique("Geography", where=("Geo_Level", ["PROVINCE"])))
+    # a few selections are much more popular than the others
+    weights = [1 / (rank + 1) for rank in range(len(metrics) * len(violations))]
+    selections = [(metric, violation) for violation in violations for metric in metrics]
+
+    events = []
+    for visit_selection in [selections[0]] + rng.choices(selections, weights, k=2):
+        metric, violation = visit_selection
+        years = list(range(tab1.END_YEAR, tab1.END_YEAR - rng.randint(1, 8), -1))
+        for year in years:
+            events.append(("barplot", [metric, violation, "All", year, None]))
+            events.append(("map", [metric, violation, "All", year, "PROVINCE"]))
+        if rng.random() < 0.3:
+            events.append(("barplot", [metric, violation, "All", tab1.END_YEAR, rng.choice(cmas).split(",")[0]]))
+    if rng.random() < 0.5:
+        events.append(("trends", [rng.sample(provinces, 3), "PROVINCE"]))
+    return events
+
+
+def run(events, workers, backend, rng):
+    """Replay the events over `workers` processes, returns the stats of every worker"""
+    env = dict(os.environ, WARMUP="0", COALESCE="0", PYTHONPATH=SRC, SHARED_CACHE=backend,
+               DATA_URL_DIR=tempfile.mkdtemp(prefix="crime-data-urls-"))
+    shares = [[] for _ in range(workers)]
+    for event in events:
+        shares[rng.randrange(workers)].append(event)
+
+    processes, files = [], []
+    for share in shares:
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(share, f)
+        files.append(f.name)
+        processes.append(subprocess.Popen([sys.executable, "-c", WORKER, f.name], cwd=os.getcwd(), env=env,
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                          text=True))
+    # let every worker finish importing the app, then start them together
+    for process in processes:
+        process.stdout.readline()
+    for process in processes:
+        process.stdin.write("go\n")
+        process.stdin.flush()
+    stats = [json.loads(process.communicate()[0]) for process in processes]
+    for name in files:
+        os.unlink(name)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    index = query.QueryIndex(crime_data.load_columns())
+    events = [event for _ in range(args.users) for event in user_events(index, rng)]
+    standin = start_standin()
+    workdir = tempfile.mkdtemp(prefix="crime-shared-cache-")
+    backends = {
+        "none": "none",
+        "sqlite": "sqlite://" + os.path.join(workdir, "{}.sqlite"),
+        "redis": "redis://127.0.0.1:{}/{{}}".format(standin.server_address[1]),
+    }
+
+    print("{} requests from {} users".format(len(events), args.users))
+    print("{:>7}  {:<7} {:>8} {:>9} {:>11} {:>10} {:>9}".format(
+        "workers", "backend", "renders", "hit rate", "shared hits", "waited", "wall"))
+    run_number = 0
+    for workers in args.workers:
+        for name, url in backends.items():
+            run_number += 1
+            stats = run(events, workers, url.format(run_number), random.Random(args.seed))
+            renders = sum(s["shared"]["misses"] if "shared" in s else s["misses"] for s in stats)
+            shared_hits = sum(s["shared"]["hits"] for s in stats if "shared" in s)
+            waited = sum(s["shared"]["waits"] for s in stats if "shared" in s)
+            errors = sum(s["shared"]["errors"] for s in stats if "shared" in s)
+            print("{:>7}  {:<7} {:>8} {:>8.1%} {:>11} {:>10} {:>8.1f}s{}".format(
+                workers, name, renders, 1 - renders / len(events), shared_hits, waited,
+                max(s["seconds"] for s in stats), "   ({} backend errors)".format(errors) if errors else ""))
+
+
+if __name__ == '__main__':
+    main()
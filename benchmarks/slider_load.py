@@ -0,0 +1,198 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Load test year slider drags: requests in flight, updates rendered, worker CPU and time to the final chart, with and without coalescing
+Usage: python benchmarks/slider_load.py [--users=<n>] [--drags=<n>] [--step-ms=<n>] [--workers=<n>] [--port=<n>]
+
+Run from the repository root. Every user drags the year slider across all
+years a few times. "every step" sends the barplot and map updates of each
+step without waiting for the previous ones, as the browser does when the
+slider is moved with the keyboard or clicked repeatedly; "drag end" sends
+only the year where the drag stops (dcc.Slider's default updatemode="mouseup"). Every drag uses
+another metric and violation, so the renders are not served from the cache.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from worker_boot import SRC, children, wait_healthy
+
+sys.path.insert(0, SRC)
+
+import crime_data
+import query
+import tab1
+
+
+def callback(output, inputs, state):
+    """Body of a Dash callback request, `output` is a list for several outputs"""
+    def ids(names):
+        return [{"id": name.split(".")[0], "property": name.split(".")[1], "value": value} for name, value in names]
+    outputs = [{"id": name.split(".")[0], "property": name.split(".")[1]} for name in output]
+    return json.dumps({
+        "output": output[0] if len(output) == 1 else "..{}..".format("...".join(output)),
+        "outputs": outputs[0] if len(outputs) == 1 else outputs,
+        "inputs": ids(inputs),
+        "changedPropIds": ["year_select.value"],
+        "state": ids(state),
+    }).encode()
+
+
+def updates(selection, year, session):
+    """The barplot and map requests sent for a year"""
+    metric, violation = selection
+    inputs = [("metric_select.value", metric), ("violation_select.value", violation), ("subviolation_select.value", "All"),
+              ("year_select.value", year)]
+    # only the barplot is coalesced, and without coalescing it does not take the session id
+    state = [("session_id.data", session)] if session else []
+    return [
+        callback(["cma_barplot.srcDoc"], inputs + [("highlight.value", None)], state),
+        callback(["provinces.hideout", "colorbar.colorscale", "colorbar.min", "colorbar.max"],
+                 inputs + [("map_level.value", "PROVINCE")], []),
+    ]
+
+
+class Load:
+    """Requests in flight and responses of all users"""
+
+    def __init__(self, base):
+        self.base = base
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.sent = 0
+        self.statuses = {}
+
+    def post(self, body):
+        request = urllib.request.Request(self.base + "/_dash-update-component", data=body,
+                                         headers={"Content-Type": "application/json"})
+        with self.lock:
+            self.in_flight += 1
+            self.sent += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+        return status
+
+
+def mine(selections, i, drags):
+    """The selections dragged by user `i`, distinct across users as long as there are enough"""
+    return [selections[(i * drags + d) % len(selections)] for d in range(drags)]
+
+
+def user(load, session, selections, years, every_step, step, results):
+    """Drag the slider once per selection, `session` is None when the server does not coalesce"""
+    for selection in selections:
+        steps = years if every_step else years[-1:]
+        threads = []
+        for year in steps:
+            for body in updates(selection, year, session):
+                thread = threading.Thread(target=load.post, args=(body,))
+                thread.start()
+                threads.append(thread)
+            if every_step:
+                time.sleep(step)
+        # the drag ends with the last step, the user waits for its charts
+        end = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        results.append((time.perf_counter() - end) * 1000)
+
+
+def worker_cpu(pid):
+    """CPU seconds used by the workers of a gunicorn master"""
+    ticks = 0
+    for child in children(pid):
+        with open("/proc/{}/stat".format(child)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime, the 14th and 15th fields of the whole line
+        ticks += int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def health(port):
+    with urllib.request.urlopen("http://127.0.0.1:{}/health".format(port), timeout=10) as response:
+        return json.loads(response.read())
+
+
+def run(mode, args, selections, years):
+    every_step, coalesce = {"every step": (True, False), "every step, coalesced": (True, True),
+                            "drag end": (False, True)}[mode]
+    cmd = [sys.executable, "-m", "gunicorn", "app:server", "--pythonpath", SRC,
+           "--config", os.path.join(SRC, "gunicorn_config.py"),
+           "--workers", str(args.workers), "--bind", "127.0.0.1:{}".format(args.port)]
+    env = dict(os.environ, WARMUP="0", COALESCE="1" if coalesce else "0")
+    server = subprocess.Popen(cmd, cwd=os.getcwd(), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_healthy(args.port, args.timeout):
+            raise RuntimeError("gunicorn did not become healthy within {}s".format(args.timeout))
+        while len(children(server.pid)) < args.workers:
+            time.sleep(0.1)
+        load = Load("http://127.0.0.1:{}".format(args.port))
+        cpu = worker_cpu(server.pid)
+        start = time.perf_counter()
+        results = []
+        users = [threading.Thread(target=user, args=(load, "user{}".format(i) if coalesce else None, mine(selections, i, args.drags),
+                                                     years, every_step, args.step_ms / 1000, results))
+                 for i in range(args.users)]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+        seconds = time.perf_counter() - start
+        cpu = worker_cpu(server.pid) - cpu
+        coalescing = health(args.port)["coalescing"]
+    finally:
+        server.terminate()
+        server.wait()
+
+    print("\n{} ({:.1f} s)".format(mode, seconds))
+    print("  requests {:5}   peak in flight {:4}   responses {}".format(
+        load.sent, load.peak_in_flight, ", ".join("{}: {}".format(k, v) for k, v in sorted(load.statuses.items()))))
+    if coalescing:
+        print("  rendered {:5}   dropped {:5}   dropped after rendering {:4}   failed {:4}".format(
+            coalescing["rendered"], coalescing["dropped"], coalescing["stale"], coalescing["failed"]))
+    print("  worker CPU {:6.1f} s   final chart after drag end p50 {:7.0f} ms   p95 {:7.0f} ms".format(
+        cpu, statistics.median(results), statistics.quantiles(results, n=20)[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=6)
+    parser.add_argument("--drags", type=int, default=2, help="drags per user")
+    parser.add_argument("--step-ms", type=float, default=40, help="time between two slider steps")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    index = query.QueryIndex(crime_data.load_columns())
+    selections = [(metric, violation) for violation in index.unique("Level1 Violation Flag")
+                  for metric in index.unique("Metric")]
+    years = list(range(tab1.START_YEAR, tab1.END_YEAR + 1))
+    print("{} users x {} drags over {} years, a step every {:.0f} ms, {} workers".format(
+        args.users, args.drags, len(years), args.step_ms, args.workers))
+    for mode in ("every step", "every step, coalesced", "drag end"):
+        run(mode, args, selections, years)
+
+
+if __name__ == '__main__':
+    main()
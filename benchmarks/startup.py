@@ -0,0 +1,80 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare dashboard data startup time when wrangling the TSV versus reading the column store
+Usage: python benchmarks/startup.py [--source=<path>] [--store=<path>] [--repeat=<n>]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import crime_data
+
+
+COLD_START = """
+import time
+start = time.perf_counter()
+import crime_data
+data = crime_data.{loader}
+print(time.perf_counter() - start)
+"""
+
+
+def time_in_process(func, repeat):
+    """Time `func` `repeat` times in the current interpreter"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def time_cold(loader, repeat):
+    """Time imports plus loading in a fresh interpreter, as a new gunicorn worker would"""
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", COLD_START.format(loader=loader)],
+                             cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=SRC),
+                             capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def report(name, times):
+    print("{:<28} median {:8.1f} ms   min {:8.1f} ms".format(
+        name, statistics.median(times) * 1000, min(times) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--source", default=crime_data.TSV_PATH)
+    parser.add_argument("--store", default=crime_data.STORE_PATH)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if not crime_data.store_is_fresh(args.store, args.source):
+        crime_data.build_store(args.source, args.store)
+
+    tsv = lambda: crime_data.clean_data(crime_data.read_tsv(args.source))
+    store = lambda: crime_data.read_store(args.store)
+    report("TSV wrangle (warm)", time_in_process(tsv, args.repeat))
+    report("column store (warm)", time_in_process(store, args.repeat))
+    report("TSV wrangle (cold)", time_cold("clean_data(crime_data.read_tsv({!r}))".format(args.source), args.repeat))
+    report("column store (cold)", time_cold("read_store({!r})".format(args.store), args.repeat))
+
+    print("TSV size   {:10.1f} kB".format(os.path.getsize(args.source) / 1024))
+    print("store size {:10.1f} kB".format(
+        sum(os.path.getsize(os.path.join(args.store, f)) for f in os.listdir(args.store)) / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Benchmark the dashboard's hot paths on synthetically scaled data and write the results to JSON, to compare commits
+Usage: python benchmarks/suite.py [--source=<path>] [--scales=<n> ...] [--repeat=<n>] [--seed=<n>] [--output=<path>]
+       python benchmarks/suite.py --compare <base.json> <new.json> [--threshold=<ratio>]
+
+Run from the repository root, offline. The data is scaled by adding copies of
+every CMA under new names ("Calgary #2, Alberta"), as if more areas were
+reported: the years and violation categories stay the same. For every scale
+a column store is built in a temporary directory and a fresh interpreter
+imports the app there, with every cache, the coalescing, the render pool
+and the metrics turned off, and drives:
+
+- import_data, and the query index built on it when the data is (re)loaded
+- import_map, for every boundary file and simplification level
+- each server-side callback through the function Dash dispatches to, so
+  payloads are the JSON responses Dash sends: the CMA barplot and the map for
+  every year and violation category, the trends of 3 to all CMAs, hovering
+  over every area and clicking on the map, and the dropdowns
+
+Each sweep runs --repeat times after one untimed call, short sweeps until
+20 calls are timed. Latencies are
+reported as percentiles, peak Python allocations of a single call from a
+separate pass under tracemalloc, and the peak RSS of every scale's process.
+The JSON records the commit, whether the tree had changes, the package
+versions and the app settings, and `--compare` prints the ratio of two runs.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+
+import crime_data
+
+
+# Every cache and background helper off, so each call does its full work
+APP_ENV = {
+    "WARMUP": "0",
+    "RENDER_CACHE_SIZE": "0",
+    "SHARED_CACHE": "none",
+    "COALESCE": "0",
+    "RENDER_PROCESSES": "0",
+    "METRICS": "0",
+}
+# Settings changing what the callbacks do, recorded with the results
+APP_SETTINGS = ("CHART_RENDERING", "CHART_DATA", "CHOROPLETH_CLASSING", "DATA_MMAP")
+
+SUITE_VERSION = 1
+
+
+def make_dataset(source, scale, root):
+    """Lay out a data directory with `scale` copies of every CMA, returns its row and CMA counts"""
+    processed = os.path.join(root, "data", "processed")
+    os.makedirs(processed)
+    source_dir = os.path.dirname(os.path.abspath(source))
+    for name in os.listdir(source_dir):
+        if ".geojson" in name:
+            os.symlink(os.path.join(source_dir, name), os.path.join(processed, name))
+
+    raw = pd.read_csv(source, sep="\t", encoding="ISO-8859-1")
+    # "Prince Edward Island" is reported as a CMA but has no province part, it is not copied
+    cmas = raw[(raw["Geo_Level"] == "CMA") & raw["Geography"].str.contains(",")]
+    copies = [raw]
+    for copy in range(2, scale + 1):
+        frame = cmas.copy()
+        frame["Geography"] = frame["Geography"].str.replace(r"^([^,]*),", r"\1 #{},".format(copy), regex=True)
+        copies.append(frame)
+    data = pd.concat(copies, ignore_index=True)
+    tsv = os.path.join(root, crime_data.TSV_PATH)
+    data.to_csv(tsv, sep="\t", index=False, encoding="ISO-8859-1")
+    rows = crime_data.build_store(tsv, os.path.join(root, crime_data.STORE_PATH))
+    return rows, cmas["Geography"].nunique() * scale
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(latencies, payloads, peak):
+    """Statistics of one benchmark, latencies in seconds"""
+    ms = [latency * 1000 for latency in latencies]
+    result = {
+        "calls": len(ms),
+        "p50_ms": percentile(ms, 0.5),
+        "p90_ms": percentile(ms, 0.9),
+        "p99_ms": percentile(ms, 0.99),
+        "mean_ms": sum(ms) / len(ms),
+        "max_ms": max(ms),
+        "peak_alloc_bytes": peak,
+    }
+    if payloads:
+        result["payload_bytes"] = {"mean": sum(payloads) / len(payloads), "max": max(payloads),
+                                   "total": sum(payloads)}
+    return result
+
+
+def measure(cases, repeat, min_calls=20):
+    """Time every case `repeat` times, then trace the allocations of each once
+
+    Parameters
+    -------
+    [callable]
+        Functions without arguments returning the size of their output in
+        bytes, None if it has no size
+    Int
+        Runs of the sweep
+    Int
+        Calls timed at least, short sweeps are run more times
+
+    Returns
+    -------
+    dict
+        See `summarize`
+    """
+    cases[0]()
+    latencies, payloads = [], []
+    for _ in range(max(repeat, -(-min_calls // len(cases)))):
+        for case in cases:
+            start = time.perf_counter()
+            size = case()
+            latencies.append(time.perf_counter() - start)
+            if size is not None:
+                payloads.append(size)
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for case in cases:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            case()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return summarize(latencies, payloads, peak)
+
+
+def run_scale(repeat, seed):
+    """Drive the app imported from the current directory, runs in a fresh interpreter per scale"""
+    import warnings
+    warnings.simplefilter("ignore")
+    from dash._utils import split_callback_id
+    from dash.exceptions import PreventUpdate
+
+    import app
+    import geometry
+    import query
+
+    rng = random.Random(seed)
+    index = app.DATASET.get().index
+
+    def callbacks():
+        """The function Dash dispatches to and the outputs it is called with, by first output"""
+        found = {}
+        for callback_id, entry in app.app.callback_map.items():
+            if "callback" in entry:
+                outputs = split_callback_id(callback_id)
+                first = outputs[0] if isinstance(outputs, list) else outputs
+                found["{}.{}".format(first["id"], first["property"])] = (entry["callback"], outputs)
+        return found
+
+    registered = callbacks()
+
+    def call(output, *args):
+        func, outputs = registered[output]
+
+        def case():
+            try:
+                return len(func(*args, outputs_list=outputs))
+            except PreventUpdate:
+                return 0
+        return case
+
+    metrics = index.unique("Metric")
+    violations = index.unique("Level1 Violation Flag")
+    years = sorted(index.unique("Year"))
+    provinces = sorted(index.unique("Geography", where=("Geo_Level", ["PROVINCE"])))
+    cmas = sorted(index.unique("Geography", where=("Geo_Level", ["CMA"])))
+
+    def import_data():
+        app.import_data()
+
+    def load_dataset():
+        query.QueryIndex(app.import_data())
+
+    def import_map(level, name):
+        def case():
+            app.import_map(level, name)
+            return os.path.getsize(app.map_path(level, name))
+        return case
+
+    benchmarks = {"import_data": measure([import_data], repeat), "load_dataset": measure([load_dataset], repeat)}
+    for name in ("provinces", "cma"):
+        for level in [level for level, *_ in geometry.LEVELS] + [None]:
+            if os.path.exists(app.map_path(level, name)):
+                benchmarks["import_map[{}, {}]".format(name, level or "full")] = measure(
+                    [import_map(level, name)], repeat)
+
+    selections = [(metric, violation) for metric in metrics[:1] for violation in violations]
+    if "cma_barplot.srcDoc" in registered:
+        benchmarks["generate_cma_barplot"] = measure(
+            [call("cma_barplot.srcDoc", metric, violation, "All", year, None)
+             for metric, violation in selections for year in years], repeat)
+    if "cma_barplot_data.data" in registered:
+        benchmarks["cma_barplot_data"] = measure(
+            [call("cma_barplot_data.data", metric, violation, "All") for metric, violation in selections], repeat)
+    for level in ("PROVINCE", "CMA"):
+        benchmarks["generate_choropleth[{}]".format(level)] = measure(
+            [call("provinces.hideout", metric, violation, "All", year, level)
+             for metric, violation in selections for year in years], repeat)
+
+    if "crime_trends_plot.srcDoc" in registered:
+        for level, locations in (("PROVINCE", provinces), ("CMA", cmas)):
+            count = 3
+            while True:
+                count = min(count, len(locations))
+                benchmarks["generate_time_plots[{} x {}]".format(level, count)] = measure(
+                    [call("crime_trends_plot.srcDoc", rng.sample(locations, count), level) for _ in range(2)], repeat)
+                if count == len(locations):
+                    break
+                count *= 2
+    if "crime_trends_data.data" in registered:
+        benchmarks["crime_trends_data"] = measure(
+            [call("crime_trends_data.data", level) for level in ("PROVINCE", "CMA")], repeat)
+
+    for level, name_prop in (("PROVINCE", app.MAP_LAYERS["PROVINCE"][1]), ("CMA", app.MAP_LAYERS["CMA"][1])):
+        hideout = app.generate_choropleth.__wrapped__(metrics[0], violations[0], "All", years[-1], level)[0]
+        areas = provinces if level == "PROVINCE" else cmas
+        benchmarks["province_hover[{}]".format(level)] = measure(
+            [call("province_info.children", {"properties": {name_prop: area}}, None, level, hideout, 3) for area in areas],
+            repeat)
+        if level == "CMA":
+            # clicks anywhere over southern Canada, most near no CMA
+            clicks = [[rng.uniform(42, 55), rng.uniform(-130, -55)] for _ in range(50)]
+            benchmarks["province_hover[click]"] = measure(
+                [call("province_info.children", None, click, level, hideout, rng.randint(3, 10)) for click in clicks], repeat)
+
+    benchmarks["set_dropdown_values[metric]"] = measure([call("metric_select.options", "tab-1")], repeat)
+    benchmarks["set_dropdown_values[subviolation]"] = measure(
+        [call("subviolation_select.options", violation) for violation in violations], repeat)
+    benchmarks["set_multi_dropdown_values"] = measure(
+        [call("geo_multi_select.options", "tab-2", level) for level in ("PROVINCE", "CMA")], repeat)
+    benchmarks["set_map_geometry"] = measure(
+        [call("provinces.url", zoom, level, None) for level in ("PROVINCE", "CMA") for zoom in range(1, 13)], repeat)
+
+    return {
+        "rows": index.table.rows,
+        "process_max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "benchmarks": benchmarks,
+    }
+
+
+def git(*args):
+    try:
+        return subprocess.run(["git"] + list(args), cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """What the results depend on besides the code"""
+    packages = {}
+    for name in ("numpy", "pandas", "altair", "dash", "flask"):
+        try:
+            packages[name] = __import__(name).__version__
+        except ImportError:
+            packages[name] = None
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "packages": packages,
+        "settings": {name: os.environ.get(name) for name in APP_SETTINGS},
+    }
+
+
+def compare(base_path, new_path, threshold):
+    """Print the ratio new / base of the median and p99 latency, payload and allocations of every benchmark"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print("base {} ({}), new {} ({})".format(
+        (base["commit"] or "?")[:10], base["created"], (new["commit"] or "?")[:10], new["created"]))
+    if base["settings"] != new["settings"] or base["packages"] != new["packages"]:
+        print("settings or packages differ: {} / {}".format(
+            {**base["settings"], **base["packages"]}, {**new["settings"], **new["packages"]}))
+
+    def ratio(a, b):
+        return "{:.2f}x".format(b / a) if a and b is not None else "-"
+
+    base_scales = {scale["scale"]: scale for scale in base["scales"]}
+    regressions = 0
+    for scale in new["scales"]:
+        old = base_scales.get(scale["scale"])
+        if old is None:
+            continue
+        print("\nscale {} ({} rows)".format(scale["scale"], scale["rows"]))
+        print("{:<40} {:>9} {:>7} {:>7} {:>8} {:>7}".format("", "p50 ms", "p50", "p99", "payload", "alloc"))
+        for name, stats in scale["benchmarks"].items():
+            before = old["benchmarks"].get(name)
+            if before is None:
+                print("{:<40} {:>9.2f}   (new)".format(name, stats["p50_ms"]))
+                continue
+            change = stats["p50_ms"] / before["p50_ms"]
+            flag = ""
+            if change > threshold:
+                flag = "  slower"
+                regressions += 1
+            elif change < 1 / threshold:
+                flag = "  faster"
+            print("{:<40} {:>9.2f} {:>7} {:>7} {:>8} {:>7}{}".format(
+                name, stats["p50_ms"], ratio(before["p50_ms"], stats["p50_ms"]),
+                ratio(before["p99_ms"], stats["p99_ms"]),
+                ratio(before.get("payload_bytes", {}).get("mean"), stats.get("payload_bytes", {}).get("mean")),
+                ratio(before["peak_alloc_bytes"], stats["peak_alloc_bytes"]), flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=crime_data.TSV_PATH, help="raw TSV, next to the boundary files")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 16], help="copies of every CMA")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every sweep")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file, suite-<commit>.json by default")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files")
+    parser.add_argument("--threshold", type=float, default=1.2, help="p50 ratio reported as a change")
+    parser.add_argument("--run-scale", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    if args.run_scale:
+        json.dump(run_scale(args.repeat, args.seed), sys.stdout)
+        return
+
+    results = dict(environment(), suite=SUITE_VERSION, repeat=args.repeat, seed=args.seed, scales=[])
+    for scale in args.scales:
+        root = tempfile.mkdtemp(prefix="crime-suite-")
+        try:
+            start = time.perf_counter()
+            rows, cmas = make_dataset(args.source, scale, root)
+            env = dict(os.environ, PYTHONPATH=SRC, DATA_URL_DIR=os.path.join(root, "data-urls"), **APP_ENV)
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scale", root,
+                                  "--repeat", str(args.repeat), "--seed", str(args.seed)],
+                                 cwd=root, env=env, capture_output=True, text=True)
+            if out.returncode:
+                sys.exit("scale {} failed:\n{}".format(scale, out.stderr))
+            result = dict(json.loads(out.stdout), scale=scale, cmas=cmas)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        results["scales"].append(result)
+        print("scale {:>3}: {} rows, {} CMAs, peak RSS {:.0f} MB, {:.0f}s".format(
+            scale, rows, cmas, result["process_max_rss_bytes"] / 1024 ** 2, time.perf_counter() - start))
+        for name, stats in result["benchmarks"].items():
+            print("  {:<40} p50 {:9.2f} ms   p99 {:9.2f} ms   payload {:>9}   alloc {:>6.0f} kB".format(
+                name, stats["p50_ms"], stats["p99_ms"],
+                "{:.0f} B".format(stats["payload_bytes"]["mean"]) if "payload_bytes" in stats else "-",
+                stats["peak_alloc_bytes"] / 1024))
+
+    output = args.output or "suite-{}.json".format((results["commit"] or "unknown")[:10])
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print("wrote {}".format(output))
+
+
+if __name__ == '__main__':
+    main()
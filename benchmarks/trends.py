@@ -0,0 +1,80 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Compare the Crime Trends data step and full render, filtering the data versus gathering from the trends cube, as more locations are selected
+Usage: python benchmarks/trends.py [--repeat=<n>]
+
+Run from the repository root.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import warnings
+
+import pandas as pd
+
+os.environ.setdefault("WARMUP", "0")
+warnings.simplefilter("ignore", FutureWarning)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import app
+import query
+
+
+GROUPS = ['Total violent Criminal Code violations', 'Total property crime violations',
+          'Total drug violations', 'Total other Criminal Code violations']
+
+
+def filtered_series(index, geo_list, geo_level):
+    """Data step of generate_time_plots before the cube"""
+    df = index.trend(query.TREND_METRIC, geo_level)
+    df = df[df["Geography"].isin(geo_list)]
+    df['Year'] = pd.to_datetime(df['Year'], format='%Y')
+    return [df[df['Level1 Violation Flag'] == group] for group in GROUPS]
+
+
+def cube_series(index, geo_list, geo_level):
+    return [index.cube.series(geo_level, geo_list, group) for group in GROUPS]
+
+
+def median_ms(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    index = app.DATASET.get().index
+    # the undecorated render, below the Dash callback and the render cache
+    render = app.generate_time_plots.__wrapped__.__wrapped__
+    cmas = sorted(index.unique("Geography", where=("Geo_Level", ["CMA"])))
+
+    counts = sorted({n for n in (3, 6, 12, 24) if n < len(cmas)} | {len(cmas)})
+    print("{:>9} {:>13} {:>13} {:>15}".format("locations", "filter", "cube", "full render"))
+    for n in counts:
+        geo_list = cmas[:n]
+        for before, after in zip(filtered_series(index, geo_list, "CMA"), cube_series(index, geo_list, "CMA")):
+            expected = before[["Geography", "Year", "Value"]].reset_index(drop=True)
+            result = after[["Geography", "Year", "Value"]].sort_values(["Geography", "Year"]).reset_index(drop=True)
+            expected = expected.sort_values(["Geography", "Year"]).reset_index(drop=True)
+            expected["Geography"] = expected["Geography"].astype(object)
+            pd.testing.assert_frame_equal(expected, result)
+        print("{:>9} {:>10.3f} ms {:>10.3f} ms {:>12.1f} ms".format(
+            n, median_ms(args.repeat, filtered_series, index, geo_list, "CMA"),
+            median_ms(args.repeat, cube_series, index, geo_list, "CMA"),
+            median_ms(max(1, args.repeat // 4), render, geo_list, "CMA")))
+
+
+if __name__ == '__main__':
+    main()
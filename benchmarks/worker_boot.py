@@ -0,0 +1,146 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Profile dashboard startup: import time per module and resident memory per gunicorn worker
+Usage: python benchmarks/worker_boot.py [--workers=<n> ...] [--top=<n>] [--port=<n>] [--no-preload] [--in-memory]
+
+Run from the repository root. Import times come from `python -X importtime`,
+memory from /proc/<pid>/smaps_rollup (Linux): RSS counts shared pages in every
+worker, PSS splits them between the processes sharing them, so the sum of PSS
+is the real footprint of the whole server. The column store is memory-mapped
+by default; --in-memory reads it into every process instead (DATA_MMAP=0).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC = os.path.join(ROOT, "src")
+
+
+def import_times(module, top):
+    """Slowest imports of `module` in a fresh interpreter, by cumulative time"""
+    env = dict(os.environ, PYTHONPATH=SRC, WARMUP="0")
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                         cwd=os.getcwd(), env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # nesting is shown by indentation, only keep `module` and what it imports directly
+        if name.startswith("     "):
+            continue
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    total = rows[0][0] if rows else 0
+    return rows[1:top + 1], total
+
+
+def memory(pid):
+    """RSS and PSS of a process in kB"""
+    values = {}
+    with open("/proc/{}/smaps_rollup".format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0][:-1]] = int(parts[1])
+    return values.get("Rss", 0), values.get("Pss", 0)
+
+
+def children(pid):
+    """Process ids whose parent is `pid`"""
+    found = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/{}/stat".format(entry)) as f:
+                    # the parent id is the second field after the parenthesised command name
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        found.append(int(entry))
+            except (OSError, IndexError):
+                pass
+    return sorted(found)
+
+
+def wait_healthy(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:{}/health".format(port), timeout=2) as resp:
+                if resp.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def profile_workers(workers, port, preload, timeout, mmap=True):
+    """Boot gunicorn, wait until every worker answers /health and report memory per process"""
+    cmd = [sys.executable, "-m", "gunicorn", "app:server", "--pythonpath", SRC,
+           "--config", os.path.join(SRC, "gunicorn_config.py"),
+           "--workers", str(workers), "--bind", "127.0.0.1:{}".format(port)]
+    env = dict(os.environ, GUNICORN_PRELOAD="1" if preload else "0", DATA_MMAP="1" if mmap else "0")
+    start = time.perf_counter()
+    server = subprocess.Popen(cmd, cwd=os.getcwd(), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_healthy(port, timeout):
+            raise RuntimeError("gunicorn did not become healthy within {}s".format(timeout))
+        # every worker has to finish its own warm-up when the app is not preloaded
+        for _ in range(workers * 4):
+            wait_healthy(port, timeout)
+        while len(children(server.pid)) < workers and time.perf_counter() - start < timeout:
+            time.sleep(0.1)
+        boot = time.perf_counter() - start
+
+        print("\n{} workers, preload {}, data {}: healthy after {:.1f}s".format(
+            workers, "on" if preload else "off", "mmap" if mmap else "in memory", boot))
+        master_rss, master_pss = memory(server.pid)
+        print("  master     RSS {:9.1f} MB   PSS {:9.1f} MB".format(master_rss / 1024, master_pss / 1024))
+        total_pss = master_pss
+        worker_rss, worker_pss = [], []
+        for pid in children(server.pid):
+            rss, pss = memory(pid)
+            worker_rss.append(rss)
+            worker_pss.append(pss)
+            if workers <= 4:
+                print("  worker {:<4}RSS {:9.1f} MB   PSS {:9.1f} MB".format(pid % 10000, rss / 1024, pss / 1024))
+        total_pss += sum(worker_pss)
+        print("  per worker RSS {:9.1f} MB   PSS {:9.1f} MB (mean of {})".format(
+            sum(worker_rss) / len(worker_rss) / 1024, sum(worker_pss) / len(worker_pss) / 1024, len(worker_rss)))
+        print("  total PSS {:.1f} MB".format(total_pss / 1024))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--no-preload", action="store_true", help="Only profile workers loading the app themselves")
+    parser.add_argument("--in-memory", action="store_true", help="Read the column store into every process")
+    args = parser.parse_args()
+
+    rows, total = import_times("app", args.top)
+    print("import app: {:.0f} ms".format(total / 1000))
+    print("{:>12} {:>12}  module".format("cumulative", "self"))
+    for cumulative_us, self_us, name in rows:
+        print("{:>9.1f} ms {:>9.1f} ms  {}".format(cumulative_us / 1000, self_us / 1000, name))
+
+    for workers in args.workers:
+        if not args.no_preload:
+            profile_workers(workers, args.port, True, args.timeout, not args.in_memory)
+        profile_workers(workers, args.port, False, args.timeout, not args.in_memory)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,25 +13,74 @@ import dash
 import dash_html_components as html
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
-import dash_leaflet as dl
-from dash_extensions.javascript import Namespace, arrow_function
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
+from dash.fingerprint import check_fingerprint
 
-import altair as alt
-import pandas as pd
+import flask
+import functools
+import hashlib
+import importlib.metadata
 import json
+import os
+import tempfile
 import numpy as np
-import matplotlib
-from matplotlib import cm
 
 import tab1
 import tab2
+import crime_data
+import dataset
+import query
+import render_cache
+import render_pool
+import shared_cache
+import data_urls
+import compression
+import coalesce
+import metrics
+import warmup
+import geometry
+import colorscale
 
 
-app = dash.Dash(__name__,  external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
+# Responses are compressed by our own middleware below rather than Dash's flask-compress
+app = dash.Dash(__name__,  external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True, compress=False)
 app.title = 'Canadian Crime Dashboard'
 server = app.server
 
+# gzip / brotli responses of at least COMPRESSION_MIN_SIZE bytes, RESPONSE_COMPRESSION=0 turns it off
+if os.environ.get("RESPONSE_COMPRESSION", "1") != "0":
+    server.wsgi_app = compression.CompressionMiddleware(
+        server.wsgi_app, min_size=int(os.environ.get("COMPRESSION_MIN_SIZE", 1024)))
+
+# The layout only changes on deploy, browsers revalidate it with its ETag after this many seconds
+LAYOUT_MAX_AGE = int(os.environ.get("LAYOUT_MAX_AGE", 3600))
+
+
+@server.after_request
+def cache_headers(response):
+    """Long-lived caching for static assets and the layout"""
+    path = flask.request.path
+    if response.status_code != 200:
+        return response
+    if path.startswith(("/assets/", "/_dash-component-suites/")):
+        # Dash fingerprints asset urls with the file's modification time, as ?m=... for
+        # assets/ and in the file name (bundle.v1_8_3m1612345678.min.js) for component suites
+        if "m" in flask.request.args or check_fingerprint(path)[1]:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, max-age=3600"
+    elif path in ("/_dash-layout", "/_dash-dependencies"):
+        response.add_etag()
+        response.headers["Cache-Control"] = "public, max-age={}".format(LAYOUT_MAX_AGE)
+        response.make_conditional(flask.request)
+    return response
+
+# "server" renders the charts to html on every change, "client" sends the data
+# of a selection once and filters and draws it in the browser (assets/charts.js)
+CHART_RENDERING = os.environ.get("CHART_RENDERING", "server")
+CLIENT_CHARTS = CHART_RENDERING == "client"
+
 app.layout = html.Div([
     dbc.Row(
         [
@@ -56,9 +105,21 @@ app.layout = html.Div([
         id='crime-dashboard-tabs',
         active_tab='tab-1'
     ),
-    html.Div(id='crime-dashboard-content')
+    html.Div(id='crime-dashboard-content'),
+    # Random id of the page, lets the server coalesce the updates of one visitor
+    dcc.Store(id='session_id')
 ])
 
+app.clientside_callback(
+    """
+    function(_, session) {
+        return session || Math.random().toString(36).slice(2) + Date.now().toString(36);
+    }
+    """,
+    Output('session_id', 'data'),
+    Input('crime-dashboard-tabs', 'active_tab'),
+    State('session_id', 'data'))
+
 
 @app.callback(
     Output('crime-dashboard-content', 'children'),
@@ -76,75 +137,359 @@ def render_content(tab):
    html
        The page to render
     """
-    data = import_data()
     if tab == 'tab-1':
+        # the slider covers the years of the data, a year added by an update shows up without a restart
+        start_year, end_year = data_years()
         return html.Div([
-            tab1.generate_layout()
+            tab1.generate_layout(client_charts=CLIENT_CHARTS, start_year=start_year, end_year=end_year)
         ])
     elif tab == 'tab-2':
         return html.Div([
-            tab2.generate_layout()
+            tab2.generate_layout(client_charts=CLIENT_CHARTS)
         ])
 
+def altair():
+    """Import altair on first use, it is slow to import and not needed until a chart is rendered
+    Returns
+    -------
+    module
+        altair, with max rows disabled for data sent to altair plots
+    """
+    import altair as alt
+    alt.data_transformers.disable_max_rows()
+    return alt
+
+
 # Pull initial data for plots
 def import_data():
-    """Import data from file
+    """Import data from the column store, or from file if the store is missing or stale
+    
+    The store is memory-mapped read-only so all workers share its pages,
+    DATA_MMAP=0 reads it into the memory of each process instead.
     Returns
     -------
-    pd.Dataframe
-        dataframe containing all data from the processed import file
+    crime_data.ColumnTable
+        columns containing all data from the processed import file
     """
     
-    # Disable max rows for data sent to altair plots
-    alt.data_transformers.disable_max_rows()
+    return crime_data.load_columns(mmap=os.environ.get("DATA_MMAP", "1") != "0")
+
+def data_identity(data):
+    """Identifies the loaded data in every process: the build and the number of updates of the store"""
+    history = getattr(data, "history", None)
+    return (history.build, history.generation) if history is not None else None
+
+
+# Loaded once per process and reloaded when the source TSV or the column store changes
+DATASET = dataset.DatasetProvider(
+    import_data,
+    watch=[crime_data.TSV_PATH, os.path.join(crime_data.STORE_PATH, "meta.json")],
+    indexer=query.QueryIndex,
+    identity=data_identity
+)
+DATASET.get()
+
+
+@server.route("/dataset/status")
+def dataset_status():
+    """Report the dataset version and number of loads, to confirm callbacks do no I/O"""
+    history = getattr(DATASET.get().data, "history", None)
+    return flask.jsonify(dict(DATASET.status(), build=history.build if history else None,
+                              generation=history.generation if history else None))
+
+
+# Charts missing from the caches are rendered in RENDER_PROCESSES child processes of
+# each gunicorn worker (started by gunicorn_config.post_worker_init), at most
+# RENDER_QUEUE at once, callers waiting RENDER_TIMEOUT seconds at most. The
+# children render from the same data as the worker asking, see render_pool.py
+RENDER_POOL = render_pool.RenderPool(
+    processes=int(os.environ.get("RENDER_PROCESSES", 2)),
+    max_pending=int(os.environ.get("RENDER_QUEUE", 0)) or None,
+    timeout=float(os.environ.get("RENDER_TIMEOUT", 30)),
+    provider=DATASET
+)
+
+
+@server.errorhandler(render_pool.Busy)
+def render_busy(error):
+    """Turn renders away while the pool is full, the browser keeps the previous chart"""
+    response = flask.jsonify(error=str(error))
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+@server.errorhandler(render_pool.Timeout)
+def render_timeout(error):
+    response = flask.jsonify(error=str(error))
+    response.status_code = 504
+    return response
+
+
+# Slider updates superseded within COALESCE_WINDOW_MS by a newer one from the same page are not rendered
+COALESCER = coalesce.Coalescer(window=float(os.environ.get("COALESCE_WINDOW_MS", 50)) / 1000) \
+    if os.environ.get("COALESCE", "1") != "0" else None
+
+
+# "url" charts load their rows from content-addressed /data urls, "inline" embeds them in the html.
+# The data is written to DATA_URL_DIR, a directory of the host unless it is set
+CHART_DATA = os.environ.get("CHART_DATA", "url")
+DATA_URL_DIR = os.environ.get("DATA_URL_DIR")
+DATA_URLS = data_urls.DataUrls(DATA_URL_DIR or os.path.join(tempfile.gettempdir(), "crime-dashboard-data"))
+
+
+# Charts rendered by any worker: sqlite://<path> for the workers of one host,
+# redis://host:port/db for several hosts, none to only cache in each process.
+# With redis and "url" charts, a chart cached by one host points to data only
+# that host wrote, so DATA_URL_DIR must then be set to storage every host shares
+SHARED_CACHE_URL = os.environ.get(
+    "SHARED_CACHE", "sqlite://" + os.path.join(tempfile.gettempdir(), "crime-dashboard-cache.sqlite"))
+SHARED_CACHE_BACKEND = shared_cache.backend_from_url(SHARED_CACHE_URL)
+if isinstance(SHARED_CACHE_BACKEND, shared_cache.RedisBackend) and CHART_DATA == "url" and not DATA_URL_DIR:
+    raise ValueError("SHARED_CACHE={} with CHART_DATA=url needs DATA_URL_DIR on storage shared by every host"
+                     .format(SHARED_CACHE_URL))
+
+def code_version():
+    """Identifies the code rendering the charts, part of the shared cache keys
+
+    CACHE_VERSION if set, e.g. the release being deployed, otherwise a hash of
+    the app's source files and the altair version.
+    """
+    if os.environ.get("CACHE_VERSION"):
+        return os.environ["CACHE_VERSION"]
+    digest = hashlib.sha1()
+    src = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(src)):
+        if name.endswith(".py"):
+            with open(os.path.join(src, name), "rb") as f:
+                digest.update(name.encode() + b"\0" + f.read())
+    try:
+        # without importing altair, see `altair`
+        digest.update(importlib.metadata.version("altair").encode())
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    return digest.hexdigest()[:16]
+
+
+def data_version():
+    """Identifies the loaded data, the same in every worker loading the same files
+
+    The build id of the column store, which incremental updates (see
+    `crime_data.update_store`) keep, so that the charts they did not change
+    stay cached. The fingerprint of the source files without a store.
+    """
+    snapshot = DATASET.get()
+    history = getattr(snapshot.data, "history", None)
+    return history.build if history is not None else snapshot.fingerprint
+
+
+def data_generation(years=None, geographies=None):
+    """Last incremental update of the store changing any of `years` in any of `geographies`, None for all"""
+    history = getattr(DATASET.get().data, "history", None)
+    return history.generation_for(years, geographies) if history is not None else 0
+
+
+def data_years():
+    """First and last year of the data, the range of the year slider"""
+    years = DATASET.get().index.unique("Year")
+    return min(years), max(years)
+
+
+# Rendered charts, keyed on the normalized callback arguments and dropped on
+# data reload, or only made unreachable when an update changed their data.
+# A chart is keyed and rendered from the same snapshot of the data
+RENDER_CACHE = render_cache.RenderCache(
+    maxsize=int(os.environ.get("RENDER_CACHE_SIZE", 256)),
+    version=data_version,
+    generation=data_generation,
+    pin=DATASET.pinned,
+    # keyed on the code too, a deploy does not serve the charts of the previous one
+    shared=shared_cache.SharedCache(SHARED_CACHE_BACKEND, namespace=CHART_DATA + ":" + code_version())
+    if SHARED_CACHE_BACKEND else None
+)
+
+
+@server.route("/data/<digest>.json")
+def chart_data(digest):
+    """Serve the data of a chart, compressed if the client accepts it and cacheable forever"""
+    etag = '"{}"'.format(digest)
+    if etag in flask.request.headers.get("If-None-Match", ""):
+        response = flask.Response(status=304)
+    else:
+        encoding = compression.accepted_encoding(flask.request.headers.get("Accept-Encoding"))
+        body = DATA_URLS.read(digest, encoding)
+        if body is None:
+            flask.abort(404)
+        response = flask.Response(body, mimetype="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+@server.route("/cache/status")
+def cache_status():
+    """Report render cache hits, misses and evictions of this worker and its use of the shared cache"""
+    return flask.jsonify(RENDER_CACHE.stats())
+
+def import_map(level=None, name="provinces"):
+    """Import map data from file
     
-    path = "data/processed/DSCI532-CDN-CRIME-DATA.tsv"
-    data = pd.read_csv(path, sep="\t", encoding="ISO-8859-1")
+    Parameters
+    -------
+    String
+        Name of the simplification level built by build_geometry.py, None for full resolution
+    String
+        Name of the boundary file, provinces or cma
     
-    ### Data Wrangling 
-    data = data.dropna()
-    data.replace(" \[.*\]", "", regex=True, inplace=True)
-    data.loc[data["Geography"] == "Prince Edward Island", "Geo_Level"] = data["Geo_Level"].replace("CMA", "PROVINCE")
-    data['Geography'].replace("\?", "e", regex=True, inplace=True)
+    Returns
+    -------
+    json
+        geojson for provinces or CMAs
+    """
     
-    # Remove total col
-    data = data[data['Level1 Violation Flag'] != "Total, all violations"]
+    with open(map_path(level, name)) as f:
+        geojson = json.load(f)
+    return geojson
+
+
+def map_path(level=None, name="provinces"):
+    """Path of a boundary file at a simplification level, None for full resolution"""
+    return "data/processed/{}.geojson".format(name) if level is None else "data/processed/{}_{}.geojson".format(name, level)
+
+
+def import_map_payloads(name):
+    """Serialize every simplification level of a boundary file that has been built
     
-    # Change subcategory name to All for totals 
-    for name in data['Level1 Violation Flag'].unique():
-        data['Violation Description'].replace(name, "All", inplace=True)
+    Parameters
+    -------
+    String
+        Name of the boundary file, provinces or cma
     
-    # Separate 'Geography' into Province and CMA
-    data[['CMA','Province']]=data['Geography'].str.extract(r'(?P<CMA>^.*)\,(?P<Province>.*$)')
-    data.loc[(data["Geo_Level"] == "PROVINCE"),'Province'] = data.loc[(data["Geo_Level"] == "PROVINCE"),'Geography']
+    Returns
+    -------
+    dict
+        Level name ("full" for full resolution) to json bytes
+    """
+    payloads = {}
+    for level in [level for level, *_ in geometry.LEVELS] + [None]:
+        if os.path.exists(map_path(level, name)):
+            payloads[level or "full"] = json.dumps(import_map(level, name), separators=(",", ":")).encode()
+    return payloads
 
 
-    return data
+def encode_map_payloads(name, payloads):
+    """Compressed copies of the serialized boundaries, from build_geometry.py when available
     
-DATA = import_data()
-
-def import_map():
-    """Import map data from file
     Returns
     -------
-    json
-        geojson for provinces
+    dict
+        Level name to encoding (None for uncompressed) to body
+    """
+    return {
+        level: compression.load_precompressed(map_path(None if level == "full" else level, name), payload)
+        for level, payload in payloads.items()
+    }
+
+
+# Boundary file and the feature property matching the data's Geography column for each map level
+MAP_LAYERS = {
+    'PROVINCE': ('provinces', 'PRENAME'),
+    'CMA': ('cma', 'Geography')
+}
+
+# Name of an area of each map level in the info box on the map, as a title and in a sentence
+MAP_AREAS = {
+    'PROVINCE': ('Province', 'province'),
+    'CMA': ('CMA', 'CMA')
+}
+
+# Serialized once, the map layer fetches the geometry from /geometry/<name>/<level>.json
+MAP_PAYLOADS = {name: import_map_payloads(name) for name, _ in MAP_LAYERS.values()}
+MAP_ENCODED = {name: encode_map_payloads(name, payloads) for name, payloads in MAP_PAYLOADS.items()}
+MAP_ETAGS = {name: {level: hashlib.sha1(payload).hexdigest()[:20] for level, payload in payloads.items()}
+             for name, payloads in MAP_PAYLOADS.items()}
+
+# Resolves map clicks to CMAs, which are too small to hover over at low zoom
+CMA_INDEX = geometry.GridIndex(import_map(name="cma"), "Geography") if MAP_PAYLOADS["cma"] else None
+
+
+@server.route("/geometry/<name>/<level>.json")
+def map_geometry(name, level):
+    """Serve boundaries at a simplification level, full resolution for unknown levels"""
+    encoded = MAP_ENCODED.get(name)
+    if not encoded:
+        flask.abort(404)
+    level = level if level in encoded else "full"
+    encoding = compression.accepted_encoding(flask.request.headers.get("Accept-Encoding"))
+    response = flask.Response(encoded[level][encoding], mimetype="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    # one ETag per encoding, the bodies differ
+    response.set_etag("{}-{}".format(MAP_ETAGS[name][level], encoding or "identity"))
+    return response.make_conditional(flask.request)
+
+# Locations selected by default on the crime trends tab
+DEFAULT_LOCATIONS = {
+    'PROVINCE': ['Alberta', 'British Columbia', 'Ontario'],
+    'CMA': ['Edmonton, Alberta', 'Vancouver, British Columbia', 'Toronto, Ontario']
+}
+
+def latest_only(channel, *dependencies):
+    """Register a callback whose updates are dropped when a newer one arrives from the same page
+    
+    The callback also receives the page's session id, which is not passed on
+    to the function. Updates already in the render cache are returned at once.
+    The function is returned wrapped like `app.callback` does, so
+    `__wrapped__` still reaches it.
     """
+    def register(func):
+        if COALESCER is None:
+            return app.callback(*dependencies)(func)
+        cached = getattr(func, "cached", lambda *args: False)
+
+        def coalesced(*args):
+            *args, session = args
+            if cached(*args):
+                return func(*args)
+            return COALESCER.run(channel, session, func, *args)
+
+        app.callback(*dependencies, State('session_id', 'data'))(functools.wraps(func)(coalesced))
+        return functools.wraps(func)(lambda *args: func(*args))
+    return register
+
+
+def server_chart(*dependencies, coalesce=None):
+    """Register a chart callback rendered on the server, unless charts are drawn in the browser
     
-    with open("data/processed/provinces.geojson") as f:
-        geojson = json.load(f)
-    return geojson
+    In client mode the function is left unregistered but wrapped the same way,
+    so `__wrapped__` still reaches the cached render. With `coalesce`, the
+    name of the chart, superseded updates are dropped, see `latest_only`.
+    """
+    if CLIENT_CHARTS:
+        return lambda func: functools.wraps(func)(lambda *args: func(*args))
+    if coalesce:
+        return latest_only(coalesce, *dependencies)
+    return app.callback(*dependencies)
 
-PROVINCES = import_map()
 
 # CMA plot, tab1
-@app.callback(
+@server_chart(
    Output('cma_barplot', 'srcDoc'),
    Input('metric_select', 'value'), 
    Input('violation_select', 'value'),
    Input('subviolation_select', 'value'),
    Input('year_select', 'value'), 
-   Input('highlight', 'value'))
+   Input('highlight', 'value'),
+   coalesce='cma_barplot')
+@RENDER_CACHE.memoize(
+    normalize=lambda metric, violation, subcategory, year, highlight: (metric, violation, subcategory, year, highlight or ""),
+    depends=lambda metric, violation, subcategory, year, highlight: ([year], None))
+@RENDER_POOL.task
 def generate_cma_barplot(metric, violation, subcategory, year, highlight):
     """Updates the CMA barplot on tab 1 when triggered
     
@@ -165,36 +510,92 @@ def generate_cma_barplot(metric, violation, subcategory, year, highlight):
         An altair plot in html format
     """
 
-    df = DATA[
-        (DATA["Metric"] == metric) & 
-        (DATA["Level1 Violation Flag"] == violation) &
-        (DATA["Violation Description"] == subcategory) &
-        (DATA["Year"] == year) &
-        (DATA["Geo_Level"] == "CMA")
-    ]
+    alt = altair()
+    with metrics.phase("filter"):
+        df = DATASET.get().index.slice(metric, violation, subcategory, year, "CMA")
     
-    df["highlight"] = df["Geography"].str.contains(highlight or "")
+    if CHART_DATA == "url":
+        # The rows do not depend on the highlight, which is computed in the browser
+        with metrics.phase("spec"):
+            data = alt.UrlData(DATA_URLS.publish(alt.to_values(df[["Geography", "Value", "Year", "Metric"]])["values"]))
+            chart = cma_barplot_chart(alt, data, metric, violation, subcategory).transform_calculate(
+                highlight="indexof(datum.Geography, {}) >= 0".format(json.dumps(highlight or "")))
+        with metrics.phase("serialize"):
+            return chart.to_html()
+
+    with metrics.phase("spec"):
+        df = df.copy()
+        df["highlight"] = df["Geography"].str.contains(highlight or "")
+        chart = cma_barplot_chart(alt, df, metric, violation, subcategory)
    
-    plot = alt.Chart(df, width=250).mark_bar().encode(
-        x=alt.X('Value', axis=alt.Axis(title = metric)),
-        y=alt.Y('Geography', axis=alt.Axis(title = 'Census Metropolitan Area (CMA)'), sort = '-x'), 
-        color=alt.Color("highlight", legend=None),
-        tooltip=["Metric", 'Value', 'Year']
+    with metrics.phase("serialize"):
+        plot = chart.to_html()
+    return plot
+
+
+def cma_barplot_chart(alt, data, metric, violation, subcategory):
+    """The CMA barplot chart for some data, a dataframe or a named dataset filled in the browser"""
+    return alt.Chart(data, width=250).mark_bar().encode(
+        x=alt.X('Value:Q', axis=alt.Axis(title = metric)),
+        y=alt.Y('Geography:N', axis=alt.Axis(title = 'Census Metropolitan Area (CMA)'), sort = '-x'), 
+        color=alt.Color("highlight:N", legend=None),
+        tooltip=["Metric:N", 'Value:Q', 'Year:Q']
     ).properties(
         title=(subcategory if subcategory != 'All' else violation)
-    ).to_html()
-    return plot
+    )
+
+
+@RENDER_CACHE.memoize(depends=lambda metric, violation, subcategory, year, geo_level: ([year], None))
+def map_values(metric, violation, subcategory, year, geo_level):
+    """Values shown on the choropleth map for each province or CMA
+    
+    Parameters
+    -------
+    String
+        The name of the metric selected from the dropdown
+    String
+        The violation selected from the dropdown
+    String
+        The subcategory selected from the dropdown
+    Int
+        The year selected from the slider
+    String
+        The map level, PROVINCE or CMA
+    
+    Returns
+    -------
+    dict
+        Geography name to value, all 0 if there is no data for the selection
+    """
+    index = DATASET.get().index
+    with metrics.phase("filter"):
+        values = index.slice_values(metric, violation, subcategory, year, geo_level)
+
+        if not values:
+            geographies = index.unique('Geography', where=('Geo_Level', [geo_level]))
+            return dict(zip(geographies, [0]*len(geographies)))
+    return values
+
+
+# Equal-width ("fixed") or equal-count ("quantile") colour classes on the map
+CHOROPLETH_CLASSING = os.environ.get("CHOROPLETH_CLASSING", "fixed")
 
 
 # Canadian provinces map from: https://exploratory.io/map 
 # Tutorial used: https://dash-leaflet.herokuapp.com/#geojson 
+# The map only recolours the boundaries, cheap enough not to wait for a newer
+# update the way the barplot does (see `latest_only`)
 @app.callback(
-   Output('choropleth', 'children'),
+   Output('provinces', 'hideout'),
+   Output('colorbar', 'colorscale'),
+   Output('colorbar', 'min'),
+   Output('colorbar', 'max'),
    Input('metric_select', 'value'), 
    Input('violation_select', 'value'),
    Input('subviolation_select', 'value'),
-   Input('year_select', 'value'))
-def generate_choropleth(metric, violation, subcategory, year):     
+   Input('year_select', 'value'),
+   Input('map_level', 'value'))
+def generate_choropleth(metric, violation, subcategory, year, map_level='PROVINCE'):     
     """Updates the choropleth map on tab 1 when triggered
     
     Parameters
@@ -207,95 +608,124 @@ def generate_choropleth(metric, violation, subcategory, year):
         The subcategory selected from the dropdown
     Int
         The year selected from the slider
+    String
+        The map level selected, PROVINCE or CMA
     
     Returns
     -------
-    html
-        A leaflet choropleth map
+    dict, [String], Int, Float
+        The hideout of the map layer (values, classes and colours), and
+        the colorscale, min and max of the colorbar
     """
     
-    geojson = PROVINCES
-    df = DATA [
-        (DATA["Metric"] == metric) & 
-        (DATA["Level1 Violation Flag"] == violation) &
-        (DATA["Violation Description"] == subcategory) &
-        (DATA["Year"] == year) &
-        (DATA['Geo_Level'] == "PROVINCE")
-    ]
-
-    if df.shape[0] == 0:
-        data_dict = dict(zip(DATA[DATA['Geo_Level'] == "PROVINCE"]['Geography'].unique(), [0]*13))
-    else:    
-        data_dict = dict(zip(df['Geography'], df['Value']))
-    
-    for location in geojson['features']:
-        try:
-            lookup_val = data_dict[location['properties']['PRENAME']]
-        except:
-            lookup_val = None
-        location['properties']['Value'] = lookup_val
+    # The geometry is static on the page, only the values and colours are sent
+    data_dict = map_values(metric, violation, subcategory, year, map_level)
         
-    num = 13 # number of provinces and territories in Canada
-    vals = pd.Series(data_dict.values())
-    classes = list(np.linspace(max(0,int(vals.min())), max(10,int(vals.max())+0.01), num = num))
-    mm =  dict(min = max(0,int(vals.min())), max = max(10,int(vals.max())+0.01)) 
-    
-    viridis = cm.get_cmap('viridis', num)
-    colorscale = []
-    for i in range(viridis.N):
-        rgba = viridis(i)
-        colorscale.append(matplotlib.colors.rgb2hex(rgba))
-    
-    style = dict(weight=1, color='black', fillOpacity=0.7)
-    hover_style = dict(weight=5, color='orange', dashArray='')
-    ns = Namespace("dlx", "choropleth")  
-    
-    return [ 
-        dl.TileLayer(),
-        dl.GeoJSON(data=geojson, id="provinces", 
-        options=dict(style=ns("style")),
-        hideout=dict(colorscale = colorscale[::-1], classes = classes, style = style, colorProp = "Value"),
-        hoverStyle=arrow_function(hover_style)),
-        dl.Colorbar(colorscale = colorscale[::-1], id = "colorbar", width = 20, height = 150, **mm, position = "bottomleft")
-    ]
+    with metrics.phase("spec"):
+        num = 13 # number of colour classes, one per province and territory
+        classes, vmin, vmax = colorscale.class_breaks(data_dict.values(), num, mode=CHOROPLETH_CLASSING)
+        colors = colorscale.palette('viridis', num, reverse=True)
+        
+        style = dict(weight=1, color='black', fillOpacity=0.7)
+        hideout = dict(colorscale = colors, classes = classes, style = style, values = data_dict, nameProp = MAP_LAYERS[map_level][1])
+    
+    return hideout, colors, vmin, vmax
 
 
-# Effect of hovering over province. Alternative: click_feature
+@app.callback(
+    Output('provinces', 'url'),
+    Input('choropleth', 'zoom'),
+    Input('map_level', 'value'),
+    State('provinces', 'url'))
+def set_map_geometry(zoom, map_level, url):
+    """Switch the map layer to the boundaries of the map level, simplified for the map zoom
+    
+    Parameters
+    -------
+    Int
+        The current zoom level of the map
+    String
+        The map level selected, PROVINCE or CMA
+    String
+        The url the map layer currently loads its geometry from
+    
+    Returns
+    -------
+    String
+        The url of the geometry for the zoom level, not updated if unchanged
+    """
+    new_url = geometry.geometry_url(MAP_LAYERS[map_level][0], geometry.level_for_zoom(zoom))
+    if new_url == url:
+        raise PreventUpdate
+    return new_url
+
+
+# Effect of hovering over a province or CMA. Clicks are resolved with CMA_INDEX, as CMAs are hard to hover over
 @app.callback(
     Output("province_info", "children"), 
     Output('highlight', 'value'),
-    Input("provinces", "hover_feature"))
-def province_hover(feature):
+    Input("provinces", "hover_feature"),
+    Input("choropleth", "click_lat_lng"),
+    Input('map_level', 'value'),
+    State("provinces", "hideout"),
+    State("choropleth", "zoom"))
+def province_hover(feature, click_lat_lng=None, map_level='PROVINCE', hideout=None, zoom=None):
     """Displays information about the map area hovered over
     
     Parameters
     -------
     geojson feature
         The geojson feature being hovered over
+    [Float]
+        Latitude and longitude of the last click on the map
+    String
+        The map level selected, PROVINCE or CMA
+    dict
+        The hideout of the map layer, holding the value of each area
+    Int
+        The current zoom level of the map
     
     Returns
     -------
     html, String
          Html to display on in the info box on the map and the name of the province to hightlight
     """
+    title, area = MAP_AREAS.get(map_level, MAP_AREAS['PROVINCE'])
     intro_message = [
-        html.H5("Hover over a Province"), 
-        "Hovering over a province will allow you to view details", 
+        html.H5("Hover over a {}".format(title)), 
+        "Hovering over a {} will allow you to view details".format(area), 
         html.Br(), 
         "and highlight related entries in the CMA plot to the right"
     ]
     
+    hideout = hideout or {}
+    name_prop = hideout.get('nameProp', 'PRENAME')
+    name = None
     if feature is not None:
-        return [[html.H5(feature['properties']['PRENAME']), feature['properties']['Value']], feature['properties']['PRENAME']]
+        name = feature['properties'].get(name_prop)
+    elif click_lat_lng and name_prop == 'Geography' and CMA_INDEX:
+        # Not over any CMA, select the one clicked on or within about 10 pixels of the click
+        tolerance = 360 / 256 / 2 ** (zoom or tab1.MAP_ZOOM) * 10
+        with metrics.phase("filter"):
+            name = CMA_INDEX.locate(click_lat_lng[1], click_lat_lng[0], tolerance=tolerance)
+    
+    if name is not None:
+        value = hideout.get('values', {}).get(name)
+        return [[html.H5(name), value], name]
     else:
         return [intro_message, None]
 
 
 # Crime trends plots, tab2
-@app.callback(
+@server_chart(
     Output('crime_trends_plot', 'srcDoc'),
     Input('geo_multi_select', 'value'),
     Input('geo_radio_button', 'value'))
+@RENDER_CACHE.memoize(
+    normalize=lambda geo_list, geo_level: (tuple(sorted(geo_list or [])), geo_level),
+    # with chart data urls the chart holds every location of the level
+    depends=lambda geo_list, geo_level: (None, None if CHART_DATA == "url" else geo_list or []))
+@RENDER_POOL.task
 def generate_time_plots(geo_list, geo_level):
     """Updates the time series plots on tab 2 when triggered
     
@@ -311,45 +741,158 @@ def generate_time_plots(geo_list, geo_level):
     html
         A 2 by 2 plot 
     """
-    metric = "Rate per 100,000 population"
+    alt = altair()
     metric_name = "Violations per 100k"
     
-    df = DATA[
-        (DATA['Metric'] == metric) &
-        (DATA["Geo_Level"] == geo_level) &
-        (DATA['Violation Description'] == 'All')
-    ]
-    df = df[df["Geography"].isin(geo_list)]
-    df['Year'] = pd.to_datetime(df['Year'], format='%Y')
-    
-    category_dict = {
-        'Violent Crimes' : 'Total violent Criminal Code violations',
-        'Property Crimes' : 'Total property crime violations',
-        'Drug Crimes' : 'Total drug violations',
-        'Other Criminal Code Violations' : 'Total other Criminal Code violations'
-    }
+    index = DATASET.get().index
     
+    def series(geographies, description):
+        with metrics.phase("filter"):
+            return index.cube.series(geo_level, geographies, description)
+
+    if CHART_DATA == "url":
+        # One url per level and group with every location, the selection is filtered in the browser
+        geographies = index.unique("Geography", where=("Geo_Level", [geo_level]))
+        with metrics.phase("spec"):
+            chart = crime_trends_chart(
+                alt,
+                lambda description: alt.UrlData(DATA_URLS.publish(
+                    alt.to_values(series(geographies, description))["values"])),
+                locations=geo_list or [])
+        with metrics.phase("serialize"):
+            return chart.to_html()
+
+    with metrics.phase("spec"):
+        chart = crime_trends_chart(alt, lambda description: series(geo_list or [], description))
+
+    with metrics.phase("serialize"):
+        return chart.to_html()
+
+
+# Violation group of each trends plot
+TREND_GROUPS = {
+    'Violent Crimes' : 'Total violent Criminal Code violations',
+    'Property Crimes' : 'Total property crime violations',
+    'Drug Crimes' : 'Total drug violations',
+    'Other Criminal Code Violations' : 'Total other Criminal Code violations'
+}
+
+
+def crime_trends_chart(alt, data_for, locations=None):
+    """The 2 by 2 trends chart, `data_for` gives the data of each violation group
+    
+    Locations, if given, are filtered from the data by the chart itself
+    """
     plot_list = []
 
-    for title, description in category_dict.items():
+    for title, description in TREND_GROUPS.items():
+        chart = alt.Chart(data_for(description), title = title)
+        if locations is not None:
+            chart = chart.transform_filter(alt.FieldOneOfPredicate(field='Geography', oneOf=list(locations)))
         plot_list.append(
-            alt.Chart(df[df['Level1 Violation Flag'] == description], title = title).mark_line().encode(
-                x = alt.X('Year'),
-                y = alt.Y('Value'),
-                tooltip = ["Metric", 'Value'],
-                color = 'Geography').properties(height = 200, width = 300)
+            chart.mark_line().encode(
+                x = alt.X('Year:T'),
+                y = alt.Y('Value:Q'),
+                tooltip = ["Metric:N", 'Value:Q'],
+                color = 'Geography:N').properties(height = 200, width = 300)
         )
 
-    chart = (plot_list[0] | plot_list[2]) & (plot_list[1] | plot_list[3])
+    return (plot_list[0] | plot_list[2]) & (plot_list[1] | plot_list[3])
+
 
-    return chart.to_html()
+@RENDER_CACHE.memoize()
+def cma_barplot_data(metric, violation, subcategory):
+    """Data of the CMA barplot for every year with its chart spec, for `charts.js` to draw in the browser
+    
+    Parameters
+    -------
+    String
+        The name of the metric selected from the dropdown
+    String
+        The violation selected from the dropdown
+    String
+        The subcategory selected from the dropdown
+    
+    Returns
+    -------
+    dict
+        Vega-Lite spec reading the named dataset "cma", and columns of the
+        rows with the geography names dictionary-encoded
+    """
+    alt = altair()
+    index = DATASET.get().index
+    start_year, end_year = data_years()
+    with metrics.phase("filter"):
+        rows = np.concatenate([index.slice_rows(metric, violation, subcategory, year, "CMA")
+                               for year in range(start_year, end_year + 1)])
+        codes, geography = np.unique(index.table.columns["Geography"][rows], return_inverse=True)
+    with metrics.phase("spec"):
+        spec = cma_barplot_chart(alt, alt.Data(name="cma"), metric, violation, subcategory).to_dict()
+    with metrics.phase("serialize"):
+        return {
+            "spec": spec,
+            "metric": metric,
+            "geographies": index.table.categories("Geography")[codes].tolist(),
+            "geography": geography.tolist(),
+            "year": index.table.columns["Year"][rows].tolist(),
+            "value": index.table.columns["Value"][rows].tolist()
+        }
 
 
-def get_dropdown_values(col, filter=False):
+@RENDER_CACHE.memoize()
+def crime_trends_data(geo_level):
+    """Trends of every location of a geography level with the chart spec, for `charts.js` to draw in the browser
+    
+    Parameters
+    -------
+    String
+        Radio button selection, CMA or PROVINCE
+    
+    Returns
+    -------
+    dict
+        Vega-Lite spec reading one named dataset per violation group and the
+        trends cube of the level, see `query.TrendCube.payload`
+    """
+    alt = altair()
+    with metrics.phase("filter"):
+        payload = DATASET.get().index.cube.payload(geo_level, list(TREND_GROUPS.values()))
+    with metrics.phase("spec"):
+        payload["spec"] = crime_trends_chart(alt, lambda description: alt.Data(name=description)).to_dict()
+    return payload
+
+
+if CLIENT_CHARTS:
+    # The server only sends the data of a selection, the year slider, the
+    # highlighted CMA and the selected locations are applied in the browser
+    app.callback(
+        Output('cma_barplot_data', 'data'),
+        Input('metric_select', 'value'),
+        Input('violation_select', 'value'),
+        Input('subviolation_select', 'value'))(cma_barplot_data)
+    app.clientside_callback(
+        ClientsideFunction(namespace='crimeDashboard', function_name='cmaBarplot'),
+        Output('cma_barplot', 'srcDoc'),
+        Input('cma_barplot_data', 'data'),
+        Input('year_select', 'value'),
+        Input('highlight', 'value'))
+    app.callback(
+        Output('crime_trends_data', 'data'),
+        Input('geo_radio_button', 'value'))(crime_trends_data)
+    app.clientside_callback(
+        ClientsideFunction(namespace='crimeDashboard', function_name='crimeTrends'),
+        Output('crime_trends_plot', 'srcDoc'),
+        Input('crime_trends_data', 'data'),
+        Input('geo_multi_select', 'value'))
+
+
+def get_dropdown_values(index, col, filter=False):
     """Helper function for extracting dropdown option list from given column
     
     Parameters
     -------
+    query.QueryIndex
+        The index of the data snapshot to read the options from
     String
         The column to get dropdown options / value for
     
@@ -358,10 +901,8 @@ def get_dropdown_values(col, filter=False):
     [[String], String]
         List with two elements, options list and default value based on data
     """
-    if filter:
-        df = DATA[DATA[filter[0]].isin(filter[1])][col].unique()
-    else:
-        df = DATA[col].unique()
+    with metrics.phase("filter"):
+        df = index.unique(col, where=filter or None)
     return [[{"label": x, "value": x} for x in df], df[0]]
  
 
@@ -384,10 +925,11 @@ def set_dropdown_values(__):
     [[String], String]
         List with two elements, options list and default value based on data
     """
+    index = DATASET.get().index
     dropdowns = ["Metric", "Level1 Violation Flag"]
     output = []
     for i in dropdowns:
-        output += get_dropdown_values(i)
+        output += get_dropdown_values(index, i)
     return output
 
 
@@ -408,7 +950,7 @@ def set_dropdown_values(violation_values):
     [String], String
         Two elements, options list and default value based on data
     """
-    output = get_dropdown_values("Violation Description", filter = ["Level1 Violation Flag", [violation_values]])
+    output = get_dropdown_values(DATASET.get().index, "Violation Description", filter = ["Level1 Violation Flag", [violation_values]])
     return output
 
 @app.callback(
@@ -432,17 +974,85 @@ def set_multi_dropdown_values(__, geo_level):
     List with two elements, options list and default value based on data
     """
     
-    df = DATA[DATA["Geo_Level"] == geo_level]
-    df = df["Geography"].unique()
-    df2 = np.sort(df)   # can't call it df without map error
-    selected = ['Alberta', 'British Columbia', 'Ontario'] if geo_level == 'PROVINCE' else ['Edmonton, Alberta', 'Vancouver, British Columbia', 'Toronto, Ontario']
+    with metrics.phase("filter"):
+        df = DATASET.get().index.unique("Geography", where=("Geo_Level", [geo_level]))
+        df2 = np.sort(df)   # can't call it df without map error
+    selected = DEFAULT_LOCATIONS[geo_level]
 
     return [{'label': city, 'value': city} for city in df2], selected
 
 
-if __name__ == '__main__':
+def warmup_jobs():
+    """List the dashboard states to pre-render, most requested first
     
-    # Disable max rows for data sent to altair plots
-    alt.data_transformers.disable_max_rows()
+    Returns
+    -------
+    [(callable, tuple)]
+        Render functions and the arguments to call them with
+    """
+    index = DATASET.get().index
+    metrics = index.unique("Metric")
+    violations = index.unique("Level1 Violation Flag")
+    default_subcategory = index.unique("Violation Description", where=("Level1 Violation Flag", [violations[0]]))[0]
+    default = (metrics[0], violations[0], default_subcategory)
+    
+    # Call the cached functions underneath the Dash callback wrappers
+    barplot = generate_cma_barplot.__wrapped__
+    trends = generate_time_plots.__wrapped__
+    if CLIENT_CHARTS:
+        # The browser applies the year and the locations, only the data of each selection is rendered here
+        barplot = lambda metric, violation, subcategory, year, highlight: cma_barplot_data(metric, violation, subcategory)
+        trends = lambda geo_list, geo_level: crime_trends_data(geo_level)
+    
+    start_year, end_year = data_years()
+    jobs = [
+        (barplot, default + (end_year, None)),
+        (map_values, default + (end_year, 'PROVINCE')),
+        (map_values, default + (end_year, 'CMA')),
+        (trends, (DEFAULT_LOCATIONS['PROVINCE'], 'PROVINCE')),
+        (trends, (DEFAULT_LOCATIONS['CMA'], 'CMA'))
+    ]
+    # Dragging the year slider on the default selection
+    for year in range(end_year - 1, start_year - 1, -1):
+        jobs += [(barplot, default + (year, None)), (map_values, default + (year, 'PROVINCE'))]
+    # Every metric and violation for the default year
+    for metric in metrics:
+        for violation in violations:
+            if (metric, violation) != default[:2]:
+                jobs += [(barplot, (metric, violation, 'All', end_year, None)),
+                         (map_values, (metric, violation, 'All', end_year, 'PROVINCE'))]
+    return jobs
+
+
+# Latency, outcome and response size of every callback, served at /metrics; METRICS=0 turns it off
+METRICS = metrics.Metrics().instrument(app) if os.environ.get("METRICS", "1") != "0" else None
+
+
+@server.route("/metrics")
+def prometheus_metrics():
+    """Callback metrics of all workers in the Prometheus text format"""
+    if METRICS is None:
+        flask.abort(404)
+    response = flask.Response(METRICS.exposition(), content_type=metrics.CONTENT_TYPE)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+# Pre-render the default states in the background, limited to WARMUP_BUDGET seconds
+WARMUP = warmup.Warmup(
+    warmup_jobs() if os.environ.get("WARMUP", "1") != "0" else [],
+    time_budget=float(os.environ.get("WARMUP_BUDGET", 60))
+).start()
+
+
+@server.route("/health")
+def health():
+    """Health check, returns 503 until the render caches are warm"""
+    status = dict(WARMUP.status(), coalescing=COALESCER.stats() if COALESCER else None,
+                  render_pool=RENDER_POOL.stats())
+    return flask.jsonify(status), 200 if WARMUP.ready else 503
+
+
+if __name__ == '__main__':
     
     app.run_server(debug=False)
\ No newline at end of file
@@ -0,0 +1,74 @@
+/*
+Client-side chart rendering, used when the app runs with CHART_RENDERING=client.
+
+The server sends the data of a selection once (a dcc.Store) together with a
+Vega-Lite spec reading named datasets. The functions below filter that data by
+year, highlighted CMA or selected locations and return the page shown in the
+chart iframe, so moving the slider does not go back to the server.
+*/
+(function() {
+    // Same page and library versions as altair's Chart.to_html
+    const PAGE_HEAD = '<!DOCTYPE html><html><head>' +
+        '<style>.error { color: red; }</style>' +
+        '<script type="text/javascript" src="https://cdn.jsdelivr.net/npm//vega@5"></script>' +
+        '<script type="text/javascript" src="https://cdn.jsdelivr.net/npm//vega-lite@4.8.1"></script>' +
+        '<script type="text/javascript" src="https://cdn.jsdelivr.net/npm//vega-embed@6"></script>' +
+        '</head><body><div id="vis"></div><script>';
+    const PAGE_TAIL = 'vegaEmbed("#vis", spec, {"mode": "vega-lite"}).catch(function(error) {' +
+        'document.getElementById("vis").innerHTML = \'<div class="error">JavaScript Error: \' + error.message + "</div>";' +
+        '});</script></body></html>';
+
+    function page(spec, datasets) {
+        const full = Object.assign({}, spec, {datasets: Object.assign({}, spec.datasets, datasets)});
+        // keep "</script>" in the data from closing the script tag
+        return PAGE_HEAD + 'var spec = ' + JSON.stringify(full).replace(/</g, '\\u003c') + ';' + PAGE_TAIL;
+    }
+
+    function cmaBarplot(data, year, highlight) {
+        if (!data) {
+            return window.dash_clientside.no_update;
+        }
+        const rows = [];
+        for (let i = 0; i < data.year.length; ++i) {
+            if (data.year[i] === year) {
+                const geography = data.geographies[data.geography[i]];
+                rows.push({
+                    Geography: geography,
+                    Value: data.value[i],
+                    Year: year,
+                    Metric: data.metric,
+                    highlight: geography.includes(highlight || "")
+                });
+            }
+        }
+        return page(data.spec, {cma: rows});
+    }
+
+    function crimeTrends(data, locations) {
+        if (!data) {
+            return window.dash_clientside.no_update;
+        }
+        const selected = new Set(locations || []);
+        const datasets = {};
+        data.groups.forEach(function(group, j) {
+            const rows = [];
+            data.geographies.forEach(function(geography, i) {
+                if (!selected.has(geography)) {
+                    return;
+                }
+                const series = data.values[i][j];
+                for (let k = 0; k < series.length; ++k) {
+                    if (series[k] !== null) {
+                        rows.push({Geography: geography, Year: data.years[k], Value: series[k], Metric: data.metric});
+                    }
+                }
+            });
+            datasets[group] = rows;
+        });
+        return page(data.spec, datasets);
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        crimeDashboard: {cmaBarplot: cmaBarplot, crimeTrends: crimeTrends}
+    });
+})();
@@ -0,0 +1,27 @@
+/*
+Style functions for the choropleth map on tab 1, referenced from app.py through
+dash_extensions.javascript.Namespace("crimeDashboard", "choropleth").
+
+The province geometry is loaded once from a static url; the values to colour
+by are passed separately in the GeoJSON `hideout` prop.
+*/
+window.crimeDashboard = Object.assign({}, window.crimeDashboard, {
+    choropleth: {
+        style: function(feature, context) {
+            const hideout = context.props.hideout;
+            if (!hideout) {
+                // Geometry loaded before the first values arrived
+                return {weight: 1, color: 'black', fillOpacity: 0};
+            }
+            const {classes, colorscale, style, values, nameProp} = hideout;
+            const value = values[feature.properties[nameProp]];
+            const featureStyle = Object.assign({}, style);
+            for (let i = 0; i < classes.length; ++i) {
+                if (value > classes[i]) {
+                    featureStyle.fillColor = colorscale[i];
+                }
+            }
+            return featureStyle;
+        }
+    }
+});
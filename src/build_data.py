@@ -0,0 +1,53 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Wrangle the crime statistics TSV once and write it to the column store read by the app
+Usage: python src/build_data.py [--source=<path>] [--store=<path>] [--chunksize=<rows>] [--force] [--update=<path>]
+
+With --chunksize the TSV is read, cleaned and written a chunk of rows at a
+time, so extracts larger than memory can be loaded.
+
+With --update only the rows of a TSV of new or revised rows (e.g. a newly
+published year) are wrangled and merged into the existing store. Running
+apps pick the store up within seconds and keep the cached charts of the
+years and geographies the update did not change. The source TSV is left as
+it is, a change to it makes the store stale.
+"""
+
+import argparse
+import time
+
+import crime_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the column store used by the dashboard")
+    parser.add_argument("--source", default=crime_data.TSV_PATH, help="raw TSV to wrangle")
+    parser.add_argument("--store", default=crime_data.STORE_PATH, help="directory to write the store to")
+    parser.add_argument("--chunksize", type=int, help="rows to process at a time, for sources larger than memory")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the store is fresh")
+    parser.add_argument("--update", help="TSV of new or revised rows to merge into the store")
+    args = parser.parse_args()
+
+    if args.update:
+        start = time.perf_counter()
+        summary = crime_data.update_store(args.update, args.store)
+        print("Merged {} in {:.2f}s: {} rows added, {} revised, {} unchanged, {} rows in {}".format(
+            args.update, time.perf_counter() - start, summary["added"], summary["revised"], summary["unchanged"],
+            summary["rows"], args.store))
+        if summary["years"]:
+            print("Changed years {} in {} geographies".format(summary["years"], len(summary["geographies"])))
+        return
+
+    if not args.force and crime_data.store_is_fresh(args.store, args.source):
+        print("Store at {} is up to date".format(args.store))
+        return
+
+    start = time.perf_counter()
+    rows = crime_data.build_store(args.source, args.store, chunksize=args.chunksize)
+    print("Wrote {} rows to {} in {:.2f}s".format(rows, args.store, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Write simplified versions of the province and CMA boundaries for the map to serve at each zoom level
+Usage: python src/build_geometry.py [--provinces=<path>] [--cma=<path>] [--out-dir=<path>]
+
+The CMA boundaries are read from the StatCan shapefile, reprojected to
+longitude / latitude, restricted to census metropolitan areas and labelled
+with the `Geography` names used by the crime data. Every file gets gzip (and
+brotli) compressed copies for the app to serve as is, with the digest of the
+content they were made from. The copies are not committed, the app writes
+the missing or outdated ones when it starts.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import compression
+import crime_data
+import geometry
+
+
+def write_levels(geojson, name, out_dir, write_full=True):
+    """Write every simplification level of a FeatureCollection, and optionally the full resolution"""
+    if write_full:
+        path = os.path.join(out_dir, "{}.geojson".format(name))
+        with open(path, "w") as f:
+            json.dump(geojson, f, separators=(",", ":"))
+        compression.write_precompressed(path)
+        print("{} full: {} vertices, {:.1f} kB".format(name, geometry.count_vertices(geojson), os.path.getsize(path) / 1024))
+
+    for level, tolerance, decimals, _ in geometry.LEVELS:
+        start = time.perf_counter()
+        simplified = geometry.simplify_geojson(geojson, tolerance, decimals)
+        path = os.path.join(out_dir, "{}_{}.geojson".format(name, level))
+        with open(path, "w") as f:
+            json.dump(simplified, f, separators=(",", ":"))
+        compression.write_precompressed(path)
+        print("{} {}: {} vertices, {:.1f} kB, {:.2f}s -> {}".format(
+            name, level, geometry.count_vertices(simplified), os.path.getsize(path) / 1024,
+            time.perf_counter() - start, path))
+
+
+def cma_boundaries(path):
+    """CMA boundaries from the shapefile, labelled with the crime data's Geography names"""
+    try:
+        data = crime_data.load_data()
+        known = set(data.loc[data["Geo_Level"] == "CMA", "Geography"].unique())
+    except OSError:
+        print("Crime data not found, CMA names are derived from the boundary file only")
+        known = set()
+
+    cmas = geometry.read_shapefile(path)
+    # CMATYPE B is a census metropolitan area, D and K are smaller census agglomerations
+    cmas["features"] = [f for f in cmas["features"] if f["properties"]["CMATYPE"] == "B"]
+    for feature in cmas["features"]:
+        props = feature["properties"]
+        feature["properties"] = {
+            "Geography": geometry.cma_geography(props["CMANAME"], props["PRNAME"], known),
+            "CMANAME": props["CMANAME"],
+            "PRNAME": props["PRNAME"]
+        }
+    unmatched = sorted(f["properties"]["Geography"] for f in cmas["features"] if known and f["properties"]["Geography"] not in known)
+    if unmatched:
+        print("CMAs without crime data: " + "; ".join(unmatched))
+    return cmas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build simplified province and CMA boundaries")
+    parser.add_argument("--provinces", default="data/processed/provinces.geojson")
+    parser.add_argument("--cma", default="data/raw/shp/cma.shp")
+    parser.add_argument("--out-dir", default="data/processed")
+    args = parser.parse_args()
+
+    with open(args.provinces) as f:
+        provinces = json.load(f)
+    name = os.path.splitext(os.path.basename(args.provinces))[0]
+    write_levels(provinces, name, args.out_dir, write_full=False)
+    compression.write_precompressed(args.provinces)
+    write_levels(cma_boundaries(args.cma), "cma", args.out_dir)
+
+
+if __name__ == '__main__':
+    main()
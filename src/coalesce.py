@@ -0,0 +1,179 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Coalescing of rapid updates from one browser session
+
+Stepping the year slider sends a chart update per step, and the browser only
+shows the last one. `Coalescer` numbers the updates of every (session,
+chart) pair; an update that is no longer the newest after a short wait is
+dropped (PreventUpdate) before rendering, and a stale result is not sent.
+
+The counters live in shared memory created at import, so with gunicorn's
+preload the workers forked from the master see each other's updates. Without
+preload every worker only coalesces the updates it receives itself.
+
+A worker killed while holding the shared lock (e.g. by gunicorn's timeout)
+leaves it held for good, so the lock is only waited for briefly: a process
+that cannot get it stops coalescing and renders every update.
+"""
+
+import hashlib
+import multiprocessing
+import time
+
+from dash.exceptions import PreventUpdate
+
+
+class Coalescer:
+    """Drop updates superseded by a newer one from the same session
+
+    Parameters
+    -------
+    window : Float
+        Seconds an update waits for a newer one before rendering, 0 to only drop stale results
+    slots : Int
+        Number of (session, chart) pairs tracked at once, pairs sharing a slot are
+        just not coalesced
+    lock_timeout : Float
+        Seconds to wait for the shared lock before giving up on coalescing in this process
+    """
+
+    def __init__(self, window=0.05, slots=4096, lock_timeout=0.1):
+        self.window = window
+        self.lock_timeout = lock_timeout
+        self.disabled = False
+        self._lock = multiprocessing.Lock()
+        self._keys = multiprocessing.RawArray("Q", slots)
+        self._tickets = multiprocessing.RawArray("Q", slots)
+        self._last_ticket = multiprocessing.RawValue("Q", 0)
+        self._pending = multiprocessing.RawValue("q", 0)
+        self._peak_pending = multiprocessing.RawValue("q", 0)
+        self._rendered = multiprocessing.RawValue("Q", 0)
+        self._dropped = multiprocessing.RawValue("Q", 0)
+        self._stale = multiprocessing.RawValue("Q", 0)
+        self._failed = multiprocessing.RawValue("Q", 0)
+
+    def _acquire(self):
+        """Take the shared lock, or disable coalescing in this process if it stays held"""
+        if self.disabled:
+            return False
+        if self._lock.acquire(timeout=self.lock_timeout):
+            return True
+        self.disabled = True
+        return False
+
+    def claim(self, session, channel):
+        """Register an update, returns the claim to check with `superseded`, None if disabled"""
+        digest = hashlib.blake2b("{}\0{}".format(session, channel).encode(), digest_size=8).digest()
+        # never 0, which marks an empty slot
+        key = int.from_bytes(digest, "little") | 1
+        slot = key % len(self._keys)
+        if not self._acquire():
+            return None
+        try:
+            self._last_ticket.value += 1
+            ticket = self._last_ticket.value
+            self._keys[slot] = key
+            self._tickets[slot] = ticket
+            self._pending.value += 1
+            self._peak_pending.value = max(self._peak_pending.value, self._pending.value)
+        finally:
+            self._lock.release()
+        return slot, key, ticket
+
+    def superseded(self, claim):
+        """Whether a newer update of the same session and chart was claimed since"""
+        slot, key, ticket = claim
+        if not self._acquire():
+            # better to render or send an old update than to drop the newest
+            return False
+        try:
+            return self._keys[slot] == key and self._tickets[slot] > ticket
+        finally:
+            self._lock.release()
+
+    def _count(self, counter):
+        if not self._acquire():
+            return
+        try:
+            counter.value += 1
+            self._pending.value -= 1
+        finally:
+            self._lock.release()
+
+    def run(self, channel, session, func, *args):
+        """Call `func(*args)` unless a newer update of `channel` arrives from `session`
+
+        Parameters
+        -------
+        String
+            Name of the chart or output being updated
+        String
+            Session id sent by the browser, updates without one are never dropped
+        callable
+            Render function, called with the remaining arguments
+
+        Returns
+        -------
+        object
+            The return value of `func`
+
+        Raises
+        -------
+        PreventUpdate
+            If the update was superseded, the browser keeps waiting for the newer one
+        """
+        if not session:
+            return func(*args)
+        claim = self.claim(session, channel)
+        if claim is None:
+            return func(*args)
+        outcome = self._failed
+        try:
+            if self.window:
+                time.sleep(self.window)
+            if self.superseded(claim):
+                outcome = self._dropped
+                raise PreventUpdate
+            try:
+                result = func(*args)
+            except PreventUpdate:
+                # the function ran and had nothing to update, not a failure
+                outcome = self._rendered
+                raise
+            outcome = self._rendered
+            if self.superseded(claim):
+                # rendered (and cached) for nothing, at least do not send it
+                outcome = self._stale
+                raise PreventUpdate
+            return result
+        finally:
+            self._count(outcome)
+
+    def stats(self):
+        """Counters for health checks and load tests
+
+        Returns
+        -------
+        dict
+            Updates rendered, dropped before rendering, dropped after rendering,
+            failed (the render raised, e.g. render_pool.Busy), in progress and
+            the peak number in progress at once, and whether coalescing is
+            disabled in this process
+        """
+        # a lock that cannot be taken only makes the counters approximate
+        locked = self._lock.acquire(timeout=self.lock_timeout)
+        try:
+            return {
+                "rendered": self._rendered.value,
+                "dropped": self._dropped.value,
+                "stale": self._stale.value,
+                "failed": self._failed.value,
+                "pending": self._pending.value,
+                "peak_pending": self._peak_pending.value,
+                "disabled": self.disabled,
+            }
+        finally:
+            if locked:
+                self._lock.release()
@@ -0,0 +1,93 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Colour scales and class breaks for the choropleth map
+
+The palette is precomputed (it is matplotlib's viridis sampled at 13 colours)
+so workers do not need to import matplotlib just to colour the map.
+"""
+
+import numpy as np
+
+
+# matplotlib.cm.get_cmap('viridis', 13), dark to light
+VIRIDIS = ['#440154', '#481f70', '#443983', '#3b528b', '#31688e', '#287c8e', '#21918c',
+           '#20a486', '#35b779', '#5ec962', '#90d743', '#c8e020', '#fde725']
+
+PALETTES = {"viridis": VIRIDIS}
+
+CLASSING_MODES = ("fixed", "quantile")
+
+
+def _resample(colors, n):
+    """Linearly interpolate a palette to `n` colours"""
+    rgb = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in colors], dtype=float)
+    positions = np.linspace(0, 1, len(colors))
+    targets = np.linspace(0, 1, n)
+    channels = np.column_stack([np.interp(targets, positions, rgb[:, i]) for i in range(3)])
+    return ['#{:02x}{:02x}{:02x}'.format(*row) for row in np.rint(channels).astype(int)]
+
+
+_CACHE = {}
+
+
+def palette(name="viridis", n=13, reverse=False):
+    """Hex colours of a palette, computed once per name, size and direction
+
+    Parameters
+    -------
+    String
+        Name of the palette in `PALETTES`
+    Int
+        Number of colours
+    Boolean
+        Whether to return the colours light to dark
+
+    Returns
+    -------
+    [String]
+        Hex colours
+    """
+    key = (name, n, reverse)
+    colors = _CACHE.get(key)
+    if colors is None:
+        colors = PALETTES[name] if n == len(PALETTES[name]) else _resample(PALETTES[name], n)
+        colors = colors[::-1] if reverse else list(colors)
+        _CACHE[key] = colors
+    return list(colors)
+
+
+def class_breaks(values, n=13, mode="fixed"):
+    """Lower bounds of the colour classes for a set of values
+
+    Parameters
+    -------
+    iterable
+        Values shown on the map
+    Int
+        Number of classes
+    String
+        "fixed" for equal-width classes between the (rounded) minimum and
+        maximum, "quantile" for classes holding about the same number of values
+
+    Returns
+    -------
+    [Float], Float, Float
+        Class breaks, and the minimum and maximum of the colorbar
+    """
+    vals = np.fromiter((v for v in values if v is not None), dtype=float)
+    vals = vals[~np.isnan(vals)]
+    if vals.size == 0:
+        vals = np.zeros(1)
+    vmin = max(0, int(vals.min()))
+    vmax = max(10, int(vals.max()) + 0.01)
+
+    if mode == "fixed":
+        breaks = np.linspace(vmin, vmax, num=n)
+    elif mode == "quantile":
+        breaks = np.maximum(np.quantile(vals, np.linspace(0, 1, num=n)), vmin)
+        breaks[0] = vmin
+    else:
+        raise ValueError("Unknown classing mode {!r}, expected one of {}".format(mode, CLASSING_MODES))
+    return breaks.tolist(), vmin, vmax
@@ -0,0 +1,251 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Response compression helpers
+
+Picks the best content encoding a client accepts and compresses bodies with
+it. Brotli is used when the optional `brotli` package is installed, gzip
+otherwise. `CompressionMiddleware` applies this to every response of the
+server, static files can be compressed once ahead of time instead.
+"""
+
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def accepted_encoding(accept_encoding, available=ENCODINGS):
+    """The preferred encoding of `available` allowed by an Accept-Encoding header, or None
+
+    Parameters
+    -------
+    String
+        Value of the Accept-Encoding request header
+    (String)
+        Encodings that can be served, preferred first
+
+    Returns
+    -------
+    String
+        Encoding to use, None for an uncompressed response
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    """Compress bytes with an encoding returned by `accepted_encoding`"""
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def precompress(body, best=False):
+    """Every encoding of a static body, to serve without compressing per request
+
+    Parameters
+    -------
+    bytes
+        Uncompressed body
+    Boolean
+        Use the slowest, smallest settings, for files compressed at build time
+
+    Returns
+    -------
+    dict
+        Encoding (None for uncompressed) to body
+    """
+    encoded = {None: body}
+    for encoding in ENCODINGS:
+        if encoding == "br":
+            encoded[encoding] = brotli.compress(body, quality=11 if best else 5)
+        else:
+            encoded[encoding] = gzip.compress(body, compresslevel=9 if best else 6)
+    return encoded
+
+
+SUFFIXES = {"gzip": ".gz", "br": ".br"}
+# Next to the compressed copies of a file, the digest of the content they were made from
+DIGEST_SUFFIX = ".sha256"
+
+
+def _digest(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def write_precompressed(path):
+    """Write the compressed copies of a static file next to it, e.g. provinces_low.geojson.gz
+
+    The digest of the file is written last, as provinces_low.geojson.sha256,
+    and tells `load_precompressed` which content the copies hold.
+
+    Returns
+    -------
+    dict
+        Encoding (None for uncompressed) to body
+    """
+    with open(path, "rb") as f:
+        encoded = precompress(f.read(), best=True)
+    for encoding, suffix in SUFFIXES.items():
+        if encoding in encoded:
+            with open(path + suffix, "wb") as f:
+                f.write(encoded[encoding])
+    with open(path + DIGEST_SUFFIX, "w") as f:
+        f.write(_digest(encoded[None]))
+    return encoded
+
+
+def load_precompressed(path, body):
+    """Every encoding of a static file, from the copies written by `write_precompressed`
+
+    The copies are used when the digest written with them is the digest of
+    the file as it is now, whatever the modification times (a git checkout
+    sets them arbitrarily). Missing or outdated copies are written again,
+    or only compressed in memory if the directory is read-only.
+
+    Parameters
+    -------
+    String
+        Path of the file
+    bytes
+        Body served for the file (which may be a re-serialization of it)
+
+    Returns
+    -------
+    dict
+        Encoding (None for uncompressed) to body
+    """
+    encoded = {None: body}
+    copies = _fresh_copies(path)
+    if copies is None:
+        try:
+            copies = write_precompressed(path)
+        except OSError:
+            copies = {}
+    for encoding in ENCODINGS:
+        encoded[encoding] = copies[encoding] if encoding in copies else compress(body, encoding)
+    return encoded
+
+
+def _fresh_copies(path):
+    """The compressed copies of a file if they hold its current content, else None"""
+    try:
+        with open(path, "rb") as f:
+            current = _digest(f.read())
+        with open(path + DIGEST_SUFFIX) as f:
+            if f.read().strip() != current:
+                return None
+        copies = {}
+        for encoding in ENCODINGS:
+            with open(path + SUFFIXES[encoding], "rb") as f:
+                copies[encoding] = f.read()
+        return copies
+    except OSError:
+        return None
+
+
+# Content types worth compressing, images and fonts are already compressed
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "application/geo+json", "image/svg+xml")
+
+
+class CompressionMiddleware:
+    """WSGI middleware compressing responses with the best encoding the client accepts
+
+    Only successful responses of a compressible content type, at least
+    `min_size` bytes long and not already encoded are compressed. Other
+    responses (including file downloads) are passed through untouched.
+
+    Parameters
+    -------
+    app : callable
+        WSGI application, e.g. `server.wsgi_app`
+    min_size : Int
+        Smallest body worth compressing, in bytes
+    """
+
+    def __init__(self, app, min_size=1024):
+        self.app = app
+        self.min_size = min_size
+
+    def _compressible(self, status, headers):
+        if not status.startswith("200"):
+            return False
+        values = {name.lower(): value for name, value in headers}
+        if "content-encoding" in values or "no-transform" in values.get("cache-control", ""):
+            return False
+        if not values.get("content-type", "").startswith(COMPRESSIBLE):
+            return False
+        length = values.get("content-length")
+        return length is None or int(length) >= self.min_size
+
+    def __call__(self, environ, start_response):
+        encoding = accepted_encoding(environ.get("HTTP_ACCEPT_ENCODING"))
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        captured = {}
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            captured.update(status=status, headers=headers, exc_info=exc_info)
+            return written.append
+
+        result = self.app(environ, capture)
+        status, headers = captured["status"], captured["headers"]
+        if not self._compressible(status, headers):
+            start_response(status, headers, captured["exc_info"])
+            if not written:
+                return result
+            try:
+                return written + list(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+
+        try:
+            body = b"".join(written + list(result))
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        if len(body) < self.min_size:
+            start_response(status, headers, captured["exc_info"])
+            return [body]
+
+        body = compress(body, encoding)
+        headers = [(name, value) for name, value in headers if name.lower() not in ("content-length", "etag")]
+        vary = [value for name, value in captured["headers"] if name.lower() == "vary"]
+        headers = [(name, value) for name, value in headers if name.lower() != "vary"]
+        headers += [
+            ("Content-Encoding", encoding),
+            ("Content-Length", str(len(body))),
+            ("Vary", ", ".join(vary + ["Accept-Encoding"]))
+        ]
+        # a strong ETag identifies the uncompressed body, mark the compressed one as weak
+        etags = [value for name, value in captured["headers"] if name.lower() == "etag"]
+        if etags:
+            headers.append(("ETag", etags[0] if etags[0].startswith("W/") else "W/" + etags[0]))
+        start_response(status, headers, captured["exc_info"])
+        return [body]
@@ -0,0 +1,790 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Loading, wrangling and columnar storage of the crime statistics data
+
+The raw StatCan extract is a TSV that needs several regex passes before the
+dashboard can use it. `build_store` runs that wrangling once and writes the
+result to a column store (one raw binary file per column plus a `meta.json`
+describing dtypes and category dictionaries). `load_data` reads the store when
+it is fresh and falls back to wrangling the TSV otherwise. `load_columns`
+memory-maps the store instead, so that every gunicorn worker shares one copy
+of the data through the page cache.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+
+TSV_PATH = "data/processed/DSCI532-CDN-CRIME-DATA.tsv"
+STORE_PATH = "data/processed/crime_store"
+# StatCan extracts are Latin-1, not UTF-8
+TSV_ENCODING = "ISO-8859-1"
+
+# Raw columns read by chunked builds, and cleaned columns the dashboard uses
+RAW_COLUMNS = ["Geography", "Year", "Violation Description", "Metric", "Value", "Geo_Level", "Level1 Violation Flag"]
+STORE_COLUMNS = RAW_COLUMNS
+
+# Bump whenever `clean_data` changes so that stale stores are rebuilt
+CLEANING_VERSION = 1
+STORE_FORMAT = 3
+
+# Columns identifying a row: a place (PEI is both a province and a CMA), a
+# violation under its level 1 category, a metric and a year. Every other
+# column is payload, replaced when a revised row is merged
+KEY_COLUMNS = ["Geography", "Geo_Level", "Violation Description", "Level1 Violation Flag", "Metric", "Year"]
+
+
+def read_tsv(path=TSV_PATH):
+    """Read the raw crime statistics TSV
+
+    Parameters
+    -------
+    String
+        Path to the TSV file
+
+    Returns
+    -------
+    pd.DataFrame
+        Unprocessed data
+    """
+    return pd.read_csv(path, sep="\t", encoding=TSV_ENCODING)
+
+
+# StatCan footnote markers such as "Ontario [35]"
+FOOTNOTE = re.compile(r" \[.*\]")
+TOTAL_FLAG = "Total, all violations"
+
+
+def _map_distinct(col, func):
+    """Apply `func` to each distinct value of a column rather than to every row
+
+    Returns
+    -------
+    np.array, np.array
+        Integer codes of the rows into the mapped distinct values (-1 for
+        missing values), and the mapped values followed by NaN
+    """
+    codes, uniques = pd.factorize(col)
+    return codes, np.array([func(x) for x in uniques] + [np.nan], dtype=object)
+
+
+def _strip_footnote(value):
+    return FOOTNOTE.sub("", value) if isinstance(value, str) else value
+
+
+def read_tsv_chunks(path=TSV_PATH, chunksize=1_000_000):
+    """Read the raw TSV lazily in chunks of rows, only the columns `clean_data` needs
+
+    Parameters
+    -------
+    String
+        Path to the TSV file
+    Int
+        Number of rows per chunk
+
+    Returns
+    -------
+    iterator of pd.DataFrame
+        Unprocessed chunks
+    """
+    return pd.read_csv(path, sep="\t", encoding=TSV_ENCODING, chunksize=chunksize,
+                       usecols=lambda name: name in RAW_COLUMNS, dtype={"Value": np.float64})
+
+
+def clean_data(data):
+    """Wrangle the raw crime statistics for use in the dashboard
+
+    Every string transformation runs once per distinct value of a column and
+    is then broadcast to the rows through integer codes, so each column is
+    scanned once whatever the number of categories.
+
+    Parameters
+    -------
+    pd.DataFrame
+        Data as read by `read_tsv`
+
+    Returns
+    -------
+    pd.DataFrame
+        Cleaned data with added `CMA` and `Province` columns
+    """
+    # Strip footnote markers from every string column
+    columns = {}
+    for name in data.columns:
+        if pd.api.types.is_object_dtype(data[name]):
+            columns[name] = _map_distinct(data[name], _strip_footnote)
+
+    # Remove rows with missing values (code -1 in string columns) and total rows
+    keep = np.ones(len(data), dtype=bool)
+    for name in data.columns:
+        keep &= columns[name][0] >= 0 if name in columns else data[name].notna().to_numpy()
+    flag_codes, flags = columns["Level1 Violation Flag"]
+    keep &= ~np.isin(flag_codes, np.flatnonzero(flags == TOTAL_FLAG))
+
+    # Prince Edward Island is reported as a CMA but shown as a province
+    geo_codes, geographies = columns["Geography"]
+    level_codes, levels = columns["Geo_Level"]
+    geo_level = levels[level_codes]
+    pei = np.isin(geo_codes, np.flatnonzero(geographies == "Prince Edward Island"))
+    geo_level[pei & (geo_level == "CMA")] = "PROVINCE"
+
+    # Change subcategory name to All for totals
+    totals = set(flags[np.unique(flag_codes[keep])])
+    desc_codes, descriptions = columns["Violation Description"]
+    descriptions = np.array(["All" if x in totals else x for x in descriptions], dtype=object)
+
+    # Separate 'Geography' into Province and CMA
+    geographies = np.array([x.replace("?", "e") if isinstance(x, str) else x for x in geographies], dtype=object)
+    parts = [re.match(r"^(.*)\,(.*)$", x) if isinstance(x, str) else None for x in geographies]
+    cmas = np.array([m.group(1) if m else np.nan for m in parts], dtype=object)
+    provinces = np.array([m.group(2) if m else np.nan for m in parts], dtype=object)
+
+    geography = geographies[geo_codes]
+    province = provinces[geo_codes]
+    province[geo_level == "PROVINCE"] = geography[geo_level == "PROVINCE"]
+
+    cleaned = {}
+    for name in data.columns:
+        if name == "Geography":
+            cleaned[name] = geography
+        elif name == "Geo_Level":
+            cleaned[name] = geo_level
+        elif name == "Violation Description":
+            cleaned[name] = descriptions[desc_codes]
+        elif name in columns:
+            codes, values = columns[name]
+            cleaned[name] = values[codes]
+        else:
+            cleaned[name] = data[name].to_numpy()
+        cleaned[name] = cleaned[name][keep]
+    cleaned["CMA"] = cmas[geo_codes][keep]
+    cleaned["Province"] = province[keep]
+    return pd.DataFrame(cleaned, index=data.index[keep])
+
+
+def _source_stamp(path):
+    """Describe the source file so a store can be checked for freshness"""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def _code_dtype(n_categories):
+    """Smallest signed integer dtype able to hold category codes (and -1 for missing)"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _int_dtype(values):
+    """Smallest integer dtype holding every value of an integer array, e.g. int16 for years"""
+    if values.size == 0:
+        return values.dtype
+    low, high = values.min(), values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def write_store(data, store=STORE_PATH, source=None):
+    """Write a cleaned dataframe to a column store
+
+    The store is written to a temporary directory and swapped into place so
+    that a running app never sees a half-written store.
+
+    Parameters
+    -------
+    pd.DataFrame
+        Cleaned data
+    String
+        Directory to write the store to
+    dict
+        Optional description of the source file, see `_source_stamp`
+    """
+    _write_table(ColumnTable.from_frame(data), store, source)
+
+
+def _write_table(table, store, source, history=None):
+    """Write the columns of a `ColumnTable` to a store, see `write_store`"""
+    tmp = store + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = []
+    for i, name in enumerate(table.names):
+        values = table.columns[name]
+        filename = "col_{:02d}.bin".format(i)
+        if table.is_category(name):
+            columns.append({"name": name, "kind": "category", "dtype": values.dtype.str,
+                            "categories": table.categories(name).tolist(), "file": filename})
+        else:
+            columns.append({"name": name, "kind": "numeric", "dtype": values.dtype.str, "file": filename})
+        np.ascontiguousarray(values).tofile(os.path.join(tmp, filename))
+
+    _finish_store(tmp, store, table.rows, columns, source, history)
+
+
+def _finish_store(tmp, store, rows, columns, source, history=None):
+    """Write the metadata of a store built in `tmp` and swap it into place
+
+    `history` carries the build id and the incremental updates over from the
+    store being updated, a full build starts a new history.
+    """
+    if history is None:
+        build = hashlib.sha1(json.dumps([source, time.time()]).encode()).hexdigest()[:16]
+        history = {"build": build, "updates": []}
+    meta = {
+        "format": STORE_FORMAT,
+        "cleaning_version": CLEANING_VERSION,
+        "rows": rows,
+        "source": source,
+        "build": history["build"],
+        "updates": history["updates"],
+        "columns": columns
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+
+    old = store + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(store):
+        os.rename(store, old)
+    os.rename(tmp, store)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class StoreWriter:
+    """Write a column store incrementally, one cleaned chunk at a time
+
+    While appending, string columns are encoded as int32 codes into category
+    dictionaries that grow with every chunk and integer columns are written as
+    int64. `close` then sorts the categories and narrows every file to the
+    dtypes `write_store` would have chosen, streaming through the files one
+    block at a time, so memory stays bounded by the chunk and block sizes
+    rather than by the size of the data.
+
+    Parameters
+    -------
+    String
+        Directory to write the store to
+    Int
+        Number of rows rewritten at a time by `close`
+    """
+
+    def __init__(self, store=STORE_PATH, block_rows=1 << 20):
+        self.store = store
+        self.rows = 0
+        self._block_rows = block_rows
+        self._tmp = store + ".tmp"
+        self._columns = None
+        shutil.rmtree(self._tmp, ignore_errors=True)
+        os.makedirs(self._tmp)
+
+    def _start(self, data):
+        """Fix the column layout from the first chunk"""
+        self._columns = []
+        for i, name in enumerate(data.columns):
+            col = data[name]
+            if pd.api.types.is_integer_dtype(col):
+                kind = "integer"
+            elif pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+                kind = "numeric"
+            else:
+                kind = "category"
+            self._columns.append({"name": name, "kind": kind, "file": "col_{:02d}.bin".format(i),
+                                  "codes": {}, "low": None, "high": None})
+
+    def append(self, data):
+        """Append a cleaned chunk, its columns must match the first chunk's"""
+        if self._columns is None:
+            self._start(data)
+        if list(data.columns) != [col["name"] for col in self._columns]:
+            raise ValueError("Chunk columns {} do not match the store".format(list(data.columns)))
+
+        for col in self._columns:
+            values = data[col["name"]]
+            if col["kind"] == "category":
+                codes, uniques = pd.factorize(values)
+                lookup = np.array([col["codes"].setdefault(str(x), len(col["codes"])) for x in uniques] + [-1],
+                                  dtype=np.int32)
+                values = lookup[codes]
+            elif col["kind"] == "integer":
+                values = values.to_numpy()
+                if values.dtype.kind == "f":
+                    # a chunk with missing values is parsed as float, the rows were dropped but not the dtype
+                    if not np.array_equal(values, np.round(values)):
+                        raise ValueError("Column {} is no longer integer".format(col["name"]))
+                values = values.astype(np.int64)
+                if values.size:
+                    col["low"] = values.min() if col["low"] is None else min(col["low"], values.min())
+                    col["high"] = values.max() if col["high"] is None else max(col["high"], values.max())
+            else:
+                values = values.to_numpy(dtype=np.float64)
+            with open(os.path.join(self._tmp, col["file"]), "ab") as f:
+                np.ascontiguousarray(values).tofile(f)
+        self.rows += len(data)
+
+    def _rewrite(self, col, dtype, convert):
+        """Stream a column file through `convert` into its final dtype"""
+        path = os.path.join(self._tmp, col["file"])
+        if self.rows:
+            src = np.memmap(path, dtype=dtype, mode="r", shape=(self.rows,))
+            with open(path + ".new", "wb") as f:
+                for start in range(0, self.rows, self._block_rows):
+                    convert(np.asarray(src[start:start + self._block_rows])).tofile(f)
+            del src
+            os.replace(path + ".new", path)
+
+    def close(self, source=None):
+        """Narrow the columns, write the metadata and swap the store into place
+
+        Parameters
+        -------
+        dict
+            Optional description of the source file, see `_source_stamp`
+
+        Returns
+        -------
+        Int
+            Number of rows written
+        """
+        columns = []
+        for col in self._columns or []:
+            entry = {"name": col["name"], "kind": "numeric", "file": col["file"]}
+            if col["kind"] == "category":
+                categories = sorted(col["codes"])
+                code_dtype = _code_dtype(len(categories))
+                # appended codes -> sorted codes, the last slot keeps -1 for missing values
+                remap = np.full(len(categories) + 1, -1, dtype=code_dtype)
+                for new, value in enumerate(categories):
+                    remap[col["codes"][value]] = new
+                self._rewrite(col, np.int32, lambda codes: remap[codes])
+                entry.update(kind="category", dtype=code_dtype.str, categories=categories)
+            elif col["kind"] == "integer":
+                dtype = _int_dtype(np.array([col["low"], col["high"]]) if col["low"] is not None else np.empty(0, np.int64))
+                self._rewrite(col, np.int64, lambda values: values.astype(dtype))
+                entry["dtype"] = dtype.str
+            else:
+                entry["dtype"] = np.dtype(np.float64).str
+            columns.append(entry)
+        _finish_store(self._tmp, self.store, self.rows, columns, source)
+        return self.rows
+
+    def abort(self):
+        """Throw away a partially written store"""
+        shutil.rmtree(self._tmp, ignore_errors=True)
+
+
+def read_store_meta(store=STORE_PATH):
+    """Read the metadata of a column store, or None if there is no store"""
+    try:
+        with open(os.path.join(store, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ColumnTable:
+    """Read-only columns of the cleaned data as numpy arrays
+
+    Numeric columns hold their values, string columns hold integer codes into
+    a category dictionary. When the table is mapped from a column store the
+    arrays are read-only views of the OS page cache, so every process mapping
+    the same store shares one copy of the data.
+
+    Parameters
+    -------
+    dict
+        Column name to numpy array, all of the same length, in column order
+    dict
+        Column name to list of categories, for the string columns
+    StoreHistory
+        Build and updates of the store the table was mapped from, if any
+    """
+
+    def __init__(self, columns, categories, history=None):
+        self.columns = columns
+        self.history = history
+        self.names = list(columns)
+        self.rows = len(next(iter(columns.values()))) if columns else 0
+        self._dtypes = {name: pd.CategoricalDtype(values) for name, values in categories.items()}
+
+    @classmethod
+    def from_frame(cls, data):
+        """Encode a cleaned dataframe
+
+        String columns become the smallest integer codes able to index their
+        categories and integer columns are narrowed to the smallest integer
+        dtype holding their values (`Year` fits in an int16).
+        """
+        columns, categories = {}, {}
+        for name in data.columns:
+            col = data[name]
+            if pd.api.types.is_integer_dtype(col):
+                values = col.to_numpy()
+                columns[name] = values.astype(_int_dtype(values))
+            elif pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+                columns[name] = col.to_numpy()
+            else:
+                cat = pd.Categorical(col)
+                categories[name] = [str(x) for x in cat.categories]
+                columns[name] = cat.codes.astype(_code_dtype(len(categories[name])))
+        return cls(columns, categories)
+
+    def is_category(self, name):
+        return name in self._dtypes
+
+    def categories(self, name):
+        """Category dictionary of a string column"""
+        return self._dtypes[name].categories
+
+    def encode(self, name, values):
+        """Codes (string columns) or values (numeric columns) to compare a column against, unknown values dropped"""
+        if not self.is_category(name):
+            return np.asarray(values, dtype=self.columns[name].dtype)
+        codes = self.categories(name).get_indexer(list(values))
+        return codes[codes >= 0]
+
+    def decode(self, name, rows=None):
+        """Python values of a column, optionally only for some rows"""
+        values = self.columns[name] if rows is None else self.columns[name][rows]
+        if self.is_category(name):
+            values = self.categories(name).to_numpy()[values]
+        return values.tolist()
+
+    def take(self, rows, columns=None):
+        """Copy some rows into a dataframe with categorical string columns
+
+        Parameters
+        -------
+        np.array
+            Row positions
+        [String]
+            Optional columns to include, all by default
+
+        Returns
+        -------
+        pd.DataFrame
+            The rows, indexed by their position in the table
+        """
+        frame = {}
+        for name in columns or self.names:
+            values = self.columns[name][rows]
+            if self.is_category(name):
+                values = pd.Categorical.from_codes(values, dtype=self._dtypes[name])
+            frame[name] = values
+        return pd.DataFrame(frame, index=rows)
+
+    def to_frame(self):
+        """The whole table as a dataframe"""
+        return self.take(np.arange(self.rows))
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values())
+
+
+class StoreHistory:
+    """Build id of a column store and the incremental updates applied to it since
+
+    Parameters
+    -------
+    String
+        Id of the full build, the same in every process mapping the store
+    [dict]
+        Updates written by `update_store`, oldest first
+    """
+
+    def __init__(self, build, updates=()):
+        self.build = build
+        # generation and changed geographies by year of every update
+        self.updates = [(update["generation"],
+                         {int(year): frozenset(geographies) for year, geographies in update["changes"].items()})
+                        for update in updates]
+
+    @property
+    def generation(self):
+        """Number of updates applied"""
+        return self.updates[-1][0] if self.updates else 0
+
+    def generation_for(self, years=None, geographies=None):
+        """The last update changing rows of any of `years` and any of `geographies`
+
+        Parameters
+        -------
+        [Int]
+            Years, None for every year
+        [String]
+            Values of the `Geography` column, None for every geography
+
+        Returns
+        -------
+        Int
+            Generation of the update, 0 if none changed them
+        """
+        for generation, changes in reversed(self.updates):
+            for year in changes if years is None else set(years) & changes.keys():
+                if geographies is None or not changes[year].isdisjoint(geographies):
+                    return generation
+        return 0
+
+
+def map_store(store=STORE_PATH, mmap=True):
+    """Open a column store as a `ColumnTable`
+
+    Parameters
+    -------
+    String
+        Directory of the store
+    Boolean
+        Memory-map the column files read-only instead of reading them into
+        process memory
+
+    Returns
+    -------
+    ColumnTable
+        Columns of the store
+    """
+    meta = read_store_meta(store)
+    if meta is None:
+        raise FileNotFoundError("No column store found at " + store)
+
+    columns, categories = {}, {}
+    for col in meta["columns"]:
+        path = os.path.join(store, col["file"])
+        dtype = np.dtype(col["dtype"])
+        if mmap and meta["rows"] > 0:
+            values = np.memmap(path, dtype=dtype, mode="r", shape=(meta["rows"],))
+        else:
+            values = np.fromfile(path, dtype=dtype)
+        columns[col["name"]] = values
+        if col["kind"] == "category":
+            categories[col["name"]] = col["categories"]
+    return ColumnTable(columns, categories, StoreHistory(meta["build"], meta["updates"]))
+
+
+def read_store(store=STORE_PATH):
+    """Read a column store into a dataframe
+
+    Parameters
+    -------
+    String
+        Directory of the store
+
+    Returns
+    -------
+    pd.DataFrame
+        Cleaned data with categorical dtypes for string columns
+    """
+    table = map_store(store, mmap=False)
+    data = table.to_frame()
+    data.index = pd.RangeIndex(table.rows)
+    return data
+
+
+def store_is_fresh(store=STORE_PATH, source=TSV_PATH):
+    """Check whether a column store can be used in place of the source TSV
+
+    The store is fresh when it was built with the current cleaning rules and
+    from the current version of the source. A store without a source TSV next
+    to it (e.g. a deploy that only ships the store) is also considered fresh.
+
+    Returns
+    -------
+    Boolean
+        True if the store exists and is up to date
+    """
+    meta = read_store_meta(store)
+    if meta is None or meta.get("format") != STORE_FORMAT or meta.get("cleaning_version") != CLEANING_VERSION:
+        return False
+    if not os.path.exists(source):
+        return True
+    built_from = meta.get("source") or {}
+    current = _source_stamp(source)
+    return built_from.get("mtime") == current["mtime"] and built_from.get("size") == current["size"]
+
+
+def build_store(source=TSV_PATH, store=STORE_PATH, chunksize=None):
+    """Wrangle the source TSV and write the result to a column store
+
+    Parameters
+    -------
+    String
+        Path to the TSV file
+    String
+        Directory to write the store to
+    Int
+        Optional number of rows to read, clean and write at a time. Chunked
+        builds keep memory bounded whatever the size of the source, and only
+        keep the `STORE_COLUMNS` used by the dashboard.
+
+    Returns
+    -------
+    Int
+        Number of rows written
+    """
+    if chunksize is None:
+        data = clean_data(read_tsv(source))
+        write_store(data, store, source=_source_stamp(source))
+        return len(data)
+
+    writer = StoreWriter(store)
+    try:
+        for chunk in read_tsv_chunks(source, chunksize):
+            writer.append(clean_data(chunk)[STORE_COLUMNS])
+        return writer.close(source=_source_stamp(source))
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def _row_keys(columns, names):
+    """One hash per row of the identifying columns"""
+    frame = pd.DataFrame({name: np.asarray(columns[name], dtype=np.float64 if columns[name].dtype.kind == "f" else np.int64)
+                          for name in names})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def update_store(source, store=STORE_PATH):
+    """Merge new or revised rows into a column store without rebuilding it
+
+    Only the rows of `source` (e.g. the extract of a newly published year)
+    are wrangled, with the same rules as a full build. A row replaces the
+    stored row with the same `KEY_COLUMNS`, other rows are appended. The
+    changed years and geographies are recorded in the store's history, so
+    caches can drop only what they affect.
+
+    Parameters
+    -------
+    String
+        Path to a TSV with the columns of the raw extract
+    String
+        Directory of the store to update
+
+    Returns
+    -------
+    dict
+        Rows in the store, rows added, revised and unchanged, and the
+        changed years and geographies
+    """
+    meta = read_store_meta(store)
+    if meta is None or meta.get("format") != STORE_FORMAT or meta.get("cleaning_version") != CLEANING_VERSION:
+        raise ValueError("No up to date column store at {}, run build_data.py first".format(store))
+    table = map_store(store, mmap=False)
+    update = clean_data(read_tsv(source))
+    missing = [name for name in table.names if name not in update.columns]
+    if missing:
+        raise ValueError("Update is missing the columns {}".format(missing))
+    update = update[table.names]
+
+    # Both sides in the merged (sorted) category dictionaries
+    old, new, categories = {}, {}, {}
+    for name in table.names:
+        if table.is_category(name):
+            merged = pd.Index(sorted(set(table.categories(name)) | set(update[name].dropna().astype(str))))
+            # -1 (missing) stays -1
+            remap = np.append(merged.get_indexer(table.categories(name)), -1)
+            old[name] = remap[table.columns[name]]
+            new[name] = merged.get_indexer(update[name])
+            categories[name] = merged.tolist()
+        else:
+            old[name] = np.asarray(table.columns[name])
+            new[name] = update[name].to_numpy()
+
+    old_keys, new_keys = _row_keys(old, KEY_COLUMNS), _row_keys(new, KEY_COLUMNS)
+    # the last of duplicated rows of the update wins
+    last = ~pd.Index(new_keys).duplicated(keep="last")
+    new = {name: values[last] for name, values in new.items()}
+    new_keys = new_keys[last]
+
+    existed = pd.Index(new_keys).isin(old_keys)
+    same = existed.copy()
+    unique = ~pd.Index(old_keys).duplicated(keep="last")
+    for name in table.names:
+        if name in KEY_COLUMNS:
+            continue
+        previous = pd.Series(old[name][unique], index=old_keys[unique]).reindex(new_keys).to_numpy()
+        value = new[name]
+        if value.dtype.kind == "f":
+            same &= (previous == value) | (np.isnan(previous) & np.isnan(value))
+        else:
+            same &= previous == value
+    changed = ~same
+
+    changes = {}
+    for year, code in set(zip(new["Year"][changed].tolist(), new["Geography"][changed].tolist())):
+        changes.setdefault(year, set()).add(categories["Geography"][code])
+    summary = {
+        "rows": table.rows,
+        "added": int((~existed).sum()),
+        "revised": int((existed & changed).sum()),
+        "unchanged": int(same.sum()),
+        "years": sorted(changes),
+        "geographies": sorted(set().union(*changes.values())),
+    }
+    if not changes:
+        return summary
+
+    keep = ~np.isin(old_keys, new_keys[changed])
+    columns = {}
+    for name in table.names:
+        values = np.concatenate([old[name][keep], new[name][changed]])
+        if name in categories:
+            values = values.astype(_code_dtype(len(categories[name])))
+        elif values.dtype.kind in "iu":
+            values = values.astype(_int_dtype(values))
+        columns[name] = values
+
+    generation = (meta["updates"][-1]["generation"] if meta["updates"] else 0) + 1
+    history = {"build": meta["build"], "updates": meta["updates"] + [{
+        "generation": generation,
+        "source": _source_stamp(source),
+        "applied_at": time.time(),
+        "added": summary["added"],
+        "revised": summary["revised"],
+        "changes": {str(year): sorted(changes[year]) for year in sorted(changes)},
+    }]}
+    merged = ColumnTable(columns, categories)
+    _write_table(merged, store, meta["source"], history)
+    summary["rows"] = merged.rows
+    return summary
+
+
+def load_data(source=TSV_PATH, store=STORE_PATH):
+    """Load the cleaned data, preferring a fresh column store over the TSV
+
+    Returns
+    -------
+    pd.DataFrame
+        Cleaned data
+    """
+    if store_is_fresh(store, source):
+        return read_store(store)
+    return clean_data(read_tsv(source))
+
+
+def load_columns(source=TSV_PATH, store=STORE_PATH, mmap=True):
+    """Load the cleaned data as a `ColumnTable`, mapping the column store when it is fresh
+
+    A stale or missing store is not rebuilt here, as several workers could be
+    starting at once: the TSV is wrangled in process memory instead and
+    `build_data.py` should be run to rebuild the store.
+
+    Returns
+    -------
+    ColumnTable
+        Cleaned data
+    """
+    if store_is_fresh(store, source):
+        return map_store(store, mmap=mmap)
+    return ColumnTable.from_frame(clean_data(read_tsv(source)))
@@ -0,0 +1,119 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Content-addressed JSON data files for the charts
+
+Instead of inlining their rows in the html, the charts reference the data of
+a query slice by URL. The URL is derived from a hash of the data, so it never
+changes meaning: browsers and CDNs may cache it forever, and the same slice
+rendered again (another highlighted CMA, the slider coming back to a year) is
+not downloaded twice.
+
+The files are written to a directory, together with gzip (and brotli, when
+available) compressed copies, so that every worker on the host can serve
+data published by any other worker. Hosts behind one load balancer need the
+directory on shared storage.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+import compression
+
+
+DIGEST = re.compile(r"^[0-9a-f]{20}$")
+
+SUFFIXES = {None: "", "gzip": ".gz", "br": ".br"}
+
+
+class DataUrls:
+    """Publish JSON payloads under URLs derived from their content
+
+    Parameters
+    -------
+    directory : String
+        Where the payloads are written, created if needed
+    prefix : String
+        URL path the payloads are served under, see `app.chart_data`
+    max_files : Int
+        Number of payloads kept, the least recently published are removed first
+    """
+
+    def __init__(self, directory, prefix="/data", max_files=10000):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_files = max_files
+        self._published = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest, encoding=None):
+        return os.path.join(self.directory, digest + ".json" + SUFFIXES[encoding])
+
+    def _write(self, path, body):
+        """Write a file atomically, other workers may be writing the same one"""
+        tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)
+
+    def publish(self, values):
+        """Store JSON-serializable data and return its URL
+
+        Parameters
+        -------
+        list or dict
+            Data to serve, e.g. the records of `altair.to_values`
+
+        Returns
+        -------
+        String
+            URL path of the data
+        """
+        body = json.dumps(values, separators=(",", ":")).encode()
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        path = self._path(digest)
+        if os.path.exists(path):
+            # keep recently used payloads from being pruned
+            os.utime(path)
+        else:
+            for encoding in compression.ENCODINGS:
+                self._write(self._path(digest, encoding), compression.compress(body, encoding))
+            # the uncompressed file last, its presence marks the payload complete
+            self._write(path, body)
+            with self._lock:
+                self._published += 1
+                prune = self._published % 256 == 0
+            if prune:
+                self.prune()
+        return "{}/{}.json".format(self.prefix, digest)
+
+    def read(self, digest, encoding=None):
+        """The payload for a digest, compressed with `encoding`, or None if unknown"""
+        if not DIGEST.match(digest):
+            return None
+        try:
+            with open(self._path(digest, encoding), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def prune(self):
+        """Remove the least recently published payloads beyond `max_files`"""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+            if len(names) <= self.max_files:
+                return
+            names.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+        except OSError:
+            return
+        for name in names[:len(names) - self.max_files]:
+            for suffix in SUFFIXES.values():
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except OSError:
+                    pass
@@ -0,0 +1,206 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Process-wide provider for the dashboard data
+
+Callbacks ask the provider for the current `Snapshot` instead of holding on to
+a module-level dataframe. The provider loads the data once, reloads it on
+demand or when one of the watched source files changes, and swaps the new
+snapshot in atomically so a callback that already holds a snapshot keeps a
+consistent view of the data until it returns. Code that calls `get` several
+times, e.g. to build a cache key and then compute the value, pins the
+snapshot of its thread with `pinned`.
+
+Snapshots loaded from the same data in different processes have the same
+`identity`, which a render process uses to check it answers with the data
+of the worker that asked (see render_pool.py).
+"""
+
+import contextlib
+import hashlib
+import os
+import threading
+import time
+
+
+class StaleSnapshot(Exception):
+    """The data with the requested identity could not be loaded, the files changed since"""
+
+
+class Snapshot:
+    """One loaded version of the data
+
+    Attributes
+    -------
+    data : crime_data.ColumnTable or pd.DataFrame
+        The cleaned data, as returned by the provider's loader
+    version : Int
+        Increases by one every time the data is (re)loaded
+    fingerprint : String
+        Identifies the watched source files the data was loaded from, the
+        same in every process loading them
+    identity : object
+        Identifies the loaded data, the same in every process loading it: the
+        provider's identity of the data, the fingerprint by default
+    loaded_at : Float
+        Unix time the snapshot was loaded
+    index : object
+        Lookup structure built from `data` by the provider's indexer, if any
+    """
+
+    def __init__(self, data, version, loaded_at, index=None, fingerprint=None, identity=None):
+        self.data = data
+        self.version = version
+        self.fingerprint = fingerprint
+        self.identity = identity if identity is not None else fingerprint
+        self.loaded_at = loaded_at
+        self.index = index
+
+
+class DatasetProvider:
+    """Load the data once and hand out consistent snapshots of it
+
+    Parameters
+    -------
+    loader : callable
+        Function with no arguments returning the cleaned dataframe
+    watch : [String]
+        Files whose modification time triggers a reload when it changes
+    check_interval : Float
+        Minimum number of seconds between two checks of the watched files
+    indexer : callable
+        Optional function building a lookup structure from the loaded data,
+        available as `Snapshot.index`
+    identity : callable
+        Optional function of the loaded data returning what identifies it in
+        every process, e.g. the build of a store. None falls back to the
+        fingerprint of the watched files
+    """
+
+    def __init__(self, loader, watch=(), check_interval=5.0, indexer=None, identity=None):
+        self._loader = loader
+        self._indexer = indexer
+        self._identity = identity
+        self._local = threading.local()
+        self._watch = list(watch)
+        self._check_interval = check_interval
+        self._load_lock = threading.Lock()
+        self._snapshot = None
+        self._mtimes = None
+        self._last_check = 0.0
+        self.load_count = 0
+
+    def _read_mtimes(self):
+        mtimes = []
+        for path in self._watch:
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def reload(self):
+        """Load the data and swap it in as the current snapshot
+
+        Returns
+        -------
+        Snapshot
+            The newly loaded snapshot
+        """
+        with self._load_lock:
+            mtimes = self._read_mtimes()
+            data = self._loader()
+            index = self._indexer(data) if self._indexer is not None else None
+            version = self._snapshot.version + 1 if self._snapshot is not None else 1
+            self._mtimes = mtimes
+            self._last_check = time.monotonic()
+            self.load_count += 1
+            # A single attribute assignment, so readers see either the old or the new snapshot
+            fingerprint = hashlib.sha1(repr(list(zip(self._watch, mtimes))).encode()).hexdigest()[:16]
+            identity = self._identity(data) if self._identity is not None else None
+            self._snapshot = Snapshot(data, version, time.time(), index, fingerprint, identity)
+            return self._snapshot
+
+    def _is_stale(self):
+        now = time.monotonic()
+        if now - self._last_check < self._check_interval:
+            return False
+        self._last_check = now
+        return self._read_mtimes() != self._mtimes
+
+    def get(self):
+        """Return the current snapshot, loading or reloading the data if needed
+
+        Only one thread reloads a stale snapshot; other threads keep being
+        served the previous snapshot in the meantime. Within `pinned`, the
+        pinned snapshot.
+
+        Returns
+        -------
+        Snapshot
+            The current snapshot
+        """
+        snapshot = getattr(self._local, "snapshot", None)
+        if snapshot is not None:
+            return snapshot
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._load_lock:
+                snapshot = self._snapshot
+            return snapshot if snapshot is not None else self.reload()
+
+        if self._watch and self._is_stale() and not self._load_lock.locked():
+            return self.reload()
+        return snapshot
+
+    @contextlib.contextmanager
+    def pinned(self, identity=None):
+        """Make `get` return the same snapshot in the calling thread until the block exits
+
+        Nested blocks keep the snapshot of the outermost one.
+
+        Parameters
+        -------
+        object
+            Optional identity the snapshot must have, the data is reloaded if
+            the current snapshot has another one
+
+        Yields
+        -------
+        Snapshot
+            The pinned snapshot
+
+        Raises
+        -------
+        StaleSnapshot
+            If the data loaded has another identity still, as the files changed since
+        """
+        outer = getattr(self._local, "snapshot", None)
+        snapshot = outer or self.get()
+        if identity is not None and snapshot.identity != identity:
+            if outer is None:
+                snapshot = self.reload()
+            if snapshot.identity != identity:
+                raise StaleSnapshot("data {} loaded, {} requested".format(snapshot.identity, identity))
+        self._local.snapshot = snapshot
+        try:
+            yield snapshot
+        finally:
+            self._local.snapshot = outer
+
+    def status(self):
+        """Summary of the provider state for monitoring
+
+        Returns
+        -------
+        dict
+            Current version and fingerprint, number of loads and load time of the current snapshot
+        """
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else 0,
+            "fingerprint": snapshot.fingerprint if snapshot else None,
+            "load_count": self.load_count,
+            "loaded_at": snapshot.loaded_at if snapshot else None
+        }
@@ -0,0 +1,465 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Topology-preserving simplification of the map boundaries
+
+Borders shared by two provinces must be simplified the same way on both sides,
+otherwise gaps and overlaps appear between them. Rings are therefore split into
+arcs at the points where the set of rings sharing a vertex changes, every arc
+is simplified once with Douglas-Peucker, and the rings are put back together
+from the simplified arcs. Coordinates are rounded to a fixed number of decimals
+before anything else, which also makes nearly identical border vertices match.
+"""
+
+import copy
+import os
+import re
+import struct
+import unicodedata
+
+import numpy as np
+
+
+# Simplification levels served to the map: name, tolerance (degrees),
+# coordinate decimals and the highest map zoom the level is used for
+LEVELS = [
+    ("low", 0.1, 2, 3),
+    ("medium", 0.02, 3, 5),
+    ("high", 0.005, 4, 7),
+]
+
+
+def level_for_zoom(zoom, levels=LEVELS):
+    """Name of the coarsest level detailed enough for a map zoom, None for full resolution"""
+    for name, _, _, max_zoom in levels:
+        if zoom is None or zoom <= max_zoom:
+            return name
+    return None
+
+
+def geometry_url(name, level):
+    """Url the app serves a boundary file at, see `map_geometry` in app.py"""
+    return "/geometry/{}/{}.json".format(name, level or "full")
+
+
+def _douglas_peucker(points, tolerance):
+    """Indices of the points kept when simplifying an open line
+
+    Parameters
+    -------
+    np.array
+        (n, 2) array of coordinates
+    Float
+        Maximum distance of a dropped point to the simplified line
+
+    Returns
+    -------
+    [Int]
+        Sorted indices of the kept points, always including both ends
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        segment = end - start
+        inner = points[first + 1:last] - start
+        length = np.hypot(*segment)
+        if length == 0:
+            dist = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            dist = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def _quantize_ring(ring, decimals):
+    """Round a ring's coordinates and drop consecutive duplicates, returns an open ring"""
+    points = []
+    for x, y in ring:
+        point = (round(x, decimals), round(y, decimals))
+        if not points or points[-1] != point:
+            points.append(point)
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return points
+
+
+def _polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+
+class _ArcSimplifier:
+    """Simplify arcs so that an arc shared by two rings is simplified once"""
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self._cache = {}
+
+    def simplify(self, arc):
+        key = tuple(arc)
+        backwards = key[::-1]
+        reverse = backwards < key
+        if reverse:
+            key = backwards
+        result = self._cache.get(key)
+        if result is None:
+            kept = _douglas_peucker(np.array(key), self.tolerance)
+            result = [key[i] for i in kept]
+            self._cache[key] = result
+        return result[::-1] if reverse else result
+
+
+def simplify_geojson(geojson, tolerance, decimals):
+    """Simplify every polygon of a FeatureCollection without opening gaps between neighbours
+
+    Parameters
+    -------
+    dict
+        GeoJSON FeatureCollection of Polygon / MultiPolygon features
+    Float
+        Douglas-Peucker tolerance in coordinate units
+    Int
+        Number of decimals coordinates are rounded to
+
+    Returns
+    -------
+    dict
+        A simplified copy of the FeatureCollection
+    """
+    # Quantize every ring and record which rings use each vertex
+    rings = []
+    members = {}
+    for f, feature in enumerate(geojson["features"]):
+        for p, polygon in enumerate(_polygons(feature["geometry"])):
+            for r, ring in enumerate(polygon):
+                points = _quantize_ring(ring, decimals)
+                ring_id = len(rings)
+                rings.append((f, p, r, points))
+                for point in points:
+                    members.setdefault(point, set()).add(ring_id)
+
+    simplifier = _ArcSimplifier(tolerance)
+    simplified = {}
+    for ring_id, (f, p, r, points) in enumerate(rings):
+        n = len(points)
+        if n < 4:
+            simplified[(f, p, r)] = points
+            continue
+        # A vertex ends an arc where the set of rings sharing it changes
+        fixed = [i for i in range(n)
+                 if members[points[i]] != members[points[i - 1]] or members[points[i]] != members[points[(i + 1) % n]]]
+        if not fixed:
+            # Unshared ring, split it at the vertex farthest from the first one
+            far = int(np.argmax(np.hypot(*(np.array(points) - points[0]).T)))
+            fixed = [0, far] if far else [0]
+        out = []
+        for start, end in zip(fixed, fixed[1:] + [fixed[0] + n]):
+            arc = [points[i % n] for i in range(start, end + 1)]
+            out.extend(simplifier.simplify(arc)[:-1])
+        simplified[(f, p, r)] = out
+
+    result = copy.deepcopy({k: v for k, v in geojson.items() if k != "features"})
+    result["features"] = []
+    for f, feature in enumerate(geojson["features"]):
+        polygons = []
+        for p, polygon in enumerate(_polygons(feature["geometry"])):
+            new_polygon = []
+            for r in range(len(polygon)):
+                points = simplified[(f, p, r)]
+                if len(points) >= 3:
+                    new_polygon.append([list(pt) for pt in points + points[:1]])
+                elif r == 0:
+                    break  # outer ring collapsed, drop the polygon with its holes
+            if new_polygon:
+                polygons.append(new_polygon)
+        if not polygons:
+            # Never drop a whole feature, fall back to its largest quantized polygon
+            polygon = max(_polygons(feature["geometry"]), key=lambda x: len(x[0]))
+            outer = _quantize_ring(polygon[0], decimals)
+            polygons = [[[list(pt) for pt in outer + outer[:1]]]]
+        result["features"].append({
+            "type": "Feature",
+            "properties": dict(feature["properties"]),
+            "geometry": {"type": "MultiPolygon", "coordinates": polygons}
+        })
+    return result
+
+
+def count_vertices(geojson):
+    """Total number of vertices in a FeatureCollection"""
+    return sum(len(ring) for feature in geojson["features"]
+               for polygon in _polygons(feature["geometry"]) for ring in polygon)
+
+
+# NAD83 Statistics Canada Lambert (EPSG:3347), the projection of data/raw/shp
+STATCAN_LAMBERT = dict(
+    a=6378137.0, f=1 / 298.257222101,
+    lat_0=63.390675, lon_0=-91.8666666666667, lat_1=49.0, lat_2=77.0,
+    x_0=6200000.0, y_0=3000000.0
+)
+
+
+def lambert_to_lonlat(x, y, a, f, lat_0, lon_0, lat_1, lat_2, x_0, y_0):
+    """Inverse Lambert conformal conic (two standard parallels) projection
+
+    Parameters
+    -------
+    np.array
+        Projected x coordinates in metres
+    np.array
+        Projected y coordinates in metres
+
+    Returns
+    -------
+    np.array, np.array
+        Longitudes and latitudes in degrees
+    """
+    e = np.sqrt(2 * f - f ** 2)
+    phi_0, phi_1, phi_2 = np.radians([lat_0, lat_1, lat_2])
+
+    def m(phi):
+        return np.cos(phi) / np.sqrt(1 - (e * np.sin(phi)) ** 2)
+
+    def t(phi):
+        return np.tan(np.pi / 4 - phi / 2) / ((1 - e * np.sin(phi)) / (1 + e * np.sin(phi))) ** (e / 2)
+
+    n = (np.log(m(phi_1)) - np.log(m(phi_2))) / (np.log(t(phi_1)) - np.log(t(phi_2)))
+    F = m(phi_1) / (n * t(phi_1) ** n)
+    rho_0 = a * F * t(phi_0) ** n
+
+    dx = np.asarray(x, dtype=float) - x_0
+    dy = rho_0 - (np.asarray(y, dtype=float) - y_0)
+    rho = np.sign(n) * np.hypot(dx, dy)
+    theta = np.arctan2(np.sign(n) * dx, np.sign(n) * dy)
+    t_ = (rho / (a * F)) ** (1 / n)
+
+    phi = np.pi / 2 - 2 * np.arctan(t_)
+    for _ in range(8):
+        phi = np.pi / 2 - 2 * np.arctan(t_ * ((1 - e * np.sin(phi)) / (1 + e * np.sin(phi))) ** (e / 2))
+    return np.degrees(theta / n) + lon_0, np.degrees(phi)
+
+
+def _read_dbf(path):
+    """Read the attribute table of a shapefile as a list of dicts"""
+    with open(path, "rb") as f:
+        data = f.read()
+    n_records, header_length, record_length = struct.unpack("<IHH", data[4:12])
+    fields = []
+    pos = 32
+    while data[pos] != 0x0D:
+        name = data[pos:pos + 11].split(b"\0")[0].decode("ascii")
+        fields.append((name, data[pos + 16]))
+        pos += 32
+    records = []
+    for i in range(n_records):
+        start = header_length + i * record_length + 1  # skip the deletion flag
+        record = {}
+        for name, length in fields:
+            raw = data[start:start + length]
+            try:
+                record[name] = raw.decode("utf-8").strip()
+            except UnicodeDecodeError:
+                record[name] = raw.decode("latin-1").strip()
+            start += length
+        records.append(record)
+    return records
+
+
+def _signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+
+def read_shapefile(path, projection=STATCAN_LAMBERT):
+    """Read a polygon shapefile into a GeoJSON FeatureCollection in longitude / latitude
+
+    Only polygon shapes (type 5) are supported. Clockwise rings start a new
+    polygon and counter-clockwise rings are holes of the polygon before them,
+    as laid out by the shapefile specification.
+
+    Parameters
+    -------
+    String
+        Path to the .shp file, the .dbf file next to it provides the properties
+    dict
+        Parameters of `lambert_to_lonlat`, None if the coordinates are not projected
+
+    Returns
+    -------
+    dict
+        GeoJSON FeatureCollection of MultiPolygon features
+    """
+    records = _read_dbf(os.path.splitext(path)[0] + ".dbf")
+    with open(path, "rb") as f:
+        data = f.read()
+
+    features = []
+    pos = 100
+    while pos < len(data):
+        _, content_length = struct.unpack(">ii", data[pos:pos + 8])
+        content = data[pos + 8:pos + 8 + content_length * 2]
+        pos += 8 + content_length * 2
+        shape_type = struct.unpack("<i", content[:4])[0]
+        if shape_type == 0:
+            features.append(None)
+            continue
+        if shape_type != 5:
+            raise ValueError("Unsupported shape type {} in {}".format(shape_type, path))
+        n_parts, n_points = struct.unpack("<ii", content[36:44])
+        parts = list(struct.unpack("<{}i".format(n_parts), content[44:44 + 4 * n_parts])) + [n_points]
+        points = np.frombuffer(content, dtype="<f8", count=2 * n_points, offset=44 + 4 * n_parts).reshape(-1, 2)
+        if projection is not None:
+            points = np.column_stack(lambert_to_lonlat(points[:, 0], points[:, 1], **projection))
+
+        polygons = []
+        for start, end in zip(parts, parts[1:]):
+            ring = points[start:end]
+            if _signed_area(ring) <= 0 or not polygons:
+                polygons.append([ring.tolist()])
+            else:
+                polygons[-1].append(ring.tolist())
+        features.append({"type": "MultiPolygon", "coordinates": polygons})
+
+    return {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": record, "geometry": geometry}
+                     for record, geometry in zip(records, features) if geometry is not None]
+    }
+
+
+def _strip_accents(text):
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+def _name_key(text):
+    return re.sub(r"[^a-z0-9]", "", _strip_accents(text).lower())
+
+
+def cma_geography(cma_name, province_name, known=()):
+    """Geography name used by the crime data for a CMA of the boundary files
+
+    StatCan boundary files use bilingual names such as
+    "Ottawa - Gatineau (Ontario part / partie de l'Ontario)", while the crime
+    data (after `crime_data.clean_data`) uses "Ottawa-Gatineau, Ontario part, Ontario".
+
+    Parameters
+    -------
+    String
+        CMANAME of the boundary file
+    String
+        PRNAME of the boundary file
+    [String]
+        Optional Geography values of the crime data to match against
+
+    Returns
+    -------
+    String
+        The matching Geography name
+    """
+    province = _strip_accents(province_name.split(" / ")[0]).strip()
+    part = re.search(r"\((.*)\)", cma_name)
+    name = re.sub(r"\s*\(.*\)", "", cma_name).split(" / ")[0]
+    name = _strip_accents(re.sub(r"\s*-\s*", "-", name)).strip()
+    if part:
+        english = [x.strip() for x in part.group(1).split(" / ") if x.strip().endswith("part")]
+        if english:
+            name += ", " + _strip_accents(english[0])
+    geography = "{}, {}".format(name, province)
+
+    if known and geography not in known:
+        # Fall back on a looser match of the CMA and province names
+        key = _name_key(name)
+        for candidate in known:
+            cma, _, rest = candidate.rpartition(", ") if "part," in candidate else candidate.partition(", ")
+            if _name_key(cma) == key and _name_key(rest).startswith(_name_key(province)[:6]):
+                return candidate
+    return geography
+
+
+class GridIndex:
+    """Uniform grid over feature bounding boxes for point lookups
+
+    Parameters
+    -------
+    dict
+        GeoJSON FeatureCollection in longitude / latitude
+    String
+        Feature property returned by `locate`
+    Float
+        Size of the grid cells in degrees
+    """
+
+    def __init__(self, geojson, name_prop, cell_size=1.0):
+        self.cell_size = cell_size
+        self._features = []
+        self._cells = {}
+        for feature in geojson["features"]:
+            rings = [np.asarray(ring, dtype=float) for polygon in _polygons(feature["geometry"]) for ring in polygon]
+            points = np.concatenate(rings)
+            bbox = (*points.min(axis=0), *points.max(axis=0))
+            i = len(self._features)
+            self._features.append((feature["properties"][name_prop], rings, bbox, points))
+            for cell in self._cells_for(bbox):
+                self._cells.setdefault(cell, []).append(i)
+
+    def _cells_for(self, bbox):
+        x0, y0, x1, y1 = (int(np.floor(v / self.cell_size)) for v in bbox)
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    @staticmethod
+    def _contains(rings, x, y):
+        """Even-odd rule over all rings, so holes are handled"""
+        inside = False
+        for ring in rings:
+            xs, ys = ring[:, 0], ring[:, 1]
+            xs2, ys2 = np.roll(xs, -1), np.roll(ys, -1)
+            crosses = (ys > y) != (ys2 > y)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_cross = xs + (y - ys) * (xs2 - xs) / (ys2 - ys)
+            inside ^= bool(np.count_nonzero(crosses & (x < x_cross)) % 2)
+        return inside
+
+    def locate(self, lon, lat, tolerance=0.0):
+        """Name of the feature containing a point
+
+        Parameters
+        -------
+        Float
+            Longitude
+        Float
+            Latitude
+        Float
+            If no feature contains the point, the nearest feature with a vertex
+            within this many degrees is returned instead
+
+        Returns
+        -------
+        String
+            The feature's `name_prop`, None if there is no match
+        """
+        candidates = set()
+        for cell in self._cells_for((lon - tolerance, lat - tolerance, lon + tolerance, lat + tolerance)):
+            candidates.update(self._cells.get(cell, ()))
+        best, best_dist = None, tolerance
+        for i in sorted(candidates):
+            name, rings, (x0, y0, x1, y1), points = self._features[i]
+            if x0 <= lon <= x1 and y0 <= lat <= y1 and self._contains(rings, lon, lat):
+                return name
+            if tolerance > 0:
+                dist = np.min(np.hypot(points[:, 0] - lon, points[:, 1] - lat))
+                if dist <= best_dist:
+                    best, best_dist = name, dist
+        return best
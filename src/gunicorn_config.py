@@ -0,0 +1,49 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Gunicorn settings for the dashboard, see the Procfile
+Usage: gunicorn app:server --pythonpath=src --config src/gunicorn_config.py
+
+The app is imported once in the master process (preload) so the data, the
+boundary files and the warmed render caches are loaded once and shared
+copy-on-write by the forked workers. Every worker then forks its own chart
+rendering processes, see render_pool.py.
+"""
+
+import gc
+import os
+
+
+# GUNICORN_PRELOAD=0 makes every worker import the app itself, to compare memory use
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# Threaded workers pick up a page's callbacks as they arrive, so superseded
+# slider updates are seen and dropped instead of waiting in the socket backlog
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+
+
+def when_ready(server):
+    """Runs in the master after the app is loaded and before any worker is forked"""
+    if not server.cfg.preload_app:
+        return
+    import app
+
+    # Fork only once warm-up is done: workers then inherit full caches, and no
+    # warm-up thread can be holding a lock at the moment of the fork
+    app.WARMUP.wait()
+    server.log.info("Warm-up finished: %s", app.WARMUP.status())
+
+    # Keep the garbage collector from touching (and so copying) the shared objects in every worker
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Runs in every worker before it serves requests, while it has a single thread to fork from"""
+    import app
+    app.RENDER_POOL.start()
+
+
+def worker_exit(server, worker):
+    import app
+    app.RENDER_POOL.stop()
@@ -0,0 +1,252 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Latency, outcome and response size of every Dash callback, in the Prometheus text format
+
+`Metrics.instrument` wraps the server-side callbacks of a Dash app once they
+are all registered. Each call is counted by outcome and its duration and
+response size go into histograms. Callbacks time their own steps with
+`phase`, e.g. filtering the data, building the chart spec and serializing it.
+The rest of the call (Dash's validation and JSON encoding, cache lookups,
+waiting for the render pool) is reported as the phase "other".
+
+Like the coalescer, the counters live in shared memory created at import,
+so with gunicorn's preload `/metrics` reports all workers whichever one
+answers. Without preload every worker reports its own calls only. The shared
+lock is only waited for briefly, as a worker killed while holding it leaves it
+held for good: a sample that cannot be recorded in time is dropped and counted
+by the worker that dropped it.
+
+Uninstrumented calls (warm-up, benchmarks) are not recorded, and `phase` is a
+shared no-op context outside an instrumented call.
+"""
+
+import bisect
+import contextlib
+import functools
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+from dash._utils import split_callback_id
+from dash.exceptions import PreventUpdate
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Steps timed inside callbacks, anything else is "other"
+PHASES = ("filter", "spec", "serialize")
+OUTCOMES = ("ok", "prevented", "error")
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_local = threading.local()
+_NULL = contextlib.nullcontext()
+
+
+class _Record:
+    """Time spent in each phase of the current call, nested phases excluded from the outer one"""
+
+    def __init__(self):
+        self.phases = {}
+        self.stack = []
+
+    def charge(self, now):
+        if self.stack:
+            name, since = self.stack[-1]
+            self.phases[name] = self.phases.get(name, 0.0) + now - since
+
+
+class _Phase:
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        now = time.perf_counter()
+        self.record.charge(now)
+        self.record.stack.append((self.name, now))
+
+    def __exit__(self, *exc):
+        now = time.perf_counter()
+        self.record.charge(now)
+        self.record.stack.pop()
+        if self.record.stack:
+            self.record.stack[-1] = (self.record.stack[-1][0], now)
+
+
+def phase(name):
+    """Context timing a step of the current callback, one of `PHASES`"""
+    record = getattr(_local, "record", None)
+    if record is None:
+        return _NULL
+    return _Phase(record, name)
+
+
+def recording():
+    """Whether phases of the calling thread are being recorded"""
+    return getattr(_local, "record", None) is not None
+
+
+@contextlib.contextmanager
+def capture():
+    """Record the phases of the calling thread, e.g. in a render process, yields them as a dict"""
+    outer = getattr(_local, "record", None)
+    record = _local.record = _Record()
+    try:
+        yield record.phases
+    finally:
+        _local.record = outer
+
+
+def add_phases(phases):
+    """Add phases timed elsewhere, e.g. in a render process, to the current callback"""
+    record = getattr(_local, "record", None)
+    if record is not None:
+        for name, seconds in phases.items():
+            record.phases[name] = record.phases.get(name, 0.0) + seconds
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Counters and histograms of the callbacks of a Dash app
+
+    Parameters
+    -------
+    lock_timeout : Float
+        Seconds to wait for the shared lock before dropping a sample
+    """
+
+    def __init__(self, lock_timeout=0.1):
+        self.callbacks = []
+        self.lock_timeout = lock_timeout
+        # samples this process could not record, not shared
+        self.dropped = 0
+        self._values = None
+        self._lock = multiprocessing.Lock()
+        # offsets of each callback's series
+        self._duration = len(OUTCOMES)
+        self._size = self._duration + len(DURATION_BUCKETS) + 2
+        self._phases = self._size + len(SIZE_BUCKETS) + 2
+        self._width = self._phases + (len(PHASES) + 1) * (len(DURATION_BUCKETS) + 2)
+
+    def instrument(self, app):
+        """Wrap every server-side callback of `app`, to call once all of them are registered"""
+        for callback_id, entry in app.callback_map.items():
+            # clientside callbacks have no server function
+            func = entry.get("callback")
+            if func is None:
+                continue
+            outputs = split_callback_id(callback_id)
+            first = outputs[0] if isinstance(outputs, list) else outputs
+            labels = (getattr(func, "__name__", "callback"), "{}.{}".format(first["id"], first["property"]))
+            entry["callback"] = self._wrap(len(self.callbacks), func)
+            self.callbacks.append(labels)
+        self._values = multiprocessing.RawArray("d", len(self.callbacks) * self._width)
+        return self
+
+    def _wrap(self, number, func):
+        @functools.wraps(func)
+        def instrumented(*args, **kwargs):
+            record = _local.record = _Record()
+            start = time.perf_counter()
+            outcome, size = 2, None
+            try:
+                response = func(*args, **kwargs)
+                outcome, size = 0, len(response)
+                return response
+            except PreventUpdate:
+                outcome = 1
+                raise
+            finally:
+                _local.record = None
+                self._record(number, outcome, time.perf_counter() - start, size, record.phases)
+        return instrumented
+
+    def _observe(self, offset, buckets, value):
+        self._values[offset + bisect.bisect_left(buckets, value)] += 1
+        self._values[offset + len(buckets) + 1] += value
+
+    def _record(self, number, outcome, seconds, size, phases):
+        base = number * self._width
+        other = seconds
+        if not self._lock.acquire(timeout=self.lock_timeout):
+            self.dropped += 1
+            return
+        try:
+            self._values[base + outcome] += 1
+            self._observe(base + self._duration, DURATION_BUCKETS, seconds)
+            if size is not None:
+                self._observe(base + self._size, SIZE_BUCKETS, size)
+            for i, name in enumerate(PHASES):
+                spent = phases.get(name)
+                if spent is not None:
+                    self._observe(base + self._phases + i * (len(DURATION_BUCKETS) + 2), DURATION_BUCKETS, spent)
+                    other -= spent
+            self._observe(base + self._phases + len(PHASES) * (len(DURATION_BUCKETS) + 2), DURATION_BUCKETS,
+                          max(other, 0.0))
+        finally:
+            self._lock.release()
+
+    def _histogram(self, lines, name, labels, values, buckets):
+        counts = np.cumsum(values[:len(buckets) + 1])
+        for bound, count in zip(buckets + ("+Inf",), counts):
+            lines.append('{}_bucket{{{},le="{}"}} {:d}'.format(name, labels, bound, int(count)))
+        lines.append("{}_sum{{{}}} {!r}".format(name, labels, float(values[len(buckets) + 1])))
+        lines.append("{}_count{{{}}} {:d}".format(name, labels, int(counts[-1])))
+
+    def exposition(self):
+        """All metrics in the Prometheus text format
+
+        Returns
+        -------
+        String
+            Calls by outcome, and histograms of the duration, the response
+            size and the time of each phase of every callback, and the samples
+            dropped by the answering worker
+        """
+        if self._values is None:
+            return ""
+        # without the lock a sample being recorded may be partly counted
+        locked = self._lock.acquire(timeout=self.lock_timeout)
+        try:
+            values = np.frombuffer(self._values, dtype=np.float64).reshape(len(self.callbacks), self._width).copy()
+        finally:
+            if locked:
+                self._lock.release()
+        labels = ['callback="{}",output="{}"'.format(_escape(name), _escape(output)) for name, output in self.callbacks]
+        lines = ["# HELP dash_callback_calls_total Callback calls by outcome: ok, prevented (no update) or error",
+                 "# TYPE dash_callback_calls_total counter"]
+        for label, row in zip(labels, values):
+            for i, outcome in enumerate(OUTCOMES):
+                lines.append('dash_callback_calls_total{{{},outcome="{}"}} {:d}'.format(label, outcome, int(row[i])))
+
+        lines += ["# HELP dash_callback_duration_seconds Time from the request being dispatched to the response",
+                  "# TYPE dash_callback_duration_seconds histogram"]
+        for label, row in zip(labels, values):
+            self._histogram(lines, "dash_callback_duration_seconds", label, row[self._duration:], DURATION_BUCKETS)
+
+        lines += ["# HELP dash_callback_phase_seconds Time spent in each step of the callbacks",
+                  "# TYPE dash_callback_phase_seconds histogram"]
+        for label, row in zip(labels, values):
+            for i, name in enumerate(PHASES + ("other",)):
+                offset = self._phases + i * (len(DURATION_BUCKETS) + 2)
+                self._histogram(lines, "dash_callback_phase_seconds", '{},phase="{}"'.format(label, name),
+                                row[offset:], DURATION_BUCKETS)
+
+        lines += ["# HELP dash_callback_response_bytes Size of the JSON responses of the calls that updated the page",
+                  "# TYPE dash_callback_response_bytes histogram"]
+        for label, row in zip(labels, values):
+            self._histogram(lines, "dash_callback_response_bytes", label, row[self._size:], SIZE_BUCKETS)
+
+        lines += ["# HELP dash_callback_dropped_samples_total Calls not recorded by this worker as the lock was held",
+                  "# TYPE dash_callback_dropped_samples_total counter",
+                  "dash_callback_dropped_samples_total {:d}".format(self.dropped)]
+        return "\n".join(lines) + "\n"
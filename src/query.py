@@ -0,0 +1,244 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Indexed queries over the cleaned crime data
+
+The callbacks slice the data by the same five columns over and over. Instead
+of building a boolean mask over the full table on every call, `QueryIndex`
+groups the rows once by their integer codes and keeps the row positions of
+each key. Queries run on the (possibly memory-mapped) column buffers of a
+`crime_data.ColumnTable` and only copy the rows they return. The trends tab
+reads from a `TrendCube` of the rate series built alongside the index.
+"""
+
+import numpy as np
+import pandas as pd
+
+import crime_data
+
+
+SLICE_KEYS = ["Metric", "Level1 Violation Flag", "Violation Description", "Year", "Geo_Level"]
+TREND_KEYS = ["Metric", "Geo_Level", "Violation Description"]
+TREND_METRIC = "Rate per 100,000 population"
+
+
+class QueryIndex:
+    """Pre-grouped lookups for the dashboard callbacks
+
+    Parameters
+    -------
+    crime_data.ColumnTable or pd.DataFrame
+        Cleaned data, as returned by `crime_data.load_columns` or `crime_data.load_data`
+    """
+
+    def __init__(self, data):
+        if isinstance(data, pd.DataFrame):
+            data = crime_data.ColumnTable.from_frame(data)
+        self.table = data
+        self._no_rows = np.empty(0, dtype=np.int32)
+        self._slices = self._group(SLICE_KEYS)
+        self._trends = self._group(TREND_KEYS)
+        self._unique = {}
+        self.cube = TrendCube(self.table, self._trends)
+
+    def _group(self, keys):
+        """Row positions for every combination of `keys`, rows with a missing key are left out"""
+        codes, labels = [], []
+        for name in keys:
+            if self.table.is_category(name):
+                # shift by one so that missing values (-1) get code 0
+                codes.append(self.table.columns[name].astype(np.int64) + 1)
+                labels.append([None] + self.table.categories(name).tolist())
+            else:
+                values, inverse = np.unique(self.table.columns[name], return_inverse=True)
+                codes.append(inverse.astype(np.int64) + 1)
+                labels.append([None] + values.tolist())
+
+        combined = np.ravel_multi_index(codes, [len(x) for x in labels])
+        order = np.argsort(combined, kind="stable").astype(np.int32)
+        combined = combined[order]
+        starts = np.flatnonzero(np.r_[True, combined[1:] != combined[:-1]])
+
+        groups = {}
+        # the row blocks are views of `order`, one array per grouping
+        for rows in np.split(order, starts[1:]) if order.size else []:
+            key = tuple(label[code[rows[0]]] for label, code in zip(labels, codes))
+            if None not in key:
+                groups[key] = rows
+        return groups
+
+    def slice_rows(self, metric, violation, subcategory, year, geo_level):
+        """Positions of the rows matching a metric, violation, subcategory, year and geography level"""
+        return self._slices.get((metric, violation, subcategory, year, geo_level), self._no_rows)
+
+    def slice(self, metric, violation, subcategory, year, geo_level):
+        """Rows matching a metric, violation, subcategory, year and geography level
+
+        Returns
+        -------
+        pd.DataFrame
+            Matching rows, empty if there are none
+        """
+        return self.table.take(self.slice_rows(metric, violation, subcategory, year, geo_level))
+
+    def slice_values(self, metric, violation, subcategory, year, geo_level, key="Geography", value="Value"):
+        """Map one column to another over the rows of a slice, without building a dataframe
+
+        Returns
+        -------
+        dict
+            `key` value to `value` value for the matching rows
+        """
+        rows = self.slice_rows(metric, violation, subcategory, year, geo_level)
+        return dict(zip(self.table.decode(key, rows), self.table.decode(value, rows)))
+
+    def trend(self, metric, geo_level, subcategory='All'):
+        """Rows for a metric and geography level across all years and violations
+
+        Returns
+        -------
+        pd.DataFrame
+            Matching rows, empty if there are none
+        """
+        return self.table.take(self._trends.get((metric, geo_level, subcategory), self._no_rows))
+
+    def unique(self, col, where=None):
+        """Unique values of a column in order of appearance, optionally filtered
+
+        Parameters
+        -------
+        String
+            Column to get the unique values of
+        (String, [String])
+            Optional column name and list of values the rows must match
+
+        Returns
+        -------
+        [String]
+            Unique values
+        """
+        key = (col, where[0], tuple(where[1])) if where else (col,)
+        values = self._unique.get(key)
+        if values is None:
+            codes = self.table.columns[col]
+            if where:
+                codes = codes[np.isin(self.table.columns[where[0]], self.table.encode(where[0], where[1]))]
+            codes = pd.unique(codes)
+            if self.table.is_category(col):
+                values = self.table.categories(col).to_numpy()[codes[codes >= 0]].tolist()
+            else:
+                values = codes.tolist()
+            self._unique[key] = values
+        return values
+
+
+class TrendCube:
+    """Time series of one metric per geography level, geography and violation group
+
+    For every geography level the values of `metric` for the 'All'
+    subcategory are laid out in a (geography, violation group, year) array,
+    so a chart for any set of locations is a gather from that array.
+
+    Parameters
+    -------
+    crime_data.ColumnTable
+        Cleaned data
+    dict
+        Row positions per `TREND_KEYS` key, see `QueryIndex`
+    String
+        Metric to lay out
+    """
+
+    def __init__(self, table, trends, metric=TREND_METRIC):
+        self.metric = metric
+        self._cubes = {}
+        for (key_metric, geo_level, subcategory), rows in trends.items():
+            if key_metric == metric and subcategory == "All":
+                self._cubes[geo_level] = self._build(table, rows)
+
+    @staticmethod
+    def _build(table, rows):
+        geo_codes = table.columns["Geography"][rows]
+        group_codes = table.columns["Level1 Violation Flag"][rows]
+        row_years = table.columns["Year"][rows]
+        geographies, geo_pos = np.unique(geo_codes, return_inverse=True)
+        groups, group_pos = np.unique(group_codes, return_inverse=True)
+        years, year_pos = np.unique(row_years, return_inverse=True)
+
+        values = np.full((len(geographies), len(groups), len(years)), np.nan)
+        values[geo_pos, group_pos, year_pos] = table.columns["Value"][rows]
+        return {
+            "geographies": {name: i for i, name in enumerate(table.categories("Geography")[geographies])},
+            "groups": {name: i for i, name in enumerate(table.categories("Level1 Violation Flag")[groups])},
+            "years": pd.to_datetime(years.astype(str), format="%Y").to_numpy(),
+            "values": values
+        }
+
+    def series(self, geo_level, geographies, group):
+        """Long-format time series of some geographies for one violation group
+
+        Parameters
+        -------
+        String
+            PROVINCE or CMA
+        [String]
+            Geographies to include, unknown ones are skipped
+        String
+            Level1 Violation Flag of the group
+
+        Returns
+        -------
+        pd.DataFrame
+            Geography, Year (as dates), Value and Metric of every year with a value
+        """
+        cube = self._cubes.get(geo_level)
+        names = [name for name in geographies if cube and name in cube["geographies"]]
+        if not names or group not in cube["groups"]:
+            return pd.DataFrame({"Geography": [], "Year": np.array([], dtype="datetime64[ns]"),
+                                 "Value": [], "Metric": []})
+
+        values = cube["values"][[cube["geographies"][name] for name in names], cube["groups"][group]]
+        present = ~np.isnan(values)
+        n_years = len(cube["years"])
+        return pd.DataFrame({
+            "Geography": np.repeat(np.array(names, dtype=object), n_years)[present.ravel()],
+            "Year": np.tile(cube["years"], len(names))[present.ravel()],
+            "Value": values[present],
+            "Metric": self.metric
+        })
+
+    def payload(self, geo_level, groups):
+        """The cube of a geography level as JSON-ready lists
+
+        Parameters
+        -------
+        String
+            PROVINCE or CMA
+        [String]
+            Violation groups to include, in order, groups without data are all None
+
+        Returns
+        -------
+        dict
+            Metric, geography names, groups, ISO dates of the years and the
+            values as nested (geography, group, year) lists with None where
+            there is no value
+        """
+        cube = self._cubes.get(geo_level)
+        if cube is None:
+            return {"metric": self.metric, "geographies": [], "groups": list(groups), "years": [], "values": []}
+
+        values = np.full((len(cube["geographies"]), len(groups), len(cube["years"])), np.nan)
+        for i, group in enumerate(groups):
+            if group in cube["groups"]:
+                values[:, i] = cube["values"][:, cube["groups"][group]]
+        values = values.astype(object)
+        values[pd.isna(values)] = None
+        return {
+            "metric": self.metric,
+            "geographies": list(cube["geographies"]),
+            "groups": list(groups),
+            "years": [str(year)[:19] for year in cube["years"]],
+            "values": values.tolist()
+        }
@@ -0,0 +1,164 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Bounded LRU cache for rendered chart output
+
+The chart callbacks take a handful of dropdown / slider values and return an
+Altair plot as html. The same few combinations are requested over and over,
+so the rendered html is memoized per normalized set of arguments. Entries are
+tied to the dataset version and dropped when the data is reloaded. Within a
+version, entries are also tied to the generation of the data they depend on,
+so an incremental update only makes the entries of the years and geographies
+it changed unreachable.
+"""
+
+import contextlib
+import functools
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    """Thread-safe LRU cache with hit / miss / eviction counters
+
+    Parameters
+    -------
+    maxsize : Int
+        Maximum number of entries kept, least recently used entries are evicted first
+    version : callable
+        Function returning the current dataset version; the cache is cleared when it changes
+    shared : shared_cache.SharedCache
+        Optional cache shared with the other workers, looked up on a miss.
+        The version is part of its keys, so it must be the same in every process
+    generation : callable
+        Optional function of (years, geographies), None for all of them,
+        returning the last generation of the data that changed them. Part of
+        the keys, so it must be the same in every process too
+    pin : callable
+        Optional context manager factory holding the data still while a value
+        is keyed and computed, e.g. `dataset.DatasetProvider.pinned`, so a
+        value is never cached under the version of other data
+    """
+
+    def __init__(self, maxsize=256, version=None, shared=None, generation=None, pin=None):
+        self.maxsize = maxsize
+        self.shared = shared
+        self._version = version
+        self._generation = generation
+        self._pin = pin or contextlib.nullcontext
+        self._current_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _check_version(self):
+        """Clear the cache if the dataset was reloaded, returns the current version"""
+        if self._version is None:
+            return None
+        version = self._version()
+        if version != self._current_version:
+            with self._lock:
+                if version != self._current_version:
+                    self._entries.clear()
+                    self._current_version = version
+        return version
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def memoize(self, normalize=None, depends=None):
+        """Decorator caching a function's return value per normalized arguments
+
+        Parameters
+        -------
+        normalize : callable
+            Optional function mapping the call arguments to a hashable key, so
+            that equivalent inputs (e.g. None and "") share an entry
+        depends : callable
+            Optional function mapping the call arguments to the (years,
+            geographies) of the data the value is computed from, None for all.
+            By default a value depends on all the data
+
+        Returns
+        -------
+        callable
+            Decorator, the decorated function has a `cached(*args)` method
+        """
+        def decorator(func):
+            def key(args):
+                version = self._check_version()
+                generation = None
+                if self._generation is not None:
+                    generation = self._generation(*(depends(*args) if depends else (None, None)))
+                return (func.__name__, version, generation, normalize(*args) if normalize else args)
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                if self.maxsize <= 0:
+                    return func(*args)
+                with self._pin():
+                    k = key(args)
+                    value = self.get(k, _MISSING)
+                    if value is _MISSING:
+                        if self.shared is not None:
+                            value = self.shared.get_or_compute(k, lambda: func(*args))
+                        else:
+                            value = func(*args)
+                        self.put(k, value)
+                return value
+
+            def cached(*args):
+                """Whether the value for these arguments is cached, without counting a hit or miss"""
+                k = key(args)
+                with self._lock:
+                    return k in self._entries
+
+            wrapper.cached = cached
+            return wrapper
+        return decorator
+
+    def stats(self):
+        """Counters for sizing the cache
+
+        Returns
+        -------
+        dict
+            Size, capacity, hits, misses and evictions, and the counters of the shared cache if any
+        """
+        with self._lock:
+            stats = {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+
+_MISSING = object()
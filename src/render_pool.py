@@ -0,0 +1,215 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Chart rendering in a pool of processes
+
+Building an Altair chart and serializing it to html is pure Python and holds
+the GIL, so a slow render (every CMA on the trends tab) stalls every other
+request thread of its gunicorn worker. `RenderPool` runs the render functions
+in child processes forked from the worker instead, with a bounded number of
+pending renders (callers beyond it are turned away at once) and a timeout.
+
+Functions are registered by name with `task`; the children are forked from
+the worker after the app is loaded, so they find the same functions and data.
+The phases a render times in a child (see metrics.py) are sent back with its
+result and added to the callback waiting for it.
+
+A child keeps the data it was forked with until a render needs newer data.
+Every render is sent with the identity of the worker's current snapshot
+(the one it keys its caches on), and the child renders from a snapshot of
+the same identity, reloading the data if it is behind. A child that cannot
+load it (the files changed again since) fails with `dataset.StaleSnapshot`
+and the render is done in the worker instead, so no render is ever cached
+under the version of other data.
+"""
+
+import contextlib
+import functools
+import multiprocessing
+import os
+import signal
+import threading
+
+import dataset
+import metrics
+
+
+class Busy(Exception):
+    """Too many renders are pending, the caller should retry later"""
+
+
+class Timeout(Exception):
+    """A render took longer than the pool's timeout"""
+
+
+# Registered functions, inherited by the forked children
+_FUNCTIONS = {}
+# Data provider of the pool, in a child
+_provider = None
+
+
+def _init_child(provider):
+    global _provider
+    _provider = provider
+    # the children inherit gunicorn's worker signal handlers, which would keep
+    # them from exiting when the pool is terminated
+    for name in ("SIGTERM", "SIGHUP", "SIGQUIT", "SIGUSR1", "SIGUSR2", "SIGWINCH", "SIGCHLD", "SIGTTIN", "SIGTTOU"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+    # the parent handles Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _call(name, args, timed, identity):
+    with _provider.pinned(identity) if _provider is not None else contextlib.nullcontext():
+        if not timed:
+            return _FUNCTIONS[name](*args), None
+        with metrics.capture() as phases:
+            result = _FUNCTIONS[name](*args)
+    return result, phases
+
+
+class RenderPool:
+    """Run registered functions in forked child processes
+
+    Until `start` is called in a process, registered functions run in the
+    calling thread, e.g. during warm-up in the gunicorn master.
+
+    Parameters
+    -------
+    processes : Int
+        Number of child processes, 0 to always render in the calling thread
+    max_pending : Int
+        Renders queued or running at once, more raise `Busy`. Defaults to
+        four per process
+    timeout : Float
+        Seconds a caller waits for its render before `Timeout` is raised. The
+        render keeps its slot until it really finishes
+    provider : dataset.DatasetProvider
+        Optional provider of the data the functions render, children render
+        from a snapshot of the same identity as the caller's
+    """
+
+    def __init__(self, processes=2, max_pending=None, timeout=30, provider=None):
+        self.processes = processes
+        self.max_pending = max_pending or 4 * max(processes, 1)
+        self.timeout = timeout
+        self.provider = provider
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.stale = 0
+        self.peak_pending = 0
+
+    def task(self, func):
+        """Decorator sending calls of `func` to the pool, arguments and results must be picklable"""
+        name = "{}.{}".format(func.__module__, func.__qualname__)
+        _FUNCTIONS[name] = func
+
+        @functools.wraps(func)
+        def submit(*args):
+            return self.run(name, args)
+        return submit
+
+    @property
+    def started(self):
+        return self._pool is not None and self._pid == os.getpid()
+
+    def start(self):
+        """Fork the children, best while the calling process has a single thread"""
+        if self.processes > 0 and not self.started:
+            self._pool = multiprocessing.get_context("fork").Pool(self.processes, initializer=_init_child,
+                                                                  initargs=(self.provider,))
+            self._pid = os.getpid()
+        return self
+
+    def stop(self):
+        if self.started:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+
+    def _done(self, outcome):
+        def callback(result):
+            counter = "stale" if isinstance(result, dataset.StaleSnapshot) else outcome
+            with self._lock:
+                self._pending -= 1
+                setattr(self, counter, getattr(self, counter) + 1)
+        return callback
+
+    def run(self, name, args):
+        """Call a registered function in a child process and wait for its result
+
+        Parameters
+        -------
+        String
+            Name of the function, as registered by `task`
+        tuple
+            Arguments
+
+        Returns
+        -------
+        object
+            The return value of the function
+
+        Raises
+        -------
+        Busy
+            If `max_pending` renders are already queued or running
+        Timeout
+            If the render did not finish within `timeout` seconds
+        """
+        if not self.started:
+            return _FUNCTIONS[name](*args)
+        identity = self.provider.get().identity if self.provider is not None else None
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise Busy("{} renders pending".format(self._pending))
+            self._pending += 1
+            self.submitted += 1
+            self.peak_pending = max(self.peak_pending, self._pending)
+        result = self._pool.apply_async(_call, (name, args, metrics.recording(), identity),
+                                        callback=self._done("completed"), error_callback=self._done("failed"))
+        try:
+            value, phases = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise Timeout("render of {} took over {}s".format(name, self.timeout))
+        except dataset.StaleSnapshot:
+            # the child only finds newer data, render from the caller's snapshot
+            return _FUNCTIONS[name](*args)
+        if phases:
+            metrics.add_phases(phases)
+        return value
+
+    def stats(self):
+        """Counters of the pool of this process
+
+        Returns
+        -------
+        dict
+            Processes, pending renders and their peak, and renders submitted,
+            completed, failed, rejected (Busy), timed out and done in the
+            calling thread as the children had newer data (stale)
+        """
+        with self._lock:
+            return {
+                "processes": self.processes if self.started else 0,
+                "pending": self._pending,
+                "peak_pending": self.peak_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "stale": self.stale,
+            }
@@ -0,0 +1,331 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Cache of rendered charts shared between worker processes
+
+Every gunicorn worker has its own `render_cache.RenderCache`, so without a
+shared layer the same chart is rendered once per worker. `SharedCache` sits
+under the per-process caches and stores results in a backend all workers
+reach: `SQLiteBackend` for the workers of one host, `RedisBackend` (any
+server speaking the Redis protocol) for several hosts. While one worker
+renders a missing entry the others wait for it instead of rendering it too.
+
+Values are pickled, the backend must only be writable by the dashboard.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackendError(Exception):
+    """The cache server answered a command with an error"""
+
+
+class SQLiteBackend:
+    """Cache entries in a SQLite database file, shared by the processes of a host
+
+    Parameters
+    -------
+    path : String
+        Database file, created if needed
+    max_entries : Int
+        Entries kept, the ones expiring first are removed beyond that
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _db(self):
+        # one connection per thread, and new ones after a fork
+        pid, conn = getattr(self._local, "conn", (None, None))
+        if pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            self._local.conn = (os.getpid(), conn)
+        return conn
+
+    def get(self, key):
+        row = self._db().execute("SELECT value FROM entries WHERE key = ? AND expires > ?",
+                                 (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        self._db().execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+        self._writes += 1
+        if self._writes % 256 == 0:
+            self.prune()
+
+    def add(self, key, value, ttl):
+        """Set `key` only if it is missing or expired, returns whether it was set"""
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM entries WHERE key = ? AND expires <= ?", (key, now))
+            added = db.execute("INSERT OR IGNORE INTO entries VALUES (?, ?, ?)", (key, value, now + ttl)).rowcount == 1
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return added
+
+    def delete(self, key):
+        self._db().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_if(self, key, value):
+        """Delete `key` only if it still holds `value`, returns whether it was deleted"""
+        return self._db().execute("DELETE FROM entries WHERE key = ? AND value = ?", (key, value)).rowcount == 1
+
+    def clear(self):
+        self._db().execute("DELETE FROM entries")
+
+    def prune(self):
+        """Remove expired entries, then the ones expiring first beyond `max_entries`"""
+        db = self._db()
+        db.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+        db.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                   (self.max_entries,))
+
+
+class RedisBackend:
+    """Cache entries in a server speaking the Redis protocol (RESP)
+
+    A minimal client for the few commands needed, so that no Redis package
+    has to be installed.
+
+    Parameters
+    -------
+    host : String
+    port : Int
+    db : Int
+        Database number selected on connect
+    timeout : Float
+        Seconds to wait for the server before giving up on a command
+    """
+
+    # compare-and-delete in one step on the server
+    DELETE_IF = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+
+    def __init__(self, host="localhost", port=6379, db=0, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url):
+        """Backend for a redis://host:port/db url"""
+        parts = urllib.parse.urlparse(url)
+        return cls(parts.hostname or "localhost", parts.port or 6379, int(parts.path.strip("/") or 0))
+
+    def _connection(self):
+        pid, sock, reader = getattr(self._local, "conn", (None, None, None))
+        if pid != os.getpid():
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            reader = sock.makefile("rb")
+            self._local.conn = (os.getpid(), sock, reader)
+            if self.db:
+                self._command("SELECT", self.db)
+        return sock, reader
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed by the cache server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise BackendError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read(reader) for _ in range(length)]
+        raise BackendError("unexpected reply {!r}".format(line))
+
+    def _command(self, *args):
+        parts = [arg if isinstance(arg, bytes) else str(arg).encode() for arg in args]
+        request = b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+        sock, reader = self._connection()
+        try:
+            sock.sendall(request)
+            return self._read(reader)
+        except OSError:
+            # reconnect on the next command
+            self._local.conn = (None, None, None)
+            sock.close()
+            raise
+
+    def get(self, key):
+        return self._command("GET", key)
+
+    def set(self, key, value, ttl):
+        self._command("SET", key, value, "PX", int(ttl * 1000))
+
+    def add(self, key, value, ttl):
+        """Set `key` only if it is missing, returns whether it was set"""
+        return self._command("SET", key, value, "PX", int(ttl * 1000), "NX") == "OK"
+
+    def delete(self, key):
+        self._command("DEL", key)
+
+    def delete_if(self, key, value):
+        """Delete `key` only if it still holds `value`, returns whether it was deleted"""
+        return self._command("EVAL", self.DELETE_IF, 1, key, value) == 1
+
+    def clear(self):
+        self._command("FLUSHDB")
+
+
+def backend_from_url(url):
+    """The backend for a SHARED_CACHE setting, None for "none"
+
+    Parameters
+    -------
+    String
+        sqlite:///absolute/path.db, sqlite://relative/path.db, redis://host:port/db or none
+
+    Returns
+    -------
+    SQLiteBackend or RedisBackend
+    """
+    if not url or url == "none":
+        return None
+    if url.startswith("sqlite://"):
+        return SQLiteBackend(url[len("sqlite://"):])
+    if url.startswith("redis://"):
+        return RedisBackend.from_url(url)
+    raise ValueError("unknown cache backend {!r}, expected sqlite://, redis:// or none".format(url))
+
+
+# Backend failures: the value is then computed locally
+ERRORS = (OSError, sqlite3.Error, BackendError)
+
+
+class SharedCache:
+    """Compute-once cache over a backend shared by all workers
+
+    Parameters
+    -------
+    backend : SQLiteBackend or RedisBackend
+    ttl : Float
+        Seconds entries are kept
+    lock_timeout : Float
+        Seconds other workers wait for the one computing an entry, after which
+        they compute it themselves. A worker only releases the lock it took,
+        not one taken by another worker once its own expired
+    namespace : String
+        Part of every key, keeps apart the values of settings rendering differently
+    """
+
+    def __init__(self, backend, ttl=86400, lock_timeout=30, namespace=""):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.errors = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _failed(self):
+        self._count("errors")
+        if self.errors == 1:
+            logger.exception("shared cache unavailable, computing locally")
+
+    def get_or_compute(self, key, compute):
+        """The cached value for `key`, computed with `compute()` by one worker if missing
+
+        Parameters
+        -------
+        object
+            Key, hashed from its repr, so it must be built from plain values
+        callable
+            Function computing the value
+
+        Returns
+        -------
+        object
+            The cached or computed value
+        """
+        key = hashlib.sha1(repr((self.namespace, key)).encode()).hexdigest()
+        lock = key + ":lock"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.005
+        waited = locked = False
+        while True:
+            try:
+                value = self.backend.get(key)
+                if value is not None:
+                    self._count("waits" if waited else "hits")
+                    return pickle.loads(value)
+                locked = self.backend.add(lock, token, self.lock_timeout)
+                if locked:
+                    break
+            except ERRORS:
+                self._failed()
+                return compute()
+            if time.monotonic() > deadline:
+                # the worker holding the lock is stuck or gone
+                break
+            waited = True
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+        self._count("misses")
+        try:
+            value = compute()
+            try:
+                self.backend.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.ttl)
+            except ERRORS:
+                self._failed()
+            return value
+        finally:
+            if locked:
+                try:
+                    self.backend.delete_if(lock, token)
+                except ERRORS:
+                    pass
+
+    def stats(self):
+        """Counters of the calling process
+
+        Returns
+        -------
+        dict
+            Hits, hits after waiting for another worker, misses (values computed) and backend errors
+        """
+        with self._lock:
+            return {"hits": self.hits, "waits": self.waits, "misses": self.misses, "errors": self.errors}
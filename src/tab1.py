@@ -10,12 +10,32 @@ import dash_core_components as dcc
 from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
 import dash_leaflet as dl
+from dash_extensions.javascript import Namespace, arrow_function
+
+import geometry
 
 # links to add later
 
+# Default range of the year slider, the latest year is selected by default
+START_YEAR = 1998
+END_YEAR = 2019
+
+# Initial zoom of the choropleth map
+MAP_ZOOM = 3
+
 
-def generate_layout():
+def generate_layout(client_charts=False, start_year=START_YEAR, end_year=END_YEAR):
     """Generate tab 1 layout
+
+    Parameters
+    -------
+    Boolean
+        Whether the barplot is drawn in the browser from data kept in a dcc.Store
+    Int
+        First year of the slider
+    Int
+        Last year of the slider, selected by default
+    
     Returns
     -------
     dbc.Container
@@ -23,8 +43,6 @@ def generate_layout():
     """
     
     dropdown_height = 50
-    start_year = 1998
-    end_year = 2019
     year_range = list(range(start_year, end_year+1,3))
     slider_marks = dict(zip(
         year_range,
@@ -32,6 +50,10 @@ def generate_layout():
          ))
     years = [{"label": x, "value": x} for x in range(start_year, end_year)]
     
+    # Province boundaries are loaded once, callbacks only update the layer's hideout
+    ns = Namespace("crimeDashboard", "choropleth")
+    hover_style = dict(weight=5, color='orange', dashArray='')
+    
     return dbc.Container(
         [
             dbc.Row(
@@ -97,7 +119,7 @@ def generate_layout():
                                                 min = start_year, 
                                                 max = end_year,
                                                 step = 1,
-                                                value =2019, 
+                                                value =end_year, 
                                                 dots = True,
                                                 included=False,
                                                 tooltip = {"placement": "top"},
@@ -153,12 +175,33 @@ def generate_layout():
                         dbc.Row(
                             [
                                 html.Div(html.H5("Violation Subcategory by Province")),
+                                html.Div(
+                                    dcc.RadioItems(
+                                        id='map_level',
+                                        options=[
+                                            {'label': 'Province', 'value': 'PROVINCE'},
+                                            {'label': 'CMA', 'value': 'CMA'},
+                                        ],
+                                        value='PROVINCE',
+                                        labelStyle={'margin-left': '10px', 'margin-right': '10px'}
+                                    ),
+                                    style={"width": "100%"}
+                                ),
                                 html.Div(
                                     [
                                         #dcc.Graph(id="choropleth"),
-                                        dl.Map(id="choropleth", 
+                                        dl.Map(
+                                            [
+                                                dl.TileLayer(),
+                                                dl.GeoJSON(id="provinces",
+                                                    url=geometry.geometry_url("provinces", geometry.level_for_zoom(MAP_ZOOM)),
+                                                    options=dict(style=ns("style")),
+                                                    hoverStyle=arrow_function(hover_style)),
+                                                dl.Colorbar(id="colorbar", width=20, height=150, position="bottomleft")
+                                            ],
+                                        id="choropleth", 
                                         center=[62, -98],
-                                        zoom=3,
+                                        zoom=MAP_ZOOM,
                                         style={'width': '550px', 'height': '600px'}),
                                         html.Div(#[dcc.Dropdown(id = "year_select", options = years)],
                                             id="province_info",className="info",
@@ -185,7 +228,7 @@ def generate_layout():
                                     id='cma_barplot',
                                     style={'border-width': '0', 'width': '100%', 'height': '800px'}
                                 )
-                            ]
+                            ] + ([dcc.Store(id='cma_barplot_data')] if client_charts else [])
                         ),
                         width="auto",
                         style={'padding-left': '2%', 'padding-right': '2%'}
@@ -8,15 +8,16 @@ import dash
 import dash_html_components as html
 import dash_core_components as dcc
 from dash.dependencies import Input, Output
-import numpy as np
-import pandas as pd
-import altair as alt
-import datetime
 import dash_bootstrap_components as dbc
 
-def generate_layout():
+def generate_layout(client_charts=False):
     """Generate tab 2 layout
 
+    Parameters
+    -------
+    Boolean
+        Whether the plots are drawn in the browser from data kept in a dcc.Store
+
     Returns
     -------
     dbc.Container
@@ -118,7 +119,7 @@ def generate_layout():
                     id = 'crime_trends_plot',
                     style = {'border-width': '0', 'width': '100%', 'height': '800px'}
                 )
-            ], 
+            ] + ([dcc.Store(id='crime_trends_data')] if client_charts else []), 
             style={'padding-left': '2%'},
             )
         ])
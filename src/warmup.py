@@ -0,0 +1,90 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Background warm-up of the render caches
+
+Right after a deploy every worker has empty caches, so the first users pay the
+full rendering cost for the default dashboard states. `Warmup` renders a list
+of states in a background thread, optionally within a time budget, and reports
+readiness so a health check can hold traffic until it is done.
+"""
+
+import threading
+import time
+import traceback
+
+
+class Warmup:
+    """Run a list of render jobs in a background thread
+
+    Parameters
+    -------
+    jobs : [(callable, tuple)]
+        Functions to call with their arguments, in priority order
+    time_budget : Float
+        Optional number of seconds after which the remaining jobs are skipped
+    """
+
+    def __init__(self, jobs, time_budget=None):
+        self._jobs = list(jobs)
+        self._time_budget = time_budget
+        self._thread = None
+        self._ready = threading.Event()
+        self.completed = 0
+        self.errors = 0
+        self.timed_out = False
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        """Start warming up in a daemon thread, returns immediately"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def run(self):
+        """Render every job in the calling thread until done or out of time"""
+        self.started_at = time.time()
+        deadline = time.monotonic() + self._time_budget if self._time_budget else None
+        try:
+            for func, args in self._jobs:
+                if deadline is not None and time.monotonic() > deadline:
+                    self.timed_out = True
+                    break
+                try:
+                    func(*args)
+                    self.completed += 1
+                except Exception:
+                    self.errors += 1
+                    traceback.print_exc()
+        finally:
+            self.finished_at = time.time()
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """Block until warm-up has finished, returns readiness"""
+        return self._ready.wait(timeout)
+
+    def status(self):
+        """Progress of the warm-up for health checks
+
+        Returns
+        -------
+        dict
+            Readiness, number of jobs done / failed / total and timing
+        """
+        return {
+            "ready": self.ready,
+            "completed": self.completed,
+            "errors": self.errors,
+            "total": len(self._jobs),
+            "timed_out": self.timed_out,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
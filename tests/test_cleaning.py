@@ -0,0 +1,52 @@
+# author: Sasha Babicki, Ifeanyi Anene, and Cal Schafer
+# date: 2021-02-20
+
+"""
+Check that the vectorized `clean_data` gives the same output as the original wrangling
+Usage: python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import crime_data
+from cleaning import legacy_clean_data
+
+
+def raw_rows():
+    """A small raw extract with every case the wrangling handles, without a REF_DATE column"""
+    rows = [
+        ("Ontario [35]", 2019, "Total violent Criminal Code violations [100]", "Actual incidents", 10.0,
+         "PROVINCE", "Total violent Criminal Code violations"),
+        ("Ontario [35]", 2019, "Homicide [110]", "Actual incidents", 2.0, "PROVINCE",
+         "Total violent Criminal Code violations"),
+        ("Ontario [35]", 2019, "Total, all violations [0]", "Actual incidents", 50.0, "PROVINCE",
+         "Total, all violations"),
+        ("Qu?bec, Quebec [24]", 2019, "Homicide [110]", "Rate per 100,000 population", 1.5, "CMA",
+         "Total violent Criminal Code violations"),
+        ("Toronto, Ontario [535]", 2018, "Total property crime violations [200]", "Actual incidents", 7.0,
+         "CMA", "Total property crime violations"),
+        ("Toronto, Ontario [535]", 2018, "Theft [210]", "Actual incidents", np.nan, "CMA",
+         "Total property crime violations"),
+        ("Prince Edward Island", 2018, "Theft [210]", "Actual incidents", 3.0, "CMA",
+         "Total property crime violations"),
+        ("Prince Edward Island", 2019, "Theft [210]", "Actual incidents", 4.0, "PROVINCE",
+         "Total property crime violations"),
+    ]
+    return pd.DataFrame(rows, columns=crime_data.RAW_COLUMNS)
+
+
+def test_clean_data_matches_legacy_wrangling():
+    pd.options.mode.chained_assignment = None
+    expected = legacy_clean_data(raw_rows())
+    result = crime_data.clean_data(raw_rows())
+    pd.testing.assert_frame_equal(expected, result)
+    assert len(result) == 6
+    assert "Quebec, Quebec" in set(result["Geography"])